@@ -0,0 +1,293 @@
+import os
+import sys
+import re
+import json
+import shutil
+import difflib
+import hashlib
+import argparse
+import xml.parsers.expat
+
+# --- Constants ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SYSTEMLIST_DIR = os.path.join(BASE_DIR, "share_init", "system", ".emulationstation")
+SYSTEMLIST_FILE = os.path.join(SYSTEMLIST_DIR, "systemlist.xml")
+SYSTEMLIST_VARIANTS = ("systemlist.xml", "systemlist.xml.new", "systemlist.xml.bak")  # Compared by the diff command
+INDEX_CACHE_FILE = os.path.join(BASE_DIR, "systemlist_index.json")  # Parsed indexes keyed by file SHA-1, kept between runs
+INDEX_VERSION = 1
+INDEX_CACHE_SIZE = 8  # Indexes kept in the cache, most recently used last
+CORE_ATTRIBUTES = ("priority", "extensions", "compatibility", "speed", "netplay")
+
+# --- Index ---
+def parse_systemlist(path):
+    """
+    Parse a systemlist.xml in one streaming pass into an index.
+
+    Every descriptor and core element starts on its own line; the index records it so
+    edits can rewrite that line alone.
+
+    Returns:
+        dict: System name -> {"fullname", "extensions", "line", "emulators"}, where emulators maps
+            an emulator name to its cores: core name -> {"line"} plus the CORE_ATTRIBUTES found.
+    """
+    index = {}
+    parser = xml.parsers.expat.ParserCreate()
+    current = {"system": None, "emulator": None}
+
+    def start_element(name, attrs):
+        line = parser.CurrentLineNumber
+        if name == "system":
+            current["system"] = index.setdefault(attrs["name"], {
+                "fullname": attrs.get("fullname", ""), "extensions": [], "line": None, "emulators": {},
+            })
+        elif name == "descriptor" and current["system"] is not None:
+            current["system"]["extensions"] = attrs.get("extensions", "").split()
+            current["system"]["line"] = line
+        elif name == "emulator" and current["system"] is not None:
+            current["emulator"] = current["system"]["emulators"].setdefault(attrs["name"], {})
+        elif name == "core" and current["emulator"] is not None:
+            core = {"line": line}
+            for attribute in CORE_ATTRIBUTES:
+                if attribute in attrs:
+                    core[attribute] = attrs[attribute].split() if attribute == "extensions" else attrs[attribute]
+            current["emulator"][attrs["name"]] = core
+
+    def end_element(name):
+        if name == "system":
+            current["system"] = None
+        elif name == "emulator":
+            current["emulator"] = None
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    with open(path, "rb") as f:
+        parser.ParseFile(f)
+    return index
+
+def load_index(path):
+    """Return the index of a systemlist file, from INDEX_CACHE_FILE when this version of the file was parsed before."""
+    with open(path, "rb") as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    try:
+        with open(INDEX_CACHE_FILE, encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache.get("version") != INDEX_VERSION:
+            cache = {}
+    except (IOError, ValueError):
+        cache = {}
+    indexes = cache.get("indexes", {})
+    if sha1 in indexes and list(indexes)[-1] == sha1:
+        return indexes[sha1]
+    index = indexes.pop(sha1, None) or parse_systemlist(path)
+    indexes[sha1] = index
+    while len(indexes) > INDEX_CACHE_SIZE:
+        indexes.pop(next(iter(indexes)))
+    # Write next to the cache and rename, so an interrupted run never leaves a truncated cache
+    temp_path = f"{INDEX_CACHE_FILE}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": INDEX_VERSION, "indexes": indexes}, f)
+    os.replace(temp_path, INDEX_CACHE_FILE)
+    return index
+
+def get_system(index, system_name):
+    """Return a system of the index or exit with the known names."""
+    if system_name not in index:
+        sys.exit(f"[ERROR] Unknown system {system_name}; known systems: {', '.join(sorted(index))}")
+    return index[system_name]
+
+def cores_by_priority(system):
+    """Return (emulator, core name, core) tuples of a system, highest priority (lowest number) first."""
+    cores = [
+        (emulator, core_name, core)
+        for emulator, emulator_cores in system["emulators"].items()
+        for core_name, core in emulator_cores.items()
+    ]
+    return sorted(cores, key=lambda c: (int(c[2].get("priority", 0) or 0), c[0], c[1]))
+
+def cores_for_extension(system, extension):
+    """Return the cores of a system that can launch files with this extension, highest priority first."""
+    extension = extension if extension.startswith(".") else f".{extension}"
+    if extension not in system["extensions"]:
+        return []
+    return [c for c in cores_by_priority(system) if extension in c[2].get("extensions", system["extensions"])]
+
+# --- Edits ---
+def parse_edit(text):
+    """
+    Split an edit argument, "system=value" or "system/emulator/core=value", into its target and value.
+
+    Returns:
+        tuple: (system, emulator or None, core or None, value).
+    """
+    target, separator, value = text.partition("=")
+    parts = target.split("/")
+    if separator and len(parts) == 3:
+        return parts[0], parts[1], parts[2], value
+    if separator and len(parts) == 1:
+        return parts[0], None, None, value
+    sys.exit(f"[ERROR] Expected system[/emulator/core]=value, got {text}")
+
+def set_attribute(line, name, value):
+    """Replace (or append) one attribute of the element starting on a line, leaving the rest of the line untouched."""
+    pattern = re.compile(rf'(\s{re.escape(name)}=")[^"]*(")')
+    if pattern.search(line):
+        return pattern.sub(lambda m: f"{m.group(1)}{value}{m.group(2)}", line, count=1)
+    return re.sub(r"(\s*/?>)", rf' {name}="{value}"\1', line, count=1)
+
+def plan_edits(index, priorities=(), add_extensions=(), remove_extensions=()):
+    """
+    Turn a batch of edits into attribute changes per line.
+
+    Args:
+        index (dict): The index of the edited file.
+        priorities (iterable): "system/emulator/core=N" arguments.
+        add_extensions (iterable): "system[/emulator/core]=.ext" arguments; without a core the descriptor is edited.
+        remove_extensions (iterable): Same as add_extensions.
+
+    Returns:
+        dict: Line number -> {attribute: new value}.
+    """
+    changes = {}
+
+    def target(system_name, emulator, core_name):
+        system = get_system(index, system_name)
+        if emulator is None:
+            return system["line"], system["extensions"]
+        core = system["emulators"].get(emulator, {}).get(core_name)
+        if core is None:
+            sys.exit(f"[ERROR] {system_name} has no core {emulator}/{core_name}")
+        return core["line"], core.get("extensions", [])
+
+    for text in priorities:
+        system_name, emulator, core_name, value = parse_edit(text)
+        if emulator is None or not value.isdigit():
+            sys.exit(f"[ERROR] Expected system/emulator/core=N, got {text}")
+        line, _ = target(system_name, emulator, core_name)
+        changes.setdefault(line, {})["priority"] = value
+
+    extension_edits = [(text, True) for text in add_extensions] + [(text, False) for text in remove_extensions]
+    for text, add in extension_edits:
+        system_name, emulator, core_name, extension = parse_edit(text)
+        extension = extension if extension.startswith(".") else f".{extension}"
+        line, current = target(system_name, emulator, core_name)
+        extensions = changes.setdefault(line, {}).get("extensions", " ".join(current)).split()
+        if add and extension not in extensions:
+            extensions.insert(0, extension)
+        elif not add and extension in extensions:
+            extensions.remove(extension)
+        changes[line]["extensions"] = " ".join(extensions)
+    return changes
+
+def apply_edits(path, changes):
+    """Return the original and edited lines of a file; only the lines holding changed elements differ."""
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    edited = list(lines)
+    for line_number, attributes in changes.items():
+        for name, value in attributes.items():
+            edited[line_number - 1] = set_attribute(edited[line_number - 1], name, value)
+    return lines, edited
+
+# --- Three-Way Diff ---
+def flatten_index(index):
+    """Map every (system, element, attribute) of an index to its value, for comparing files."""
+    values = {}
+    for system_name, system in index.items():
+        values[(system_name, "descriptor", "extensions")] = " ".join(system["extensions"])
+        for emulator, cores in system["emulators"].items():
+            for core_name, core in cores.items():
+                for attribute in CORE_ATTRIBUTES:
+                    if attribute in core:
+                        value = core[attribute]
+                        values[(system_name, f"{emulator}/{core_name}", attribute)] = " ".join(value) if isinstance(value, list) else value
+    return values
+
+def describe_difference(attribute, base, other):
+    """Describe a value relative to the base one; extension lists are shown as added and removed entries."""
+    if other is None:
+        return "(missing)"
+    if base is None or attribute != "extensions":
+        return other
+    added = [e for e in other.split() if e not in base.split()]
+    removed = [e for e in base.split() if e not in other.split()]
+    return " ".join([f"+{e}" for e in added] + [f"-{e}" for e in removed]) or "(reordered)"
+
+def diff_systemlists(paths):
+    """
+    Compare several systemlist files element by element and print every attribute that differs.
+
+    The first file is the base; the others are shown relative to it.
+    """
+    indexes = [flatten_index(load_index(path)) for path in paths]
+    names = [os.path.basename(path) for path in paths]
+    differences = 0
+    for key in sorted(set().union(*indexes)):
+        values = [index.get(key) for index in indexes]
+        if len(set(values)) == 1:
+            continue
+        differences += 1
+        system_name, element, attribute = key
+        print(f"{system_name} {element} {attribute}:")
+        print(f"  {names[0]}: {values[0] if values[0] is not None else '(missing)'}")
+        for name, value in zip(names[1:], values[1:]):
+            print(f"  {name}: {'(same)' if value == values[0] else describe_difference(attribute, values[0], value)}")
+    print(f"[INFO] {differences} differences between {', '.join(names)}")
+
+# --- Main Execution ---
+def main():
+    parser = argparse.ArgumentParser(description="Query, edit and compare Recalbox systemlist.xml files.")
+    parser.add_argument("--file", default=SYSTEMLIST_FILE, help="The systemlist file to query or edit (default: share_init/system/.emulationstation/systemlist.xml)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("systems", help="List the systems with their extensions")
+    show = commands.add_parser("show", help="Show a system's extensions and cores by priority")
+    show.add_argument("system")
+    which = commands.add_parser("which", help="Show which cores launch an extension on a system, by priority")
+    which.add_argument("system")
+    which.add_argument("extension")
+    edit = commands.add_parser("edit", help="Apply a batch of edits, changing only the edited lines")
+    edit.add_argument("--priority", action="append", default=[], metavar="SYSTEM/EMULATOR/CORE=N", help="Set a core's priority")
+    edit.add_argument("--add-extension", action="append", default=[], metavar="SYSTEM[/EMULATOR/CORE]=.EXT",
+                      help="Add an extension to a system's descriptor or to a core")
+    edit.add_argument("--remove-extension", action="append", default=[], metavar="SYSTEM[/EMULATOR/CORE]=.EXT",
+                      help="Remove an extension from a system's descriptor or from a core")
+    edit.add_argument("--dry-run", action="store_true", help="Print the diff without writing the file")
+    diff = commands.add_parser("diff", help="Compare systemlist files attribute by attribute (default: .xml, .new and .bak)")
+    diff.add_argument("files", nargs="*")
+    args = parser.parse_args()
+
+    if args.command == "diff":
+        diff_systemlists(args.files or [os.path.join(SYSTEMLIST_DIR, name) for name in SYSTEMLIST_VARIANTS])
+        return
+
+    index = load_index(args.file)
+    if args.command == "systems":
+        for system_name, system in sorted(index.items()):
+            print(f"{system_name:<20} {system['fullname']:<40} {' '.join(system['extensions'])}")
+    elif args.command == "show":
+        system = get_system(index, args.system)
+        print(f"{args.system} ({system['fullname']}): {' '.join(system['extensions'])}")
+        for emulator, core_name, core in cores_by_priority(system):
+            print(f"  {core.get('priority', '-'):>3}  {emulator}/{core_name:<24} compatibility={core.get('compatibility', '-')} "
+                  f"speed={core.get('speed', '-')}  {' '.join(core.get('extensions', []))}")
+    elif args.command == "which":
+        cores = cores_for_extension(get_system(index, args.system), args.extension)
+        if not cores:
+            print(f"[INFO] No core of {args.system} launches {args.extension}")
+        for emulator, core_name, core in cores:
+            print(f"  {core.get('priority', '-'):>3}  {emulator}/{core_name}  compatibility={core.get('compatibility', '-')} speed={core.get('speed', '-')}")
+    elif args.command == "edit":
+        changes = plan_edits(index, args.priority, args.add_extension, args.remove_extension)
+        lines, edited = apply_edits(args.file, changes)
+        sys.stdout.writelines(difflib.unified_diff(lines, edited, args.file, f"{args.file} (edited)"))
+        if edited == lines:
+            print("[INFO] Nothing to change.")
+        elif not args.dry_run:
+            temp_path = f"{args.file}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.writelines(edited)
+            shutil.copymode(args.file, temp_path)
+            os.replace(temp_path, args.file)
+            print(f"[INFO] Updated {sum(a != b for a, b in zip(lines, edited))} lines of {args.file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import struct
+import random
+import hashlib
+import argparse
+import resource
+import subprocess
+
+# --- Constants ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SIZES = "10,100,1000,5000"
+DEFAULT_WORK_DIR = os.path.join(BASE_DIR, "bench")
+OUTPUT_DIRS = ["expand", "staging", "db", "roms", "config"]  # Measured for bytes written per phase
+BUILD_SCRIPT = os.path.join(BASE_DIR, "whdload4uae4arm.py")
+CHECK_GAMES = 60  # Size of the library built by --check
+CHECK_TIMEOUT = 600  # Seconds before a --check build is considered hung
+WHDLF_REQAGA = 0x20  # ws_Flags bit of WHDLoad slaves that need the AGA chipset
+# WHDLoad slave header after ws_Security and ws_ID: ws_Version up to ws_config (version 17)
+WHDLOAD_HEADER_FORMAT = ">HHIIHHHBBIHHHHIHH"
+WHDLOAD_HEADER_SIZE = 4 + 8 + struct.calcsize(WHDLOAD_HEADER_FORMAT)  # 0x34; strings follow the header
+
+# --- Synthetic LHA Archives ---
+def crc16(data):
+    """CRC-16/ARC as used by LHA headers."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+def write_lha(archive_path, files):
+    """
+    Write an LHA archive with level 0 headers and stored (-lh0-) members.
+
+    Args:
+        archive_path (str): The archive to create.
+        files (list): (name, bytes) pairs; names use '/' between directories.
+    """
+    # MS-DOS timestamp for 2000-01-01 00:00
+    dos_time = ((2000 - 1980) << 25) | (1 << 21) | (1 << 16)
+    with open(archive_path, "wb") as f:
+        for name, data in files:
+            encoded_name = name.encode("latin-1")
+            header = b"-lh0-" + struct.pack("<IIIBBB", len(data), len(data), dos_time, 0x20, 0, len(encoded_name))
+            header += encoded_name + struct.pack("<H", crc16(data))
+            f.write(struct.pack("<BB", len(header), sum(header) & 0xFF))
+            f.write(header)
+            f.write(data)
+        f.write(b"\0")  # End of archive
+
+def make_slave(name, aga=False, kick_name=None):
+    """
+    Build a minimal WHDLoad slave: an Amiga hunk executable whose code starts with a slave header.
+
+    Args:
+        name (str): The game name stored in ws_name.
+        aga (bool): Set the ReqAGA flag.
+        kick_name (str, optional): A kickstart file name stored in ws_kickname.
+    """
+    header_size = WHDLOAD_HEADER_SIZE
+    strings = b""
+    name_offset = header_size + len(strings)
+    strings += name.encode("latin-1") + b"\0"
+    copy_offset = header_size + len(strings)
+    strings += b"2000 Synthetic\0"
+    info_offset = header_size + len(strings)
+    strings += b"Benchmark slave\0"
+    kick_offset = 0
+    if kick_name:
+        kick_offset = header_size + len(strings)
+        strings += kick_name.encode("latin-1") + b"\0"
+
+    code = struct.pack(">I", 0x70FF4E75) + b"WHDLOADS" + struct.pack(
+        WHDLOAD_HEADER_FORMAT,
+        17,                                   # ws_Version
+        WHDLF_REQAGA if aga else 0,           # ws_Flags
+        0x80000,                              # ws_BaseMemSize
+        0,                                    # ws_ExecInstall
+        0,                                    # ws_GameLoader
+        0,                                    # ws_CurrentDir
+        0,                                    # ws_DontCache
+        0,                                    # ws_keydebug
+        0x59,                                 # ws_keyexit (F10)
+        0,                                    # ws_ExpMem
+        name_offset, copy_offset, info_offset,
+        kick_offset,                          # ws_kickname
+        0x40000 if kick_name else 0,          # ws_kicksize
+        0,                                    # ws_kickcrc
+        0,                                    # ws_config
+    )
+    code = code.ljust(header_size, b"\0") + strings
+    code = code.ljust((len(code) + 3) // 4 * 4, b"\0")
+
+    # HUNK_HEADER with one hunk, HUNK_CODE, HUNK_END
+    hunk = struct.pack(">IIIIII", 0x3F3, 0, 1, 0, 0, len(code) // 4)
+    hunk += struct.pack(">II", 0x3E9, len(code) // 4) + code + struct.pack(">I", 0x3F2)
+    return hunk
+
+def read_slave(slave):
+    """
+    Decode the header of a slave built by make_slave, the way scan_slaves reads it.
+
+    Returns:
+        dict: ws_flags and the ws_name, ws_copy, ws_info and ws_kickname strings (None when unset).
+    """
+    code = slave[struct.calcsize(">IIIIII") + 8:]  # Skip HUNK_HEADER and the HUNK_CODE id and size
+    if code[4:12] != b"WHDLOADS":
+        raise ValueError("no WHDLoad slave header")
+    fields = struct.unpack(WHDLOAD_HEADER_FORMAT, code[12:WHDLOAD_HEADER_SIZE])
+
+    def string(offset):
+        return code[offset:code.index(b"\0", offset)].decode("latin-1") if offset else None
+
+    return {"ws_flags": fields[1], "ws_name": string(fields[10]), "ws_copy": string(fields[11]),
+            "ws_info": string(fields[12]), "ws_kickname": string(fields[13])}
+
+def check_make_slave():
+    """Check that the slaves of the synthetic library decode to the names they were built with."""
+    problems = []
+    for name, aga, kick_name in [("Game00000", False, None), ("Game00001", True, "kick40068.A1200")]:
+        header = read_slave(make_slave(name, aga, kick_name))
+        expected = {"ws_flags": WHDLF_REQAGA if aga else 0, "ws_name": name, "ws_copy": "2000 Synthetic",
+                    "ws_info": "Benchmark slave", "ws_kickname": kick_name}
+        if header != expected:
+            problems.append(f"make_slave({name!r}, {aga}, {kick_name!r}) decodes to {header}, expected {expected}")
+    return problems
+
+# --- Synthetic Library ---
+def generate_library(root, games, game_kb=256, seed=1):
+    """
+    Generate a synthetic WHDLoad library: .lha archives, single and multi-disk ADFs,
+    CD32 cue/bin directories and a matching games.csv.
+
+    Args:
+        root (str): The library directory; laid out like the whdload4uae4arm directory.
+        games (int): The total number of games.
+        game_kb (int): The size of the data in each game, in KB.
+        seed (int): Seed for the game mix and contents.
+    """
+    rng = random.Random(seed)
+    for name in ["lha", "adf", "iso", "kickstart"]:
+        os.makedirs(os.path.join(root, name), exist_ok=True)
+    shutil.copytree(os.path.join(BASE_DIR, "system_base"), os.path.join(root, "system_base"), dirs_exist_ok=True)
+    for kick_name in ["kick34005.A500", "kick40068.A1200"]:
+        with open(os.path.join(root, "kickstart", kick_name), "wb") as f:
+            f.write(rng.randbytes(256 * 1024))
+        with open(os.path.join(root, "kickstart", f"{kick_name}.RTB"), "wb") as f:
+            f.write(rng.randbytes(1024))
+
+    rows = []
+    for index in range(games):
+        name = f"Game{index:05d}"
+        kind = rng.choices(["whd", "adf", "adfset", "iso"], weights=[80, 10, 5, 5])[0]
+        aga = rng.random() < 0.3
+        if kind == "whd":
+            archive = f"{name}_v1.0{'_AGA' if aga else ''}.lha"
+            kick_name = rng.choice([None, "34005.a500"] if not aga else [None, "40068.a1200"])
+            files = [(f"{name}/{name}.slave", make_slave(name, aga, f"kick{kick_name.upper()}" if kick_name else None))]
+            files += [(f"{name}/data/file{i}", rng.randbytes(game_kb * 1024 // 4)) for i in range(4)]
+            write_lha(os.path.join(root, "lha", archive), files)
+            whd_config = f"kick={kick_name}" if kick_name else ""
+            rows.append([name, archive, "WHD", "AGA" if aga else "ECS", "UAE4ARM", "",
+                         'aspect_ratio_index="23"; custom_viewport_x="24"', "cpu_type=68040" if rng.random() < 0.1 else "",
+                         whd_config, "Synthetic", ""])
+        elif kind == "adf":
+            archive = f"{name}.adf"
+            with open(os.path.join(root, "adf", archive), "wb") as f:
+                f.write(rng.randbytes(901120))
+            rows.append([name, archive, "ADF", "ECS", "UAE4ARM", "", "", "", "", "Synthetic", ""])
+        elif kind == "adfset":
+            disk_dir = os.path.join(root, "adf", name)
+            os.makedirs(disk_dir, exist_ok=True)
+            for disk in range(1, 4):
+                with open(os.path.join(disk_dir, f"{name} Disk{disk}.adf"), "wb") as f:
+                    f.write(rng.randbytes(901120))
+            rows.append([name, f"{name} Disk1.adf", "ADF", "ECS", "UAE4ARM", "", "", "", "", "Synthetic", ""])
+        else:
+            iso_dir = os.path.join(root, "iso", name)
+            os.makedirs(iso_dir, exist_ok=True)
+            with open(os.path.join(iso_dir, f"{name}.cue"), "w", encoding="utf-8") as f:
+                f.write(f'FILE "{name} (Track 1).bin" BINARY\n  TRACK 01 MODE1/2352\n    INDEX 01 00:00:00\n')
+            with open(os.path.join(iso_dir, f"{name} (Track 1).bin"), "wb") as f:
+                f.write(rng.randbytes(game_kb * 1024 * 8))
+            rows.append([name, f"{name}.cue", "ISO", "CD32", "PUAE", "", "", "", "", "Synthetic", ""])
+
+    with open(os.path.join(root, "games.csv"), "w", newline="", encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Game", "Archive Name", "Format", "Hardware", "Emulator", "P2K Config",
+                         "RetroArch Config", "UAE Config", "WHD Config", "Notes", "Codes"])
+        writer.writerows(rows)
+
+# --- Measurement ---
+def tree_size(root):
+    """Total size in bytes of the files below root."""
+    total = 0
+    for dirpath, dirs, files in os.walk(root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            if not os.path.islink(path):
+                total += os.path.getsize(path)
+    return total
+
+def peak_rss_mb(who):
+    """Peak resident set size in MB of this process or of its waited-for children."""
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024  # bytes on macOS, KB on Linux
+
+def measure(results, phase, root, func, *args):
+    """Run one phase and append its wall time, bytes written and peak RSS to results."""
+    before = sum(tree_size(os.path.join(root, d)) for d in OUTPUT_DIRS)
+    start = time.perf_counter()
+    value = func(*args)
+    elapsed = time.perf_counter() - start
+    after = sum(tree_size(os.path.join(root, d)) for d in OUTPUT_DIRS)
+    results.append({
+        "phase": phase,
+        "seconds": round(elapsed, 3),
+        "bytes_written": max(0, after - before),
+        "peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "children_peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    })
+    return value
+
+def run_phases(root, jobs, stream, pipeline):
+    """
+    Run each build phase on a generated library and return the measurements.
+
+    Runs in its own process per library so peak RSS is not carried over between sizes.
+    """
+    import whdload4uae4arm as build
+
+    results = []
+    builder = build.Builder(root, root, jobs, stream, pipeline)
+    measure(results, "prepare", root, builder.prepare)
+    if pipeline:
+        measure(results, "build_whdload", root, builder.build_whdload)
+    else:
+        # The steps of build_whdload; scan results are collected before placing so each step is timed on its own
+        context, manifest = builder.context, builder.manifest
+        system_base_fingerprint = build.hash_tree(context, manifest, context.system_base_dir)
+        dir_to_archive_map = measure(results, "extract_lha_archives", root, build.extract_lha_archives, context, manifest, jobs, stream)
+        scan_results = measure(results, "run_scan_slaves", root, lambda: list(build.run_scan_slaves(context, manifest, jobs)))
+        measure(results, "process_database", root, build.process_database,
+                context, scan_results, dir_to_archive_map, builder.catalog, manifest, system_base_fingerprint, stream)
+    measure(results, "build_adf", root, builder.build_adf)
+    measure(results, "build_iso", root, builder.build_iso)
+    measure(results, "write_uae_files", root, builder.write_uae_files)
+    measure(results, "write_configs", root, builder.write_configs)
+    measure(results, "write_gamelists", root, builder.write_gamelists)
+    return results
+
+# --- Pipeline Check ---
+def tree_digest(root):
+    """Map each file below root to the SHA-1 of its contents, for comparing two build outputs."""
+    digest = {}
+    for dirpath, dirs, files in os.walk(root):
+        for name in files:
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as f:
+                digest[os.path.relpath(path, root)] = hashlib.sha1(f.read()).hexdigest()
+    return digest
+
+def check_pipeline(root, jobs):
+    """
+    Build a generated library phase by phase and with --pipeline, end to end, and compare the results.
+
+    Each build runs the real script in its own process with a timeout, so a hung pipeline fails the check.
+
+    Returns:
+        list: Problems found; empty if both builds finished and produced the same roms/ and config/.
+    """
+    problems = []
+    outputs = {}
+    for mode in ["phased", "pipeline"]:
+        output_dir = os.path.join(root, f"output_{mode}")
+        command = [sys.executable, BUILD_SCRIPT, "--input", root, "--output", output_dir, "--jobs", str(jobs)]
+        command += ["--pipeline"] if mode == "pipeline" else []
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=CHECK_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            problems.append(f"the {mode} build did not finish within {CHECK_TIMEOUT} seconds")
+            continue
+        if result.returncode != 0:
+            problems.append(f"the {mode} build failed: {(result.stdout + result.stderr)[-2000:]}")
+            continue
+        outputs[mode] = {d: tree_digest(os.path.join(output_dir, d)) for d in ["roms", "config"]}
+    if len(outputs) == 2:
+        for d in ["roms", "config"]:
+            phased, pipelined = outputs["phased"][d], outputs["pipeline"][d]
+            for path in sorted(set(phased) | set(pipelined)):
+                if phased.get(path) != pipelined.get(path):
+                    problems.append(f"{d}/{path} differs between the phased and the pipelined build")
+        if not any(path.endswith(".uae") for path in outputs["pipeline"]["roms"]):
+            problems.append("the pipelined build produced no .uae files")
+    return problems
+
+def print_table(report):
+    """Print the measurements of all library sizes as a table."""
+    print(f"{'games':>6}  {'phase':<26} {'seconds':>9} {'MB written':>11} {'peak RSS MB':>12} {'child RSS MB':>13}")
+    for size, results in report["sizes"].items():
+        for row in results:
+            print(f"{size:>6}  {row['phase']:<26} {row['seconds']:>9.3f} {row['bytes_written'] / (1024 * 1024):>11.1f} "
+                  f"{row['peak_rss_mb']:>12.1f} {row['children_peak_rss_mb']:>13.1f}")
+        total = sum(row["seconds"] for row in results)
+        print(f"{size:>6}  {'total':<26} {total:>9.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the WHDLoad build phases on synthetic libraries.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated library sizes in games (default: {DEFAULT_SIZES})")
+    parser.add_argument("--game-kb", type=int, default=256, help="Data size per game in KB (default: 256)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="Passed to the build phases (default: CPU count)")
+    parser.add_argument("--stream", action="store_true", help="Benchmark the --stream build")
+    parser.add_argument("--pipeline", action="store_true", help="Benchmark the --pipeline build")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help="Where the synthetic libraries are generated")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated libraries and outputs")
+    parser.add_argument("--output", "-o", default="benchmark.json", help="JSON report path (default: benchmark.json)")
+    parser.add_argument("--check", action="store_true", help=f"Instead of benchmarking, check that generated slaves decode correctly, build a "
+                        f"{CHECK_GAMES} game library phase by phase and with --pipeline and check that both finish with the same outputs")
+    parser.add_argument("--run-phases", metavar="LIBRARY", help=argparse.SUPPRESS)  # Internal: measure one library
+    args = parser.parse_args()
+
+    if args.run_phases:
+        json.dump(run_phases(args.run_phases, args.jobs, args.stream, args.pipeline), sys.stdout)
+        return
+
+    if not shutil.which("lha"):
+        sys.exit("[ERROR] lha not found in PATH")
+    tools_dir = os.path.join(BASE_DIR, "amiga68ktools")
+    if not os.path.exists(os.path.join(tools_dir, "tools", "scan_slaves.py")):
+        sys.exit(f"[ERROR] amiga68ktools not found at {tools_dir} (git submodule update --init)")
+
+    if args.check:
+        root = os.path.join(args.work_dir, "check")
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        print(f"[INFO] Generating a library of {CHECK_GAMES} games in {root}...")
+        generate_library(root, CHECK_GAMES, game_kb=16)
+        problems = check_make_slave() + check_pipeline(root, args.jobs)
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        if not args.keep:
+            shutil.rmtree(root)
+        if problems:
+            sys.exit(1)
+        print("[INFO] The pipelined build matches the phased build.")
+        return
+
+    report = {"jobs": args.jobs, "stream": args.stream, "pipeline": args.pipeline, "game_kb": args.game_kb, "sizes": {}}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        root = os.path.join(args.work_dir, f"library_{size}")
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        print(f"[INFO] Generating a library of {size} games in {root}...")
+        generate_library(root, size, args.game_kb)
+
+        print(f"[INFO] Running the build phases on {size} games...")
+        command = [sys.executable, os.path.abspath(__file__), "--run-phases", root, "--jobs", str(args.jobs)]
+        command += ["--stream"] if args.stream else []
+        command += ["--pipeline"] if args.pipeline else []
+        result = subprocess.run(command, cwd=root, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stdout[-2000:] + result.stderr[-2000:])
+            sys.exit(f"[ERROR] Benchmark of {size} games failed")
+        # The phases print their own progress before the JSON measurements on the last line
+        report["sizes"][size] = json.loads(result.stdout.strip().splitlines()[-1])
+
+        if not args.keep:
+            shutil.rmtree(root)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print_table(report)
+    print(f"[INFO] Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
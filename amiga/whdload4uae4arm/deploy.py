@@ -0,0 +1,455 @@
+import os
+import sys
+import json
+import shlex
+import base64
+import shutil
+import hashlib
+import argparse
+import tempfile
+import subprocess
+
+from whdload4uae4arm import BuildContext, hash_file
+
+# --- Constants ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROMS_DIR = os.path.join(BASE_DIR, "roms")
+CONFIG_DIR = os.path.join(BASE_DIR, "config")
+CONFIG_MASTER_DIR = os.path.join(BASE_DIR, "config_master")
+DEPLOY_CACHE_FILE = os.path.join(BASE_DIR, "deploy_cache.json")  # Local file hashes, keyed by size and mtime
+RECALBOX_HOST = "root@recalbox.local"
+SHARE_DIR = "/recalbox/share"
+REMOTE_MANIFEST = "system/.whdload4uae4arm_deploy.json"  # Relative to the share
+RETROARCH_CONFIG = "system/.config/retroarch/config"
+DEPLOY_MANIFEST_VERSION = 1
+AGENT_SCRIPT = os.path.join(BASE_DIR, "recalbox_agent.py")  # Sent to the Recalbox when a deploy starts
+AGENT_BATCH_BYTES = 8 * 1024 * 1024  # File data sent to the agent per round-trip
+
+# Local trees and where they land on the share; later entries win when paths collide
+DEPLOY_ROOTS = [
+    ("roms", ROMS_DIR, "roms"),
+    ("config", CONFIG_DIR, RETROARCH_CONFIG),
+    ("config", CONFIG_MASTER_DIR, RETROARCH_CONFIG),
+]
+IGNORED_NAMES = (".DS_Store",)
+IGNORED_SUFFIXES = (".partial",)  # Files and game directories an interrupted build was still writing
+SSH_OPTIONS = [
+    # Share one connection between the manifest read, the rsync and the remote script
+    "-o", "ControlMaster=auto",
+    "-o", "ControlPath=~/.ssh/whdload4uae4arm-%r@%h:%p",
+    "-o", "ControlPersist=60",
+]
+
+# --- Deploy Selection ---
+def in_scope(option, remote_path):
+    """Check whether a share-relative path belongs to a deploy option (all, uae or config)."""
+    if option == "all":
+        return True
+    if option == "uae":
+        return remote_path.startswith("roms/") and remote_path.endswith((".uae", ".uae.p2k.cfg", "/gamelist.xml"))
+    return remote_path.startswith(f"{RETROARCH_CONFIG}/")
+
+def build_local_manifest(option, cache):
+    """
+    Hash the files that a deploy option would place on the share.
+
+    Args:
+        option (str): The deploy option (all, uae or config).
+        cache (dict): The local hash cache, in the build manifest's "files" format.
+
+    Returns:
+        dict: Share-relative path -> (local path, SHA-1).
+    """
+    context = BuildContext(output_dir=BASE_DIR)  # Cache keys are relative to the deployed outputs
+    local_files = {}
+    for kind, local_root, remote_root in DEPLOY_ROOTS:
+        if not os.path.isdir(local_root) or option != "all" and (kind == "config") != (option == "config"):
+            continue
+        for root, dirs, files in os.walk(local_root):
+            dirs[:] = sorted(d for d in dirs if not d.endswith(IGNORED_SUFFIXES))
+            for name in sorted(files):
+                if name.startswith("._") or name in IGNORED_NAMES or name.endswith(IGNORED_SUFFIXES):
+                    continue
+                local_path = os.path.join(root, name)
+                remote_path = f"{remote_root}/{os.path.relpath(local_path, local_root).replace(os.sep, '/')}"
+                if in_scope(option, remote_path):
+                    local_files[remote_path] = (local_path, hash_file(context, cache, local_path))
+    return local_files
+
+def plan_deploy(option, local_files, remote_files, dedup=False):
+    """
+    Diff the local files against the remote manifest.
+
+    Args:
+        option (str): The deploy option; only remote files in its scope can become orphans.
+        local_files (dict): Share-relative path -> (local path, SHA-1).
+        remote_files (dict): Share-relative path -> SHA-1 of what was deployed last time.
+        dedup (bool): Hardlink files whose content already exists on the share instead of sending them again.
+
+    Returns:
+        tuple: (files to send as (local path, share path), hardlinks as (existing share path, new share path),
+            share paths to delete)
+    """
+    transfers, links = [], []
+    deleted = sorted(p for p in remote_files if p not in local_files and in_scope(option, p))
+
+    # Content already on the share that stays untouched by this deploy can be linked to
+    available = {}
+    if dedup:
+        for path, sha1 in sorted(remote_files.items()):
+            if local_files.get(path, (None, None))[1] == sha1:
+                available.setdefault(sha1, path)
+
+    for path, (local_path, sha1) in sorted(local_files.items()):
+        if remote_files.get(path) == sha1:
+            continue
+        if dedup and sha1 in available:
+            links.append((available[sha1], path))
+        else:
+            transfers.append((local_path, path))
+            if dedup:
+                available.setdefault(sha1, path)
+    return transfers, links, deleted
+
+# --- Shares ---
+class LocalShare:
+    """A local directory standing in for the Recalbox share, so deploys can be tested without a Recalbox."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def read_manifest(self):
+        """Return the manifest of the previous deploy, or None if there was none."""
+        path = os.path.join(self.root, REMOTE_MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def checksums(self, paths):
+        """Return the SHA-1 of those of the share-relative paths that exist on the share."""
+        sha1s = {}
+        for path in paths:
+            full_path = os.path.join(self.root, path)
+            if os.path.isfile(full_path):
+                with open(full_path, "rb") as f:
+                    sha1s[path] = hashlib.sha1(f.read()).hexdigest()
+        return sha1s
+
+    def send(self, transfers):
+        """Copy the changed files onto the share."""
+        for local_path, remote_path in transfers:
+            dest = os.path.join(self.root, remote_path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.lexists(dest):
+                os.remove(dest)
+            shutil.copy2(local_path, dest)
+
+    def apply(self, links, deleted, manifest):
+        """Create the hardlinks, delete the orphans and store the new manifest."""
+        for existing, new in links:
+            dest = os.path.join(self.root, new)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.lexists(dest):
+                os.remove(dest)
+            os.link(os.path.join(self.root, existing), dest)
+        for path in deleted:
+            full_path = os.path.join(self.root, path)
+            if os.path.lexists(full_path):
+                os.remove(full_path)
+        for directory in emptied_dirs(deleted):
+            try:
+                os.rmdir(os.path.join(self.root, directory))
+            except OSError:
+                pass
+        manifest_path = os.path.join(self.root, REMOTE_MANIFEST)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+def rsync_transfers(transfers, host, share_dir):
+    """Send files to the share with a single rsync over the shared SSH connection."""
+    if not transfers:
+        return
+    # Mirror the share layout with symlinks so one file list covers roms/ and config/
+    with tempfile.TemporaryDirectory() as mirror:
+        for local_path, remote_path in transfers:
+            link_path = os.path.join(mirror, remote_path)
+            os.makedirs(os.path.dirname(link_path), exist_ok=True)
+            os.symlink(local_path, link_path)
+        # --no-perms and --omit-dir-times keep the mirror's directories from altering the share's
+        subprocess.run([
+            "rsync", "-a", "--copy-links", "--no-owner", "--no-group", "--no-perms", "--omit-dir-times",
+            "-e", shlex.join(["ssh", *SSH_OPTIONS]),
+            f"{mirror}/", f"{host}:{share_dir}/"
+        ], check=True)
+
+class SshShare:
+    """The share of a Recalbox reached over one multiplexed SSH connection."""
+
+    def __init__(self, host=RECALBOX_HOST, share_dir=SHARE_DIR):
+        self.host = host
+        self.share_dir = share_dir
+
+    def ssh(self, command, **kwargs):
+        """Run a command on the Recalbox."""
+        return subprocess.run(["ssh", *SSH_OPTIONS, self.host, command], **kwargs)
+
+    def read_manifest(self):
+        """Return the manifest of the previous deploy, or None if there was none."""
+        path = shlex.quote(f"{self.share_dir}/{REMOTE_MANIFEST}")
+        result = self.ssh(f"test -f {path} && cat {path}", capture_output=True, text=True)
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+        return json.loads(result.stdout)
+
+    def checksums(self, paths):
+        """Return the SHA-1 of those of the share-relative paths that exist on the share, with one remote sha1sum loop."""
+        lines = [f"cd {shlex.quote(self.share_dir)}",
+                 'while IFS= read -r path; do [ -f "$path" ] && sha1sum "$path"; done <<\'WHDLOAD_PATHS_EOF\'',
+                 *paths, "WHDLOAD_PATHS_EOF"]
+        result = self.ssh("sh -s", input="\n".join(lines) + "\n", capture_output=True, text=True)
+        sha1s = {}
+        for line in result.stdout.splitlines():
+            sha1, _, path = line.partition("  ")
+            sha1s[path] = sha1
+        return sha1s
+
+    def send(self, transfers):
+        """Send all changed files with a single rsync over the shared connection."""
+        rsync_transfers(transfers, self.host, self.share_dir)
+
+    def apply(self, links, deleted, manifest):
+        """Create the hardlinks, delete the orphans and store the new manifest in one remote script."""
+        share = shlex.quote(self.share_dir)
+        lines = ["set -e", f"cd {share}"]
+        for existing, new in links:
+            lines.append(f"mkdir -p {shlex.quote(os.path.dirname(new))} && ln -f {shlex.quote(existing)} {shlex.quote(new)}")
+        for path in deleted:
+            lines.append(f"rm -f {shlex.quote(path)}")
+        for directory in emptied_dirs(deleted):
+            lines.append(f"rmdir {shlex.quote(directory)} 2>/dev/null || true")
+        manifest_path = shlex.quote(REMOTE_MANIFEST)
+        lines.append(f"mkdir -p {shlex.quote(os.path.dirname(REMOTE_MANIFEST))}")
+        lines.append(f"cat > {manifest_path}.tmp <<'WHDLOAD_MANIFEST_EOF'")
+        lines.append(json.dumps(manifest))
+        lines.append("WHDLOAD_MANIFEST_EOF")
+        lines.append(f"mv {manifest_path}.tmp {manifest_path}")
+        self.ssh("sh -s", input="\n".join(lines) + "\n", text=True, check=True)
+
+class AgentError(Exception):
+    """A failed operation reported by recalbox_agent.py, or an agent that stopped answering."""
+
+class AgentShare:
+    """
+    A share reached through recalbox_agent.py, running on the Recalbox or locally.
+
+    Hardlinks, deletes and the new manifest are queued and sent as batches, so a config deploy
+    takes one round-trip after reading the manifest instead of one per step. On the Recalbox,
+    file contents go through rsync over the same multiplexed SSH connection, keeping its delta
+    transfer and compression; a local agent receives them as write operations.
+
+    Args:
+        command (list): How to start the agent.
+        rsync_target (tuple, optional): (host, share directory) to send file contents to with rsync.
+    """
+
+    def __init__(self, command, rsync_target=None):
+        self.rsync_target = rsync_target
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.request_id = 0
+        self.pending = []
+        self.pending_bytes = 0
+
+    @classmethod
+    def local(cls, root):
+        """Start the agent as a local process serving a directory standing in for the share."""
+        return cls([sys.executable, AGENT_SCRIPT, root])
+
+    @classmethod
+    def ssh(cls, host=RECALBOX_HOST, share_dir=SHARE_DIR):
+        """Start the agent on the Recalbox, sending its source ahead of the requests so nothing needs installing."""
+        with open(AGENT_SCRIPT, encoding="ascii") as f:
+            source = f.read()
+        bootstrap = f"import sys; exec(sys.stdin.read({len(source)}))"
+        share = cls(["ssh", *SSH_OPTIONS, host, shlex.join(["python3", "-u", "-c", bootstrap, share_dir])], (host, share_dir))
+        share.process.stdin.write(source)
+        return share
+
+    def request(self, ops):
+        """Send one batch of operations and return their results, raising AgentError on a failure."""
+        self.request_id += 1
+        try:
+            self.process.stdin.write(json.dumps({"id": self.request_id, "ops": ops}) + "\n")
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            raise AgentError("the deploy agent exited")
+        line = self.process.stdout.readline()
+        if not line:
+            raise AgentError("the deploy agent exited")
+        results = json.loads(line)["results"]
+        if results and not results[-1]["ok"]:
+            failed = ops[len(results) - 1]
+            raise AgentError(f"{failed['op']} {failed.get('path', '')} failed: {results[-1]['error']}")
+        return results
+
+    def queue(self, op, size=0):
+        """Add an operation to the next batch, sending the batch once it carries enough file data."""
+        self.pending.append(op)
+        self.pending_bytes += size
+        if self.pending_bytes >= AGENT_BATCH_BYTES:
+            self.flush()
+
+    def flush(self):
+        """Send the queued operations."""
+        if self.pending:
+            ops, self.pending, self.pending_bytes = self.pending, [], 0
+            self.request(ops)
+
+    def close(self):
+        """Stop the agent."""
+        self.process.stdin.close()
+        self.process.wait()
+
+    def read_manifest(self):
+        """Return the manifest of the previous deploy, or None if there was none."""
+        data = self.request([{"op": "read", "path": REMOTE_MANIFEST}])[0]["data"]
+        return json.loads(base64.b64decode(data)) if data is not None else None
+
+    def checksums(self, paths):
+        """Return the SHA-1 of those of the share-relative paths that exist on the share."""
+        sha1s = self.request([{"op": "checksum", "paths": list(paths)}])[0]["sha1s"]
+        return {path: sha1 for path, sha1 in sha1s.items() if sha1}
+
+    def send(self, transfers):
+        """Send the changed files with rsync, or queue them for a local agent in chunks so large files span several batches."""
+        if self.rsync_target:
+            rsync_transfers(transfers, *self.rsync_target)
+            return
+        for local_path, remote_path in transfers:
+            size = os.path.getsize(local_path)
+            sha1 = hashlib.sha1()
+            offset = 0
+            with open(local_path, "rb") as f:
+                while True:
+                    chunk = f.read(AGENT_BATCH_BYTES)
+                    sha1.update(chunk)
+                    op = {"op": "write", "path": remote_path, "offset": offset, "data": base64.b64encode(chunk).decode("ascii")}
+                    offset += len(chunk)
+                    if offset >= size:
+                        op["sha1"] = sha1.hexdigest()  # Last chunk: the agent checks the file and renames it into place
+                    self.queue(op, len(chunk))
+                    if offset >= size:
+                        break
+
+    def apply(self, links, deleted, manifest):
+        """Create the hardlinks, delete the orphans and store the new manifest in the last batch."""
+        for existing, new in links:
+            self.queue({"op": "link", "source": existing, "path": new})
+        for path in deleted:
+            self.queue({"op": "delete", "path": path})
+        for directory in emptied_dirs(deleted):
+            self.queue({"op": "rmdir", "path": directory})
+        data = json.dumps(manifest).encode("utf-8")
+        self.queue({"op": "write", "path": REMOTE_MANIFEST, "data": base64.b64encode(data).decode("ascii"),
+                    "sha1": hashlib.sha1(data).hexdigest()})
+        self.flush()
+
+def emptied_dirs(deleted):
+    """Return the game directories of deleted ROM files, deepest first, as candidates for removal."""
+    directories = set()
+    for path in deleted:
+        parent = os.path.dirname(path)
+        while parent.startswith("roms/") and parent.count("/") >= 2:  # Keep roms/<system> itself
+            directories.add(parent)
+            parent = os.path.dirname(parent)
+    return sorted(directories, key=lambda d: (-d.count("/"), d))
+
+# --- Deploy ---
+def load_deploy_cache():
+    """Load the local hash cache used to avoid rehashing unchanged build outputs."""
+    if os.path.exists(DEPLOY_CACHE_FILE):
+        try:
+            with open(DEPLOY_CACHE_FILE, encoding="utf-8") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            pass
+    return {"files": {}}
+
+def save_deploy_cache(cache):
+    """Write the local hash cache."""
+    with open(f"{DEPLOY_CACHE_FILE}.tmp", "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(f"{DEPLOY_CACHE_FILE}.tmp", DEPLOY_CACHE_FILE)
+
+def deploy(option, share, dedup=False, dry_run=False):
+    """
+    Deploy the build to a share, sending only changed files and deleting only orphans.
+
+    Args:
+        option (str): all (ROMs, UAE and config files), uae (only .uae and .uae.p2k.cfg) or config.
+        share (LocalShare, SshShare or AgentShare): The deploy target.
+        dedup (bool): Recreate identical files as hardlinks on the share.
+        dry_run (bool): Only print what would be done.
+    """
+    cache = load_deploy_cache()
+    local_files = build_local_manifest(option, cache)
+    save_deploy_cache(cache)
+
+    remote_manifest = share.read_manifest()
+    if remote_manifest is None or remote_manifest.get("version") != DEPLOY_MANIFEST_VERSION:
+        # Files already on the share (e.g. copied by hand) are kept when their content matches
+        remote_manifest = {"version": DEPLOY_MANIFEST_VERSION, "files": share.checksums(sorted(local_files))}
+        print(f"[INFO] No deploy manifest on the share, compared {len(remote_manifest['files'])} files already there by content.")
+    remote_files = remote_manifest["files"]
+
+    transfers, links, deleted = plan_deploy(option, local_files, remote_files, dedup)
+    transfer_bytes = sum(os.path.getsize(local_path) for local_path, _ in transfers)
+    print(f"[INFO] {len(transfers)} files to send ({transfer_bytes / (1024 * 1024):.1f} MB), "
+          f"{len(links)} to link, {len(deleted)} to delete, {len(local_files) - len(transfers) - len(links)} unchanged.")
+    if dry_run:
+        for _, remote_path in transfers:
+            print(f"send   {remote_path}")
+        for existing, new in links:
+            print(f"link   {new} -> {existing}")
+        for path in deleted:
+            print(f"delete {path}")
+        return
+
+    # The new manifest keeps entries outside this option's scope untouched
+    new_files = {p: sha1 for p, sha1 in remote_files.items() if not in_scope(option, p)}
+    new_files.update({p: sha1 for p, (_, sha1) in local_files.items()})
+
+    share.send(transfers)
+    share.apply(links, deleted, {"version": DEPLOY_MANIFEST_VERSION, "files": new_files})
+    print("[INFO] Deploy finished.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Deploy the build to the Recalbox, sending only what changed.")
+    parser.add_argument("option", choices=["all", "uae", "config"],
+                        help="all: ROMs, UAE and config files; uae: only UAE files and gamelists; config: only config files")
+    parser.add_argument("--dedup", action="store_true", help="Recreate identical files (system_base, kickstarts) as hardlinks on the share")
+    parser.add_argument("--dry-run", "-n", action="store_true", help="Only print what would be sent, linked and deleted")
+    parser.add_argument("--host", default=RECALBOX_HOST, help=f"SSH destination of the Recalbox (default: {RECALBOX_HOST})")
+    parser.add_argument("--target", help="Deploy into a local directory standing in for the Recalbox share")
+    parser.add_argument("--agent", action="store_true", help="With --target, deploy through a local recalbox_agent.py process as on the Recalbox")
+    parser.add_argument("--rsync", action="store_true", help="Apply links, deletes and the manifest with a shell script instead of the deploy agent "
+                        "(files are sent with rsync either way)")
+    args = parser.parse_args()
+
+    if args.target:
+        share = AgentShare.local(args.target) if args.agent else LocalShare(args.target)
+    else:
+        share = SshShare(args.host) if args.rsync else AgentShare.ssh(args.host)
+    try:
+        deploy(args.option, share, args.dedup, args.dry_run)
+    except (subprocess.CalledProcessError, AgentError) as e:
+        print(f"[ERROR] Deploy failed: {e}")
+        sys.exit(1)
+    finally:
+        if isinstance(share, AgentShare):
+            share.close()
+
+if __name__ == "__main__":
+    main()
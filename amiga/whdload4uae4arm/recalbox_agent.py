@@ -0,0 +1,147 @@
+"""
+Deploy agent running on the Recalbox (or locally, against a directory standing in for the share).
+
+Reads one JSON request per line on stdin and answers each with one JSON line on stdout, so a
+whole batch of operations costs a single round-trip over the deploy's SSH connection.
+
+Request:  {"id": 1, "ops": [{"op": "mkdir", "path": "roms/amiga600/Game"}, ...]}
+Response: {"id": 1, "results": [{"ok": true}, ...]}
+
+Operations run in order and a batch stops at the first failure, whose result carries "error".
+Paths are relative to the share given on the command line and may not leave it.
+
+This file is sent over stdin when the deploy starts the agent, so it only uses the standard
+library and keeps to ASCII.
+"""
+import os
+import sys
+import json
+import base64
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024
+
+class AgentError(Exception):
+    """An operation that cannot be carried out, reported back in its result."""
+
+def sha1_file(path):
+    """Return the SHA-1 of a file, or None if it does not exist."""
+    if not os.path.isfile(path):
+        return None
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+class Agent:
+    """Carries out batches of operations inside one share directory."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def resolve(self, path):
+        """Return the full path of a share-relative path, refusing paths outside the share."""
+        full_path = os.path.normpath(os.path.join(self.root, path))
+        if os.path.isabs(path) or not full_path.startswith(self.root + os.sep):
+            raise AgentError(f"path outside the share: {path}")
+        return full_path
+
+    def op_mkdir(self, op):
+        """Create a directory and its parents."""
+        os.makedirs(self.resolve(op["path"]), exist_ok=True)
+        return {}
+
+    def op_delete(self, op):
+        """Delete a file if it exists."""
+        full_path = self.resolve(op["path"])
+        if os.path.lexists(full_path):
+            os.remove(full_path)
+        return {}
+
+    def op_rmdir(self, op):
+        """Remove a directory if it is empty; a directory still in use is not an error."""
+        try:
+            os.rmdir(self.resolve(op["path"]))
+        except OSError:
+            return {"removed": False}
+        return {"removed": True}
+
+    def op_write(self, op):
+        """
+        Write a file from base64 data, in one or several chunks.
+
+        Chunks go to <path>.partial at their "offset"; the chunk carrying "sha1" checks the
+        complete file and renames it into place, so a file is never seen half-written.
+        """
+        full_path = self.resolve(op["path"])
+        partial_path = f"{full_path}.partial"
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        offset = op.get("offset", 0)
+        with open(partial_path, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.write(base64.b64decode(op.get("data", "")))
+            f.truncate()
+        if "sha1" not in op:
+            return {}
+        sha1 = sha1_file(partial_path)
+        if sha1 != op["sha1"]:
+            os.remove(partial_path)
+            raise AgentError(f"checksum mismatch for {op['path']}: {sha1}")
+        if os.path.lexists(full_path):
+            os.remove(full_path)  # Breaks hardlinks instead of writing through them
+        os.replace(partial_path, full_path)
+        return {}
+
+    def op_link(self, op):
+        """Hardlink an existing file of the share to a new path."""
+        full_path = self.resolve(op["path"])
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if os.path.lexists(full_path):
+            os.remove(full_path)
+        os.link(self.resolve(op["source"]), full_path)
+        return {}
+
+    def op_read(self, op):
+        """Return the base64 content of a file, or None if it does not exist."""
+        full_path = self.resolve(op["path"])
+        if not os.path.isfile(full_path):
+            return {"data": None}
+        with open(full_path, "rb") as f:
+            return {"data": base64.b64encode(f.read()).decode("ascii")}
+
+    def op_checksum(self, op):
+        """Return the SHA-1 of each of the given paths, None for the missing ones."""
+        return {"sha1s": {path: sha1_file(self.resolve(path)) for path in op["paths"]}}
+
+    def run_batch(self, ops):
+        """Carry out the operations of one request in order, stopping at the first failure."""
+        results = []
+        for op in ops:
+            handler = getattr(self, f"op_{op.get('op')}", None)
+            try:
+                if handler is None:
+                    raise AgentError(f"unknown operation {op.get('op')}")
+                result = handler(op)
+                result["ok"] = True
+            except (AgentError, OSError, KeyError, ValueError) as e:
+                results.append({"ok": False, "error": str(e)})
+                break
+            results.append(result)
+        return results
+
+def main():
+    if len(sys.argv) != 2:
+        sys.stderr.write("usage: recalbox_agent.py SHARE_DIR\n")
+        sys.exit(2)
+    agent = Agent(sys.argv[1])
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        response = {"id": request.get("id"), "results": agent.run_batch(request.get("ops", []))}
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main()
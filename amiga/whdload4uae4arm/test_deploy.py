@@ -0,0 +1,47 @@
+import deploy
+
+# --- Deploy Plan ---
+def local(*entries):
+    """Build a local manifest from (share path, SHA-1) pairs; local paths mirror share paths."""
+    return {path: (f"/build/{path}", sha1) for path, sha1 in entries}
+
+def test_plan_deploy_sends_only_changed_files():
+    local_files = local(("roms/amiga600/Game.uae", "new"), ("roms/amiga600/.Game/Game.adf", "same"), ("roms/amiga600/New.uae", "n"))
+    remote_files = {"roms/amiga600/Game.uae": "old", "roms/amiga600/.Game/Game.adf": "same"}
+    transfers, links, deleted = deploy.plan_deploy("all", local_files, remote_files)
+    assert transfers == [("/build/roms/amiga600/Game.uae", "roms/amiga600/Game.uae"),
+                         ("/build/roms/amiga600/New.uae", "roms/amiga600/New.uae")]
+    assert links == [] and deleted == []
+
+def test_plan_deploy_deletes_orphans_in_scope():
+    local_files = local(("roms/amiga600/Game.uae", "a"))
+    remote_files = {
+        "roms/amiga600/Game.uae": "a",
+        "roms/amiga600/Gone.uae": "b",
+        "roms/amiga600/.Gone/Gone.adf": "c",
+        f"{deploy.RETROARCH_CONFIG}/default_emulator/Gone.cfg": "d",
+    }
+    assert deploy.plan_deploy("all", local_files, remote_files)[2] == sorted(p for p in remote_files if "Gone" in p)
+    # A uae deploy only knows the .uae files; game data and RetroArch overrides are left alone
+    assert deploy.plan_deploy("uae", local_files, remote_files)[2] == ["roms/amiga600/Gone.uae"]
+    assert deploy.plan_deploy("config", {}, remote_files)[2] == [f"{deploy.RETROARCH_CONFIG}/default_emulator/Gone.cfg"]
+
+def test_plan_deploy_dedup_links_identical_content():
+    local_files = local(
+        ("roms/amiga600/.Game/system/Base.library", "base"),  # Already deployed
+        ("roms/amiga600/.Other/system/Base.library", "base"),
+        ("roms/amiga600/.New/Kick.rom", "kick"),
+        ("roms/amiga600/.Newer/Kick.rom", "kick"),
+    )
+    remote_files = {"roms/amiga600/.Game/system/Base.library": "base", "roms/amiga600/.Old/Kick.rom": "kick"}
+    transfers, links, deleted = deploy.plan_deploy("all", local_files, remote_files, dedup=True)
+    assert transfers == [("/build/roms/amiga600/.New/Kick.rom", "roms/amiga600/.New/Kick.rom")]
+    assert links == [
+        ("roms/amiga600/.New/Kick.rom", "roms/amiga600/.Newer/Kick.rom"),
+        ("roms/amiga600/.Game/system/Base.library", "roms/amiga600/.Other/system/Base.library"),
+    ]
+    # .Old/Kick.rom is deleted by this deploy, so nothing may be linked to it
+    assert deleted == ["roms/amiga600/.Old/Kick.rom"]
+
+    transfers, links, deleted = deploy.plan_deploy("all", local_files, remote_files)
+    assert len(transfers) == 3 and links == []
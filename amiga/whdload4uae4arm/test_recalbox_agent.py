@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from recalbox_agent import Agent, AgentError
+
+@pytest.fixture
+def agent(tmp_path):
+    os.makedirs(tmp_path / "share")
+    return Agent(str(tmp_path / "share"))
+
+# --- Path Guard ---
+def test_resolve_keeps_paths_inside_the_share(agent):
+    assert agent.resolve("roms/amiga600/Game.uae") == os.path.join(agent.root, "roms", "amiga600", "Game.uae")
+    assert agent.resolve("roms/../system/x.json") == os.path.join(agent.root, "system", "x.json")
+
+@pytest.mark.parametrize("path", [
+    "../outside",
+    "roms/../../outside",
+    "../share2/file",  # A sibling whose name starts with the share's
+    "/etc/passwd",
+    os.path.join("/", "share", "roms"),
+    ".",
+    "",
+])
+def test_resolve_refuses_paths_outside_the_share(agent, path):
+    with pytest.raises(AgentError):
+        agent.resolve(path)
+
+def test_batch_stops_at_a_path_outside_the_share(agent, tmp_path):
+    results = agent.run_batch([
+        {"op": "mkdir", "path": "roms"},
+        {"op": "mkdir", "path": "../escaped"},
+        {"op": "mkdir", "path": "config"},
+    ])
+    assert results[0] == {"ok": True}
+    assert results[1]["ok"] is False and "outside the share" in results[1]["error"]
+    assert len(results) == 2
+    assert not os.path.exists(tmp_path / "escaped")
+    assert not os.path.exists(os.path.join(agent.root, "config"))
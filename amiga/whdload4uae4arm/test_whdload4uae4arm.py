@@ -0,0 +1,195 @@
+import os
+
+import pytest
+
+import whdload4uae4arm as build
+
+# --- Fixtures ---
+GAMES_CSV_HEADER = "Game,Archive Name,Format,Hardware,Emulator,P2K Config,RetroArch Config,UAE Config,WHD Config,Notes,Codes\n"
+GAMES_CSV_ROWS = [
+    "Single Game,Single.adf,ADF,ECS,,,,,,,\n",
+    'Multi Game,Multi-1.adf,ADF,ECS,,,"aspect_ratio_index=""23""",,,,\n',
+    "CD Game,Cdgame.cue,ISO,CD32,,,,,,,\n",
+]
+NON_WHDLOAD_PHASES = ("adf", "iso", "uae", "config", "gamelist")  # WHDLoad games need lha and scan_slaves
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+def write_games_csv(input_dir, rows):
+    write_file(os.path.join(input_dir, "games.csv"), GAMES_CSV_HEADER + "".join(rows))
+
+@pytest.fixture
+def roots(tmp_path):
+    """An input tree with a single-disk ADF game, a multi-disk ADF game and a CD32 game."""
+    input_dir, output_dir = str(tmp_path / "in"), str(tmp_path / "out")
+    write_file(os.path.join(input_dir, "adf", "Single.adf"), "single disk")
+    write_file(os.path.join(input_dir, "adf", "Multi", "Multi-1.adf"), "disk 1")
+    write_file(os.path.join(input_dir, "adf", "Multi", "Multi-2.adf"), "disk 2")
+    write_file(os.path.join(input_dir, "iso", "Cdgame", "Cdgame.cue"), 'FILE "Cdgame.bin" BINARY\n')
+    write_file(os.path.join(input_dir, "iso", "Cdgame", "Cdgame.bin"), "track 1")
+    write_games_csv(input_dir, GAMES_CSV_ROWS)
+    return input_dir, output_dir
+
+def run_build(input_dir, output_dir):
+    builder = build.Builder(input_dir, output_dir)
+    builder.run(NON_WHDLOAD_PHASES)
+    return builder
+
+def snapshot(output_dir):
+    """Map each file of roms/ and config/ to its mtime and contents."""
+    files = {}
+    for top in ("roms", "config"):
+        for dirpath, dirs, names in os.walk(os.path.join(output_dir, top)):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, output_dir)] = (os.stat(path).st_mtime_ns, f.read())
+    return files
+
+# --- Incremental Builds ---
+def test_noop_rebuild_writes_nothing(roots):
+    run_build(*roots)
+    before = snapshot(roots[1])
+    builder = run_build(*roots)
+    assert snapshot(roots[1]) == before
+    assert "config_files_written" not in builder.context.stats.counters
+    assert "staged_files_written" not in builder.context.stats.counters
+    assert builder.context.stats.counters["config_files_unchanged"] > 0
+
+def test_games_csv_edit_regenerates_only_affected_configs(roots):
+    input_dir, output_dir = roots
+    run_build(input_dir, output_dir)
+    before = snapshot(output_dir)
+    write_games_csv(input_dir, ["Single Game,Single.adf,ADF,ECS,,,,cpu_speed=max,,,\n"] + GAMES_CSV_ROWS[1:])
+    builder = run_build(input_dir, output_dir)
+    after = snapshot(output_dir)
+    assert {path for path in after if before.get(path) != after[path]} == {os.path.join("roms", "amiga600", "Single Game.uae")}
+    assert b"cpu_speed=max\n" in after[os.path.join("roms", "amiga600", "Single Game.uae")][1]
+    assert "staged_files_written" not in builder.context.stats.counters
+
+def test_rename_and_delete_remove_stale_outputs(roots):
+    input_dir, output_dir = roots
+    run_build(input_dir, output_dir)
+    os.rename(os.path.join(input_dir, "adf", "Single.adf"), os.path.join(input_dir, "adf", "Solo.adf"))
+    for name in ("Cdgame.cue", "Cdgame.bin"):
+        os.remove(os.path.join(input_dir, "iso", "Cdgame", name))
+    os.rmdir(os.path.join(input_dir, "iso", "Cdgame"))
+    write_games_csv(input_dir, ['Renamed Game,Multi-1.adf,ADF,ECS,,,"aspect_ratio_index=""23""",,,,\n'])
+    builder = run_build(input_dir, output_dir)
+    files = snapshot(output_dir)
+    assert sorted(builder.manifest["outputs"]) == ["adf:Multi", "adf:Solo.adf"]
+    assert os.path.join("roms", "amiga600", "Solo.uae") in files
+    assert os.path.join("roms", "amiga600", ".Solo", "Solo.adf") in files
+    assert os.path.join("config", "default_emulator", "Renamed Game.cfg") in files
+    for stale in ("Single", "Cdgame", "CD Game", "Multi Game"):
+        assert not [path for path in files if stale in path]
+
+# --- Game Catalog ---
+def test_load_game_catalog_parses_overrides(tmp_path):
+    input_dir = str(tmp_path)
+    write_games_csv(input_dir, [
+        "No Archive,,,,,,,,,,\n",
+        'Game,Game.lha,WHD,AGA,PUAE,,"aspect_ratio_index=""23""; custom_viewport_x=""24""",'
+        "cpu_speed=max; chipmem_size=4 fastmem_size=8,kick=40068.a1200,Some notes,ABCD\n",
+        "Old Name,Other.adf,ADF,ECS,,,,,,,\n",
+        "New Name,Other.adf,ADF,ECS,,,,,,,\n",
+    ])
+    catalog = build.load_game_catalog(build.BuildContext(input_dir, input_dir))
+    assert [record.archive_name for record in catalog] == ["Game.lha", "Other.adf"]
+    record = catalog.get("Game.lha")
+    assert (record.game_name, record.format, record.hardware, record.emulator) == ("Game", "WHD", "AGA", "puae")
+    assert (record.notes, record.codes, record.in_csv) == ("Some notes", "ABCD", True)
+    assert record.uae_config == {"cpu_speed": "max", "chipmem_size": "4", "fastmem_size": "8"}
+    assert record.retroarch_config == {"aspect_ratio_index": "23", "custom_viewport_x": "24"}
+    assert record.whd_config == {"kick": "40068.a1200"}
+    assert catalog.get("Other.adf").game_name == "New Name"  # A later row for the same archive wins
+    assert catalog.find("Old Name") == []
+
+def test_catalog_lookup_returns_every_record_sharing_a_name():
+    catalog = build.GameCatalog()
+    whdload = build.GameRecord("Pinball_AGA.lha", game_name="Pinball", in_csv=True)
+    cd32 = build.GameRecord("PF.cue", game_name="Pinball", in_csv=True)
+    catalog.add(whdload)
+    catalog.add(cd32)
+    assert catalog.find("Pinball") == [whdload, cd32]
+    assert catalog.find("Pinball_AGA") == [whdload]
+    assert catalog.find("PF.cue") == [cd32]
+
+    catalog.add_archive("Pinball_AGA.lha", "PinballFantasies")
+    catalog.add_archive("Pinball_AGA_v2.lha", "PinballFantasies")
+    assert [r.archive_name for r in catalog.find("PinballFantasies")] == ["Pinball_AGA.lha", "Pinball_AGA_v2.lha"]
+
+    catalog.add(build.GameRecord("PF.cue", game_name="Pinball CD", in_csv=True))
+    assert catalog.find("Pinball") == [whdload]
+    assert catalog.get("Missing.lha") is build.EMPTY_GAME
+
+# --- UAE Configs ---
+BASELINE_WHDLOAD_AGA = """cpu_type=68020
+chipset=aga
+chipmem_size=4
+fastmem_size=8
+kickstart_rom_file=/recalbox/share/bios/kick40068.A1200
+boot1=dh0
+filesystem2=rw,DH0:GAME:/recalbox/share/roms/amiga1200/.Game/,0
+"""
+BASELINE_ADF_ECS = """cpu_type=68000
+chipset=ecs
+chipmem_size=2
+fastmem_size=8
+kickstart_rom_file=/recalbox/share/bios/kick40063.A600
+boot1=df0
+nr_floppies=4
+floppy0=/recalbox/share/roms/amiga600/.Game/Disk1.adf
+floppy1=/recalbox/share/roms/amiga600/.Game/Disk2.adf
+floppy2=/recalbox/share/roms/amiga600/.Game/Disk3.adf
+floppy3=/recalbox/share/roms/amiga600/.Game/Disk4.adf
+"""
+BASELINE_CD32 = """cpu_type=68020
+chipset=aga
+chipmem_size=2
+fastmem_size=8
+kickstart_rom_file=/recalbox/share/bios/kick40060.CD32
+kickstart_ext_rom_file=/recalbox/share/bios/kick40060.CD32.ext
+use_gui=no
+cdimage0=/recalbox/share/roms/amigacd32/.Game/Game.cue,image
+"""
+
+@pytest.fixture
+def context(tmp_path):
+    return build.BuildContext(str(tmp_path), str(tmp_path))
+
+def test_render_uae_config_matches_baseline(context):
+    assert build.render_uae_config(context, "amiga1200", ".Game", "aga", "whdload") == BASELINE_WHDLOAD_AGA
+    disks = [f"Disk{i}.adf" for i in range(1, 6)]  # Only the first four fit in the drives
+    assert build.render_uae_config(context, "amiga600", ".Game", "ecs", "adf", adf_files=disks) == BASELINE_ADF_ECS
+    assert build.render_uae_config(context, "amigacd32", ".Game", "cd32", "cd32", cue_file="Game.cue") == BASELINE_CD32
+
+def test_render_uae_config_applies_overrides_in_place(context):
+    content = build.render_uae_config(context, "amiga1200", ".Game", "aga", "whdload",
+                                      uae_config_map={"chipmem_size": "8", "cpu_speed": "max"})
+    assert content == BASELINE_WHDLOAD_AGA.replace("chipmem_size=4", "chipmem_size=8") + "cpu_speed=max\n"
+
+def test_render_uae_config_adapts_to_the_emulator(context):
+    overrides = {"rtgmem_size": "8", "jit_enable": "true"}
+    uae4arm = build.render_uae_config(context, "amiga1200", ".Game", "aga", "whdload", uae_config_map=overrides, emulator="uae4arm")
+    assert "rtgmem_size" not in uae4arm and "jit_enable=true\n" in uae4arm
+    amiberry = build.render_uae_config(context, "amiga1200", ".Game", "aga", "whdload", uae_config_map=overrides, emulator="amiberry")
+    assert "rtgmem_size=8\n" in amiberry and "jit_enable" not in amiberry
+    assert "kickstart_rom_file=/recalbox/share/bios/kick31.rom\n" in amiberry
+
+def test_validate_overrides(context):
+    catalog = build.GameCatalog()
+    catalog.add(build.GameRecord("Good.lha", uae_config={"cpu_speed": "max", "boot1": "dh0"}, whd_config={"kick": "34005.a500"}))
+    catalog.add(build.GameRecord("Bad.lha", emulator="uae4arm",
+                                 uae_config={"no_such_setting": "1", "cpu_speed": "warp", "rtgmem_size": "8"},
+                                 whd_config={"kick": "1.3", "slave": "Game.slave"}))
+    assert build.validate_overrides(context, catalog) == [
+        ("Bad.lha", "unknown UAE setting no_such_setting=1"),
+        ("Bad.lha", "invalid value cpu_speed=warp, expected real|max|1-20"),
+        ("Bad.lha", "rtgmem_size is not supported by UAE4ARM and will be left out"),
+        ("Bad.lha", "invalid kickstart 1.3, expected nnnnn.aNNN (e.g. 34005.a500)"),
+        ("Bad.lha", "unknown WHD setting slave=Game.slave"),
+    ]
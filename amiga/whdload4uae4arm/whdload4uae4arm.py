@@ -1,21 +1,67 @@
 import os
+import sys
 import shutil
 import subprocess
 import csv
+import hashlib
+import json
+import re
+import argparse
+import io
+import runpy
+import contextlib
+import functools
+import queue
+import threading
+import time
+import select
+import struct
+import multiprocessing
+from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 # --- Constants ---
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-LHA_DIR = os.path.join(BASE_DIR, "lha")
-EXPAND_DIR = os.path.join(BASE_DIR, "expand")
-DB_DIR = os.path.join(BASE_DIR, "db")
-ROMS_DIR = os.path.join(BASE_DIR, "roms")
-AMIGA600_DIR = os.path.join(ROMS_DIR, "amiga600")
-AMIGA1200_DIR = os.path.join(ROMS_DIR, "amiga1200")
-CD32_DIR = os.path.join(ROMS_DIR, "amigacd32")
-CONFIG_DIR = os.path.join(BASE_DIR, "config")  # New constant for the config directory
 SCAN_SCRIPT = os.path.join(BASE_DIR, "amiga68ktools", "tools", "scan_slaves.py")
-DATABASE_FILE = os.path.join(DB_DIR, "database.csv")
-GAMES_CSV = os.path.join(BASE_DIR, "games.csv")
+UAE_SETTINGS_CSV = os.path.join(BASE_DIR, "uae_settings.csv")  # Which emulators support each .uae parameter
+UAE_EMULATORS = {"amiberry": "Amiberry", "uae4arm": "UAE4ARM", "puae": "PUAE"}  # games.csv Emulator -> uae_settings.csv column
+# How Recalbox launches each emulator: (emulator, core) of systemlist.xml, used for gamelist.xml overrides
+EMULATOR_CORES = {"amiberry": ("amiberry", "amiberry"), "uae4arm": ("libretro", "uae4arm"), "puae": ("libretro", "puae")}
+# Kickstart ROMs under the names an emulator looks for; unlisted ROMs keep their Recalbox BIOS name
+EMULATOR_KICKSTART_NAMES = {
+    "amiberry": {
+        "kick34005.A500": "kick13.rom",
+        "kick37175.A500": "kick20.rom",
+        "kick40068.A1200": "kick31.rom",
+        "kick40060.CD32": "cd32.rom",
+        "kick40060.CD32.ext": "cd32ext.rom",
+    },
+}
+PUAE_MODELS = {"ecs": "A600", "aga": "A1200", "cd32": "CD32"}  # puae_model core option per system type
+UAE_SCHEMA_VERSION = 1
+GAMELIST_INDEX_VERSION = 1
+# Settings written by generate_uae_file that uae_settings.csv does not document
+UAE_GENERATED_SETTINGS = ("boot1", "nr_floppies", "floppy2", "floppy3", "cdimage0")
+WHD_SETTINGS = ("kick",)  # Keys understood in the WHD Config column
+RECALBOX_BIOS_DIR = "/recalbox/share/bios"
+RECALBOX_ROMS_DIR = "/recalbox/share/roms"
+MANIFEST_VERSION = 1
+LINK_MODES = ("copy", "hardlink", "reflink")  # How system_base and kickstart files are materialized per game
+CHDMAN = "chdman"  # MAME tool converting cue/bin sets to compressed CHD images (--chd)
+CHD_EMULATORS = ("puae",)  # Emulators that read CHD images; the default amigacd32 core (UAE4ARM) and Amiberry do not
+# Scan workers are started by a server process instead of forking the build, which may be
+# in the middle of launching lha from an extraction thread (a forked child can inherit its locks)
+SCAN_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+FICLONE = 0x40049409  # Linux ioctl that clones a file's extents (btrfs, XFS)
+BUILD_PHASES = ("whdload", "adf", "iso", "uae", "config", "gamelist")  # Selectable with --only
+DATA_PHASES = ("whdload", "adf", "iso")  # Phases that place game data; uae and config only rewrite config files
+DEPLOY_SCRIPT = os.path.join(BASE_DIR, "deploy.py")
+WATCH_DEBOUNCE = 1.0  # Seconds without further changes before a watch rebuild starts
+WATCH_POLL_INTERVAL = 2.0  # Seconds between scans when inotify is not available
+# inotify event bits (linux/inotify.h)
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x002, 0x004, 0x008
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x040, 0x080, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED, IN_ISDIR = 0x400, 0x800, 0x4000, 0x8000, 0x40000000
 
 # --- Helpers ---
 def clear_dir(path):
@@ -23,219 +69,1328 @@ def clear_dir(path):
         shutil.rmtree(path)
     os.makedirs(path)
 
-def extract_lha_archives():
-    """Extract LHA archives and map expanded directory names to archive filenames."""
+def reflink_file(src, dest):
+    """Clone src to dest sharing the same data blocks; return False if the filesystem cannot do it."""
+    if sys.platform == "darwin":
+        # APFS clones through cp -c
+        return subprocess.run(["cp", "-c", "-p", src, dest], capture_output=True).returncode == 0
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+            fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+        if os.path.exists(dest):
+            os.remove(dest)
+        return False
+    shutil.copystat(src, dest)
+    return True
+
+def copy_file_fast(src, dest):
+    """
+    Copy a file and its metadata inside the kernel, like shutil.copy2.
+
+    Uses copy_file_range where available (which can share blocks or copy server-side) and
+    falls back to shutil.copyfile, which uses sendfile on Linux and fcopyfile on macOS.
+    """
+    copied = False
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src, "rb") as src_file, open(dest, "wb") as dest_file:
+                remaining = os.fstat(src_file.fileno()).st_size
+                while remaining > 0:
+                    sent = os.copy_file_range(src_file.fileno(), dest_file.fileno(), min(remaining, 1 << 30))
+                    if sent == 0:
+                        break
+                    remaining -= sent
+            copied = remaining == 0
+        except OSError:
+            pass  # e.g. EXDEV on older kernels or ENOSYS
+    if not copied:
+        shutil.copyfile(src, dest)
+    shutil.copystat(src, dest)
+
+def link_or_copy(src, dest, link_mode="copy"):
+    """
+    Materialize a shared file as a hardlink, reflink or plain copy.
+
+    Linking falls back to copying when src and dest are on different filesystems
+    or the filesystem does not support it.
+
+    Args:
+        src (str): The source file.
+        dest (str): The destination file.
+        link_mode (str): One of LINK_MODES.
+    """
+    # Never write into an existing destination: it may be a hardlink sharing the source's inode
+    if os.path.lexists(dest):
+        os.remove(dest)
+    if link_mode == "hardlink":
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass
+    elif link_mode == "reflink" and reflink_file(src, dest):
+        return
+    copy_file_fast(src, dest)
+
+# --- Build Statistics ---
+def output_size(paths):
+    """
+    Count the files and bytes below the given files and directories.
+
+    Files with more than one link are shared with system_base or the kickstart directory
+    and counted as files but not as bytes.
+
+    Returns:
+        tuple: (number of files, number of bytes)
+    """
+    file_count, byte_count = 0, 0
+    for path in paths:
+        walked = [(os.path.dirname(path), [], [os.path.basename(path)])] if os.path.isfile(path) else os.walk(path)
+        for root, dirs, files in walked:
+            for name in files:
+                stat = os.lstat(os.path.join(root, name))
+                file_count += 1
+                if stat.st_nlink == 1:
+                    byte_count += stat.st_size
+    return file_count, byte_count
+
+class BuildStats:
+    """
+    Collect timings, output sizes, subprocess durations, cache hits and failures of one build.
+
+    Games are attributed to the phase that was running when they were built. Methods may be
+    called from the extraction threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.current_phase = None
+        self.phases = {}  # Phase name -> seconds
+        self.games = {}  # Output key -> game record
+        self.subprocesses = []
+        self.counters = {}
+        self.failures = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a build phase."""
+        self.current_phase = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+            self.current_phase = None
+
+    def game(self, key):
+        """Return the record of a game output, creating it in the current phase."""
+        with self.lock:
+            if key not in self.games:
+                self.games[key] = {"phase": self.current_phase, "seconds": 0.0, "copied": False, "files": 0, "bytes": 0}
+            return self.games[key]
+
+    def add_game_time(self, key, seconds):
+        self.game(key)["seconds"] += seconds
+
+    def add_output(self, key, paths, copied):
+        """Record the files a game wrote; copied tells whether its hidden directory was rebuilt."""
+        file_count, byte_count = output_size(paths)
+        record = self.game(key)
+        record["copied"] = record["copied"] or copied
+        record["files"] += file_count
+        record["bytes"] += byte_count
+
+    def add_subprocess(self, command, item, seconds, returncode=0):
+        with self.lock:
+            self.subprocesses.append({"command": command, "item": item, "seconds": round(seconds, 4), "returncode": returncode})
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_failure(self, stage, item, error):
+        with self.lock:
+            self.failures.append({"phase": self.current_phase, "stage": stage, "item": item, "error": str(error).strip()})
+
+    def report(self):
+        """Return the build report as a JSON-serializable dict."""
+        games = sorted(self.games.items(), key=lambda item: -item[1]["seconds"])
+        return {
+            "started": self.started,
+            "seconds": round(time.time() - self.started, 3),
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "games": [dict(record, key=key, seconds=round(record["seconds"], 4)) for key, record in games],
+            "subprocesses": self.subprocesses,
+            "counters": dict(sorted(self.counters.items())),
+            "failures": self.failures,
+        }
+
+    def write_report(self, path):
+        """Write the build report as JSON."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=1)
+
+    def print_summary(self, slowest=10):
+        """Print per-phase totals, the slowest games, subprocess totals, cache counters and failures."""
+        print(f"{'phase':<24} {'seconds':>9} {'games':>7} {'copied':>7} {'files':>8} {'MB':>9}")
+        for name, seconds in self.phases.items():
+            games = [g for g in self.games.values() if g["phase"] == name]
+            print(f"{name:<24} {seconds:>9.2f} {len(games):>7} {sum(g['copied'] for g in games):>7} "
+                  f"{sum(g['files'] for g in games):>8} {sum(g['bytes'] for g in games) / (1024 * 1024):>9.1f}")
+
+        games = sorted(self.games.items(), key=lambda item: -item[1]["seconds"])[:slowest]
+        if games:
+            print("Slowest games:")
+            for key, record in games:
+                print(f"  {record['seconds']:>8.3f}s  {record['bytes'] / (1024 * 1024):>8.1f} MB  {key}")
+
+        commands = {}
+        for entry in self.subprocesses:
+            commands.setdefault(entry["command"], []).append(entry["seconds"])
+        for command, durations in sorted(commands.items()):
+            print(f"{command}: {len(durations)} runs, {sum(durations):.2f}s total, {max(durations):.2f}s max")
+        if self.counters:
+            print(", ".join(f"{name}={value}" for name, value in sorted(self.counters.items())))
+        if self.failures:
+            print(f"[ERROR] {len(self.failures)} failures, see the build report")
+
+# --- Build Manifest ---
+def empty_manifest():
+    """Return a manifest describing a build with no outputs."""
+    return {"version": MANIFEST_VERSION, "files": {}, "archives": {}, "outputs": {}}
+
+def load_manifest(context):
+    """Load the build manifest written by the previous run, or an empty one if it is missing or outdated."""
+    if not os.path.exists(context.manifest_file):
+        return empty_manifest()
+    try:
+        with open(context.manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (IOError, ValueError) as e:
+        print(f"[WARN] Ignoring unreadable build manifest {context.manifest_file}: {e}")
+        return empty_manifest()
+    if manifest.get("version") != MANIFEST_VERSION:
+        print("[INFO] Build manifest version changed, rebuilding everything.")
+        return empty_manifest()
+    return manifest
+
+def save_manifest(context, manifest):
+    """Write the build manifest, dropping hash entries for files that no longer exist."""
+    manifest["files"] = {
+        key: entry for key, entry in manifest["files"].items()
+        if os.path.exists(os.path.join(context.output_dir, key))
+    }
+    temp_path = f"{context.manifest_file}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, context.manifest_file)
+    context.journal.clear()
+
+class BuildJournal:
+    """
+    Append-only log of the manifest changes made since the manifest was last saved.
+
+    Every archive extracted and every game placed is appended (and synced) as soon as it is done,
+    so an interrupted build can be resumed with --resume instead of starting over. Saving the
+    manifest empties the journal.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def exists(self):
+        """Check whether an interrupted build left changes that are not in the manifest."""
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def replay(self, manifest):
+        """Apply the journaled changes to a manifest and return how many there were."""
+        count = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    break  # Cut short by the interruption
+                if change["value"] is None:
+                    manifest[change["section"]].pop(change["key"], None)
+                else:
+                    manifest[change["section"]][change["key"]] = change["value"]
+                count += 1
+        return count
+
+    def open(self):
+        """Start a new journal, discarding the changes of an interrupted build that is not resumed."""
+        self.close()
+        self.file = open(self.path, "w", encoding="utf-8")
+
+    def record(self, section, key, value):
+        """Journal that manifest[section][key] became value (None when it was removed)."""
+        if self.file is None:
+            return
+        line = json.dumps({"section": section, "key": key, "value": value}, sort_keys=True)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def clear(self):
+        """Empty the journal once its changes are in the saved manifest."""
+        with self.lock:
+            if self.file is not None:
+                self.file.seek(0)
+                self.file.truncate()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# --- Build Context ---
+class BuildContext:
+    """
+    The input and output paths of one build, with its statistics and journal.
+
+    Every function that reads inputs or writes outputs takes the context of its build, so several
+    builds with different roots can run in one process without sharing state.
+
+    Args:
+        input_dir (str, optional): Root of games.csv and the lha, adf, iso, kickstart and system_base directories (default: BASE_DIR).
+        output_dir (str, optional): Root of everything the build writes, including its manifest and caches (default: BASE_DIR).
+    """
+
+    def __init__(self, input_dir=None, output_dir=None):
+        self.input_dir = os.path.abspath(input_dir or BASE_DIR)
+        self.output_dir = os.path.abspath(output_dir or BASE_DIR)
+
+        self.lha_dir = os.path.join(self.input_dir, "lha")
+        self.adf_dir = os.path.join(self.input_dir, "adf")  # Directory containing .adf files
+        self.iso_dir = os.path.join(self.input_dir, "iso")  # Directory containing subdirectories for CD32 games
+        self.games_csv = os.path.join(self.input_dir, "games.csv")
+        self.system_base_dir = os.path.join(self.input_dir, "system_base")
+        self.kickstart_dir = os.path.join(self.input_dir, "kickstart")
+        self.config_master_dir = os.path.join(self.input_dir, "config_master")  # Deployed as is by deploy.py
+
+        self.expand_dir = os.path.join(self.output_dir, "expand")
+        self.staging_dir = os.path.join(self.output_dir, "staging")  # Streaming mode: full archive contents, next to roms/ so placing a game is a rename
+        self.db_dir = os.path.join(self.output_dir, "db")
+        self.roms_dir = os.path.join(self.output_dir, "roms")
+        self.amiga600_dir = os.path.join(self.roms_dir, "amiga600")
+        self.amiga1200_dir = os.path.join(self.roms_dir, "amiga1200")
+        self.cd32_dir = os.path.join(self.roms_dir, "amigacd32")
+        self.config_dir = os.path.join(self.output_dir, "config")
+        self.database_file = os.path.join(self.db_dir, "database.csv")
+        self.slave_cache_file = os.path.join(self.output_dir, "slave_cache.csv")  # Scan results keyed by slave SHA-1, kept between runs
+        self.manifest_file = os.path.join(self.output_dir, "build_manifest.json")  # Persists between runs for incremental builds
+        self.build_journal_file = os.path.join(self.output_dir, "build_journal.jsonl")  # Manifest changes not saved yet, replayed by --resume
+        self.uae_schema_file = os.path.join(self.output_dir, "uae_schema.json")  # uae_settings.csv compiled by compile_uae_schema
+        self.build_report_file = os.path.join(self.db_dir, "build_report.json")
+        self.gamelist_index_file = os.path.join(self.output_dir, "gamelist_index.json")  # Game metadata written by write_gamelists
+        self.chd_cache_dir = os.path.join(self.output_dir, "chd_cache")  # CD32 images converted by convert_to_chd, keyed by input SHA-1
+
+        self.stats = BuildStats()
+        self.journal = BuildJournal(self.build_journal_file)
+
+def hash_file(context, manifest, path):
+    """
+    Return the SHA-1 of a file, reusing the manifest entry when size and mtime are unchanged.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest holding the file hash cache.
+        path (str): The file to fingerprint.
+    """
+    stat = os.stat(path)
+    key = os.path.relpath(path, context.output_dir)
+    cached = manifest["files"].get(key)
+    if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime_ns:
+        context.stats.count("hash_cache_hits")
+        return cached["sha1"]
+    context.stats.count("hash_cache_misses")
+
+    sha1 = sha1_file(path)
+    manifest["files"][key] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha1": sha1}
+    return sha1
+
+def sha1_file(path):
+    """Return the SHA-1 of a file's contents, always reading it."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_tree(context, manifest, path):
+    """Return a single SHA-1 covering the names and contents of every file below path ('' if missing)."""
+    if not os.path.exists(path):
+        return ""
+    if os.path.isfile(path):
+        return hash_file(context, manifest, path)
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+            digest.update(hash_file(context, manifest, file_path).encode("ascii"))
+    return digest.hexdigest()
+
+def fingerprint(*parts):
+    """Combine JSON-serializable inputs (hashes, override maps, flags) into one SHA-1."""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+def kickstart_fingerprint(context, manifest, kick_name):
+    """Fingerprint the kickstart file and its .RTB companion for a kick_name."""
+    source_file = os.path.join(context.kickstart_dir, f"kick{kick_name.upper()}")
+    return fingerprint(hash_tree(context, manifest, source_file), hash_tree(context, manifest, f"{source_file}.RTB"))
+
+def data_is_current(context, manifest, key, data_fingerprint):
+    """Check whether the hidden game directory recorded for key was built from the same inputs."""
+    entry = manifest["outputs"].get(key)
+    return (
+        entry is not None
+        and entry["data"] == data_fingerprint
+        and os.path.isdir(os.path.join(context.output_dir, entry["dir"]))
+    )
+
+def config_is_current(context, manifest, key, config_fingerprint):
+    """Check whether the generated .uae/.p2k.cfg files recorded for key are up to date."""
+    entry = manifest["outputs"].get(key)
+    return (
+        entry is not None
+        and entry["config"] == config_fingerprint
+        and all(os.path.exists(os.path.join(context.output_dir, p)) for p in entry["files"])
+    )
+
+def remove_output(context, rel_path):
+    """Remove a previously generated file or directory, given relative to the output root."""
+    path = os.path.join(context.output_dir, rel_path)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def record_outputs(context, manifest, key, data_fingerprint, config_fingerprint, dest_dir, files, game=None):
+    """
+    Record what a game produced, removing outputs of the previous build that were not produced again.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest.
+        key (str): The output key, e.g. "whdload:Gods_v2.3.1_0666.lha".
+        data_fingerprint (str): Fingerprint of the inputs of the hidden game directory.
+        config_fingerprint (str): Fingerprint of the inputs of the generated config files.
+        dest_dir (str): The hidden game directory.
+        files (list): The generated .uae/.p2k.cfg files.
+        game (dict, optional): What is needed to regenerate the config files without the game data
+            (see write_game_config).
+    """
+    rel_dir = os.path.relpath(dest_dir, context.output_dir)
+    rel_files = sorted(os.path.relpath(f, context.output_dir) for f in files)
+    previous = manifest["outputs"].get(key)
+    copied = not (previous and previous["data"] == data_fingerprint and previous["dir"] == rel_dir)
+    context.stats.add_output(key, ([dest_dir] if copied else []) + list(files), copied)
+    if previous:
+        stale = set(previous["files"]) - set(rel_files)
+        if previous["dir"] != rel_dir:
+            stale.add(previous["dir"])
+        for rel_path in stale:
+            remove_output(context, rel_path)
+            parent = os.path.dirname(os.path.join(context.output_dir, rel_path))
+            if os.path.basename(parent) in UAE_EMULATORS.values():
+                try:
+                    os.rmdir(parent)  # Emulator variant directory, once its last game is gone
+                except OSError:
+                    pass
+    manifest["outputs"][key] = {
+        "data": data_fingerprint,
+        "config": config_fingerprint,
+        "dir": rel_dir,
+        "files": rel_files,
+        "game": game,
+    }
+    context.journal.record("outputs", key, manifest["outputs"][key])
+
+def remove_partial_outputs(context, path, depth):
+    """
+    Remove the .partial files and directories an interrupted build left up to depth levels below path.
+
+    Game directories (hidden, "." names) are only searched for the files stage_file was writing,
+    so the contents of WHDLoad games are not walked.
+    """
+    if depth == 0 or not os.path.isdir(path):
+        return
+    for entry in os.scandir(path):
+        if entry.name.endswith(".partial"):
+            remove_output(context, os.path.relpath(entry.path, context.output_dir))
+        elif entry.is_dir(follow_symlinks=False):
+            remove_partial_outputs(context, entry.path, 1 if entry.name.startswith(".") else depth - 1)
+
+def remove_stale_outputs(context, manifest, prefix, seen_keys):
+    """Remove the outputs of games under prefix whose inputs disappeared since the previous build."""
+    for key in sorted(manifest["outputs"]):
+        if key.startswith(prefix) and key not in seen_keys:
+            entry = manifest["outputs"].pop(key)
+            context.journal.record("outputs", key, None)
+            for rel_path in [entry["dir"]] + entry["files"]:
+                remove_output(context, rel_path)
+            print(f"[INFO] Removed outputs of deleted input: {key[len(prefix):]}")
+
+def extract_archive_to_temp(context, file, temp_root=None):
+    """
+    Extract one LHA archive into its own temporary directory.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        file (str): The archive filename in the lha directory.
+        temp_root (str, optional): The directory in which the temporary directory is created
+            (default: the expand directory of the context).
+
+    Returns:
+        tuple: The temporary directory and the list of directories expanded into it.
+    """
+    temp_root = temp_root or context.expand_dir
+    archive_path = os.path.join(context.lha_dir, file)
+    temp_dir = os.path.join(temp_root, f"temp_{os.path.splitext(file)[0]}")
+
+    # Create a temporary directory for extraction, discarding leftovers of an interrupted run
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
+    os.makedirs(temp_dir)
+
+    # Extract the archive silently into the temporary directory
+    start = time.perf_counter()
+    try:
+        subprocess.run(["lha", "xq", archive_path], cwd=temp_dir, check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, OSError) as e:
+        context.stats.add_subprocess("lha", file, time.perf_counter() - start, getattr(e, "returncode", None))
+        shutil.rmtree(temp_dir)
+        raise
+    context.stats.add_subprocess("lha", file, time.perf_counter() - start)
+
+    # Find the expanded directory inside the temporary directory
+    expanded_dirs_in_temp = [d for d in os.listdir(temp_dir) if os.path.isdir(os.path.join(temp_dir, d))]
+    return temp_dir, expanded_dirs_in_temp
+
+def expose_slave_files(staged_dir, expand_dir):
+    """Copy only the .slave files of a staged game into the expand directory, where they are scanned."""
+    if os.path.exists(expand_dir):
+        shutil.rmtree(expand_dir)
+    os.makedirs(expand_dir)
+    for root, dirs, files in os.walk(staged_dir):
+        for name in files:
+            if name.lower().endswith(".slave"):
+                rel_path = os.path.relpath(os.path.join(root, name), staged_dir)
+                os.makedirs(os.path.dirname(os.path.join(expand_dir, rel_path)), exist_ok=True)
+                shutil.copy2(os.path.join(root, name), os.path.join(expand_dir, rel_path))
+
+def stage_archive(context, file):
+    """
+    Extract an archive into the staging directory for streaming mode.
+
+    Returns:
+        str: The staged game directory, or None if the archive did not expand to exactly one directory.
+    """
+    temp_dir, expanded_dirs_in_temp = extract_archive_to_temp(context, file, context.staging_dir)
+    if len(expanded_dirs_in_temp) != 1:
+        shutil.rmtree(temp_dir)
+        return None
+    staged_dir = os.path.join(context.staging_dir, expanded_dirs_in_temp[0])
+    if os.path.exists(staged_dir):
+        shutil.rmtree(staged_dir)
+    shutil.move(os.path.join(temp_dir, expanded_dirs_in_temp[0]), staged_dir)
+    shutil.rmtree(temp_dir)
+    return staged_dir
+
+def plan_archive_extraction(context, manifest, stream=False):
+    """
+    Decide which LHA archives need extracting, reusing the expansions of unchanged archives
+    and removing the expansions of archives deleted from the lha directory.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest.
+        stream (bool): Whether the build runs in streaming mode (see extract_lha_archives).
+
+    Returns:
+        tuple: (dir_to_archive_map of the unchanged archives,
+            dict mapping archive filename to SHA-1 for the archives to extract,
+            total number of archives)
+    """
     dir_to_archive_map = {}
-    total_archives = 0
-    successful_expansions = 0
+    pending = {}
+    seen_archives = set()
 
-    for file in os.listdir(LHA_DIR):
+    for file in sorted(os.listdir(context.lha_dir)):
         if file.lower().endswith(".lha"):
-            total_archives += 1
-            archive_path = os.path.join(LHA_DIR, file)
-            temp_dir = os.path.join(EXPAND_DIR, f"temp_{os.path.splitext(file)[0]}")
-
-            # Create a temporary directory for extraction
-            os.makedirs(temp_dir, exist_ok=True)
-
-            # Extract the archive silently into the temporary directory
-            subprocess.run(["lha", "xq", archive_path], cwd=temp_dir, check=True)
-
-            # Find the expanded directory inside the temporary directory
-            expanded_dirs_in_temp = [d for d in os.listdir(temp_dir) if os.path.isdir(os.path.join(temp_dir, d))]
-            if len(expanded_dirs_in_temp) != 1:
-                # Print an error and continue
-                print(f"[ERROR] Skipping {file}: Expected exactly one expanded directory, found {len(expanded_dirs_in_temp)}")
-                shutil.rmtree(temp_dir)  # Clean up the temporary directory
+            archive_path = os.path.join(context.lha_dir, file)
+            seen_archives.add(file)
+
+            # Reuse the previous expansion if the archive has not changed
+            archive_sha1 = hash_file(context, manifest, archive_path)
+            previous = manifest["archives"].get(file)
+            if (
+                previous
+                and previous["sha1"] == archive_sha1
+                and previous.get("streamed", False) == stream
+                and os.path.isdir(os.path.join(context.expand_dir, previous["expanded_dir"]))
+            ):
+                dir_to_archive_map[previous["expanded_dir"]] = file
                 continue
+            if previous:
+                remove_output(context, os.path.relpath(os.path.join(context.expand_dir, previous["expanded_dir"]), context.output_dir))
+                del manifest["archives"][file]
+                context.journal.record("archives", file, None)
+            pending[file] = archive_sha1
 
-            expanded_dir_name = expanded_dirs_in_temp[0]
-            expanded_dir_path = os.path.join(temp_dir, expanded_dir_name)
+    # Remove the expansions of archives that were deleted from the lha directory
+    for file in sorted(set(manifest["archives"]) - seen_archives):
+        entry = manifest["archives"].pop(file)
+        context.journal.record("archives", file, None)
+        remove_output(context, os.path.relpath(os.path.join(context.expand_dir, entry["expanded_dir"]), context.output_dir))
 
-            # Map the expanded directory name to the archive filename
-            dir_to_archive_map[expanded_dir_name] = file
-            successful_expansions += 1
+    return dir_to_archive_map, pending, len(seen_archives)
 
-            # Move the expanded directory up one level to the expand directory
-            final_dest = os.path.join(EXPAND_DIR, expanded_dir_name)
-            if os.path.exists(final_dest):
-                shutil.rmtree(final_dest)
-            shutil.move(expanded_dir_path, final_dest)
+def merge_extracted_archive(context, manifest, file, archive_sha1, temp_dir, expanded_dirs_in_temp, dir_to_archive_map, stream=False):
+    """
+    Move a freshly extracted archive out of its temporary directory and record it.
 
-            # Clean up the temporary directory
-            shutil.rmtree(temp_dir)
+    Returns:
+        str: The expanded directory name, or None if the archive was skipped.
+    """
+    if len(expanded_dirs_in_temp) != 1:
+        # Print an error and continue
+        print(f"[ERROR] Skipping {file}: Expected exactly one expanded directory, found {len(expanded_dirs_in_temp)}")
+        context.stats.add_failure("extract", file, f"expected exactly one expanded directory, found {len(expanded_dirs_in_temp)}")
+        shutil.rmtree(temp_dir)  # Clean up the temporary directory
+        return None
+
+    expanded_dir_name = expanded_dirs_in_temp[0]
+    expanded_dir_path = os.path.join(temp_dir, expanded_dir_name)
+    if expanded_dir_name in dir_to_archive_map:
+        print(f"[WARN] {file} and {dir_to_archive_map[expanded_dir_name]} both expand to {expanded_dir_name}, keeping {file}")
+
+    # Map the expanded directory name to the archive filename
+    dir_to_archive_map[expanded_dir_name] = file
+    manifest["archives"][file] = {"sha1": archive_sha1, "expanded_dir": expanded_dir_name, "streamed": stream}
+
+    # Move the expanded directory up one level to the expand (or staging) directory
+    final_dest = os.path.join(context.staging_dir if stream else context.expand_dir, expanded_dir_name)
+    if os.path.exists(final_dest):
+        shutil.rmtree(final_dest)
+    shutil.move(expanded_dir_path, final_dest)
+    if stream:
+        expose_slave_files(final_dest, os.path.join(context.expand_dir, expanded_dir_name))
+    context.journal.record("archives", file, manifest["archives"][file])
+
+    # Clean up the temporary directory
+    shutil.rmtree(temp_dir)
+    return expanded_dir_name
+
+def report_extraction_failure(context, file, error):
+    """Print why an archive could not be extracted."""
+    details = getattr(error, "stderr", None) or str(error)
+    print(f"[ERROR] Failed to extract {file}: {details.strip()}")
+    context.stats.add_failure("extract", file, details)
+
+def print_extraction_summary(context, successful_expansions, total_archives, unchanged_archives, failed_archives):
+    """Print the outcome of the extraction of all archives."""
+    print(f"[INFO] Successfully expanded {successful_expansions} out of {total_archives} archives ({unchanged_archives} unchanged).")
+    context.stats.count("archives_unchanged", unchanged_archives)
+    context.stats.count("archives_extracted", successful_expansions - unchanged_archives)
+    if failed_archives:
+        print(f"[ERROR] {len(failed_archives)} archives failed to extract: {', '.join(sorted(failed_archives))}")
+
+def extract_lha_archives(context, manifest, jobs=1, stream=False):
+    """
+    Extract new or changed LHA archives and map expanded directory names to archive filenames.
 
-    print(f"[INFO] Successfully expanded {successful_expansions} out of {total_archives} archives.")
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest.
+        jobs (int): The number of archives extracted concurrently.
+        stream (bool): Extract into the staging directory and expose only the slave files in the
+            expand directory, so process_database can move each game into place instead of copying it.
+    """
+    dir_to_archive_map, pending, total_archives = plan_archive_extraction(context, manifest, stream)
+    unchanged_archives = len(dir_to_archive_map)
+    failed_archives = []
+    successful_expansions = unchanged_archives
+
+    # Extract concurrently; threads are enough because the work happens in the lha child processes
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        temp_root = context.staging_dir if stream else context.expand_dir
+        futures = {file: executor.submit(extract_archive_to_temp, context, file, temp_root) for file in sorted(pending)}
+        try:
+            # Merge (and journal) each archive as soon as it and the archives before it are extracted;
+            # merging in archive order keeps the outcome independent of completion order
+            for file, future in futures.items():
+                try:
+                    temp_dir, expanded_dirs_in_temp = future.result()
+                except (subprocess.CalledProcessError, OSError) as e:
+                    report_extraction_failure(context, file, e)
+                    failed_archives.append(file)
+                    continue
+                if merge_extracted_archive(context, manifest, file, pending[file], temp_dir, expanded_dirs_in_temp, dir_to_archive_map, stream):
+                    successful_expansions += 1
+        except KeyboardInterrupt:
+            # Only wait for the running lha processes, not for the queued archives
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    print_extraction_summary(context, successful_expansions, total_archives, unchanged_archives, failed_archives)
     return dir_to_archive_map
 
-def run_scan_slaves():
-    """Run the scan_slaves script and count the number of successfully analyzed slave files."""
-    env = os.environ.copy()
-    env["PYTHONPATH"] = os.path.join(BASE_DIR, "amiga68ktools", "lib")
-    result = subprocess.run([
-        "python3", SCAN_SCRIPT,
-        EXPAND_DIR,
-        DB_DIR
-    ], env=env, capture_output=True, text=True, check=True)
-
-    # Capture the output and errors
-    stdout = result.stdout
-    stderr = result.stderr
-
-    # Count the number of successfully analyzed slave files
-    analyzed_slaves = stdout.count(".slave") + stdout.count(".Slave")
-    print(f"[INFO] Successfully analyzed {analyzed_slaves} slave files.")
-
-    print(stderr.strip())
-
-def load_game_overrides():
-    """Load game names, WHD Config, UAE Config, RetroArch Config, and Emulator settings from games.csv if it exists."""
-    game_override_map = {}
-    if os.path.exists(GAMES_CSV):
-        with open(GAMES_CSV, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
+def load_slave_cache(context):
+    """Load the slave scan cache, mapping slave SHA-1 to the scanned flags and kick_name."""
+    slave_cache = {}
+    if os.path.exists(context.slave_cache_file):
+        with open(context.slave_cache_file, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile, delimiter=';'):
+                slave_cache[row['sha1']] = {"flags": row['flags'], "kick_name": row['kick_name']}
+    return slave_cache
+
+def save_slave_cache(context, slave_cache):
+    """Write the slave scan cache as a compact semicolon-separated file."""
+    temp_path = f"{context.slave_cache_file}.tmp"
+    with open(temp_path, "w", newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile, delimiter=';')
+        writer.writerow(["sha1", "flags", "kick_name"])
+        for sha1 in sorted(slave_cache):
+            writer.writerow([sha1, slave_cache[sha1]["flags"], slave_cache[sha1]["kick_name"]])
+    os.replace(temp_path, context.slave_cache_file)
+
+def find_slave_files(root_dir):
+    """Return the paths of all .slave files below root_dir, relative to it and sorted."""
+    slave_paths = []
+    for root, dirs, files in os.walk(root_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".slave"):
+                slave_paths.append(os.path.relpath(os.path.join(root, name), root_dir))
+    return slave_paths
+
+def init_scan_worker(lib_dir):
+    """Make the amiga68ktools library importable in a scan worker process."""
+    if lib_dir not in sys.path:
+        sys.path.insert(0, lib_dir)
+
+def scan_game_slaves(expand_dir, work_dir, slave_paths):
+    """
+    Run scan_slaves over the given slaves of one game inside the current (worker) process.
+
+    The tool script is executed with runpy, so the amiga68ktools modules it imports stay
+    loaded in the worker between games instead of paying interpreter startup per scan.
+
+    Args:
+        expand_dir (str): The expand directory holding the slaves.
+        work_dir (str): A scratch directory private to this game.
+        slave_paths (list): The game's slave paths, relative to expand_dir.
+
+    Returns:
+        tuple: (rows, stderr, seconds) where rows are (path, flags, kick_name) tuples with paths
+            relative to expand_dir and seconds is the time spent scanning.
+    """
+    start = time.perf_counter()
+    scan_input_dir = os.path.join(work_dir, "in")
+    scan_output_dir = os.path.join(work_dir, "out")
+    clear_dir(scan_input_dir)
+    clear_dir(scan_output_dir)
+    for path in slave_paths:
+        os.makedirs(os.path.dirname(os.path.join(scan_input_dir, path)), exist_ok=True)
+        link_or_copy(os.path.join(expand_dir, path), os.path.join(scan_input_dir, path), "hardlink")
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    saved_argv = sys.argv
+    sys.argv = [SCAN_SCRIPT, scan_input_dir, scan_output_dir]
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            runpy.run_path(SCAN_SCRIPT, run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise RuntimeError(f"scan_slaves exited with status {e.code}: {stderr.getvalue().strip()}")
+    finally:
+        sys.argv = saved_argv
+
+    rows = []
+    with open(os.path.join(scan_output_dir, "database.csv"), newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile, delimiter=';'):
+            path = os.path.relpath(os.path.join(scan_input_dir, row['path']), scan_input_dir)
+            rows.append((path, row['flags'].strip(), row.get('kick_name', '').strip()))
+    shutil.rmtree(work_dir)
+    return rows, stderr.getvalue(), time.perf_counter() - start
+
+class SlaveScanner:
+    """
+    Look up slaves in the scan cache and scan the missing ones in a pool of worker processes.
+
+    Games are added one at a time, which lets the pipelined build feed games as they are extracted.
+    """
+
+    def __init__(self, context, manifest, jobs=1):
+        self.context = context
+        self.manifest = manifest
+        self.jobs = max(1, jobs)
+        self.slave_cache = load_slave_cache(self.context)
+        self.slave_hashes = {}  # Slave path relative to the expand directory -> SHA-1
+        self.scan_results = []
+        self.uncached_count = 0
+        self.work_dir = os.path.join(self.context.db_dir, "scan")
+        self.executor = None
+
+    def make_result(self, path):
+        """Build the scan result of a cached slave."""
+        entry = self.slave_cache[self.slave_hashes[path]]
+        result = {"path": path, "flags": entry["flags"].split(','), "kick_name": entry["kick_name"]}
+        self.scan_results.append(result)
+        return result
+
+    def add_game(self, game_dir):
+        """
+        Hash the slaves of an expanded game directory.
+
+        Returns:
+            tuple: (results for the cached slaves, paths of the slaves that need scanning)
+        """
+        results, uncached = [], []
+        for rel_path in find_slave_files(os.path.join(self.context.expand_dir, game_dir)):
+            path = os.path.join(game_dir, rel_path)
+            self.slave_hashes[path] = hash_file(self.context, self.manifest, os.path.join(self.context.expand_dir, path))
+            if self.slave_hashes[path] in self.slave_cache:
+                results.append(self.make_result(path))
+            else:
+                uncached.append(path)
+        self.uncached_count += len(uncached)
+        self.context.stats.count("slave_cache_hits", len(results))
+        self.context.stats.count("slave_cache_misses", len(uncached))
+        return results, uncached
+
+    def submit(self, game_dir, paths):
+        """Scan the given slaves of a game in the worker pool and return the future."""
+        if self.executor is None:
+            lib_dir = os.path.join(BASE_DIR, "amiga68ktools", "lib")
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.jobs,
+                mp_context=multiprocessing.get_context(SCAN_START_METHOD),
+                initializer=init_scan_worker,
+                initargs=(lib_dir,)
+            )
+        return self.executor.submit(scan_game_slaves, self.context.expand_dir, os.path.join(self.work_dir, game_dir), paths)
+
+    def collect(self, game_dir, future):
+        """Store the results of a finished scan in the cache and return them."""
+        try:
+            rows, stderr, seconds = future.result()
+        except Exception as e:
+            print(f"[ERROR] Failed to scan slaves of {game_dir}: {e}")
+            self.context.stats.add_failure("scan", game_dir, e)
+            return []
+        self.context.stats.add_subprocess("scan_slaves", game_dir, seconds)
+        if stderr.strip():
+            print(stderr.strip())
+        results = []
+        for path, flags, kick_name in rows:
+            if path in self.slave_hashes:
+                self.slave_cache[self.slave_hashes[path]] = {"flags": flags, "kick_name": kick_name}
+                results.append(self.make_result(path))
+        return results
+
+    def close(self):
+        """Shut down the worker pool, save the cache and write database.csv."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            if os.path.exists(self.work_dir):
+                shutil.rmtree(self.work_dir)
+            save_slave_cache(self.context, self.slave_cache)
+
+        for path, sha1 in self.slave_hashes.items():
+            if sha1 not in self.slave_cache:
+                print(f"[WARN] scan_slaves could not analyze {path}")
+
+        # Keep database.csv around for inspection, in the format written by scan_slaves
+        with open(self.context.database_file, "w", newline='', encoding='utf-8') as csvfile:
+            writer = csv.writer(csvfile, delimiter=';')
+            writer.writerow(["path", "flags", "kick_name"])
+            for row in sorted(self.scan_results, key=lambda r: r["path"]):
+                writer.writerow([row["path"], ",".join(row["flags"]), row["kick_name"]])
+
+        print(f"[INFO] Successfully analyzed {len(self.scan_results)} slave files ({len(self.slave_hashes) - self.uncached_count} from cache).")
+
+def run_scan_slaves(context, manifest, jobs=1):
+    """
+    Analyze the slave files in the expand directory, yielding results as soon as they are available.
+
+    Slaves found in the cache are yielded first; games with new or changed slaves are scanned
+    in a pool of worker processes and yielded as each game completes, so the caller can place
+    one game while the next is still being scanned.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest, used for cached slave hashes.
+        jobs (int): The number of worker processes scanning games concurrently.
+
+    Yields:
+        dict: One dict per analyzed slave with 'path' (relative to the expand directory),
+            'flags' (list of WHDLoad flag names) and 'kick_name'.
+    """
+    scanner = SlaveScanner(context, manifest, jobs)
+    cached_results = []
+    futures = {}
+    for game_dir in sorted(os.listdir(context.expand_dir)):
+        if os.path.isdir(os.path.join(context.expand_dir, game_dir)):
+            results, uncached = scanner.add_game(game_dir)
+            cached_results.extend(results)
+            if uncached:
+                futures[scanner.submit(game_dir, uncached)] = game_dir
+
+    yield from cached_results
+    for future in as_completed(futures):
+        yield from scanner.collect(futures[future], future)
+    scanner.close()
+
+# --- Game Catalog ---
+def parse_config_pairs(text, split_on_spaces=True, strip_quotes=False):
+    """
+    Parse the key=value pairs of a games.csv config column into a dict.
+
+    Args:
+        text (str): The column value, e.g. "cpu_type=68040; cpu_speed=max".
+        split_on_spaces (bool): Separate pairs by spaces as well as semicolons.
+        strip_quotes (bool): Remove quotes around values (RetroArch Config).
+    """
+    config_map = {}
+    for pair in text.replace(";", " ").split() if split_on_spaces else text.split(";"):
+        if "=" in pair:
+            key, value = pair.split("=", 1)
+            value = value.strip()
+            config_map[key.strip()] = value.strip('"') if strip_quotes else value
+    return config_map
+
+class GameRecord:
+    """
+    One game of the catalog: its games.csv row joined with its archive, expanded directory and slaves.
+
+    Records of inputs without a games.csv row only carry the archive name and the join fields.
+    """
+    __slots__ = (
+        "archive_name", "game_name", "format", "hardware", "emulator", "notes", "codes",
+        "whd_config", "uae_config", "retroarch_config", "p2k_config", "in_csv", "expanded_dir", "slaves",
+    )
+    CSV_FIELDS = ("game_name", "format", "hardware", "emulator", "whd_config", "uae_config", "retroarch_config", "p2k_config")
+
+    def __init__(self, archive_name, game_name="", format="", hardware="", emulator="", notes="", codes="",
+                 whd_config=None, uae_config=None, retroarch_config=None, p2k_config=None, in_csv=False):
+        self.archive_name = archive_name
+        self.game_name = game_name
+        self.format = format
+        self.hardware = hardware
+        self.emulator = emulator
+        self.notes = notes
+        self.codes = codes
+        self.whd_config = whd_config or {}
+        self.uae_config = uae_config or {}
+        self.retroarch_config = retroarch_config or {}
+        self.p2k_config = p2k_config or {}
+        self.in_csv = in_csv
+        self.expanded_dir = None
+        self.slaves = ()  # (path, flags, kick_name) of each scanned slave
+
+    def settings(self):
+        """Return the games.csv fields that affect the build, for comparing two versions of a row."""
+        return tuple(getattr(self, field) for field in self.CSV_FIELDS)
+
+    def display_name(self):
+        """Return the game name, or the archive name without extension when the row has none."""
+        return self.game_name or os.path.splitext(self.archive_name or "")[0]
+
+EMPTY_GAME = GameRecord(None)  # Returned for lookups of unknown games; never modified
+
+class GameCatalog:
+    """
+    The games of a build indexed by archive name, game name and expanded directory.
+
+    Loaded from games.csv by load_game_catalog; the build adds the archives, expanded
+    directories and slave scan results it finds so one lookup answers everything about a game.
+    """
+    __slots__ = ("records", "by_game_name", "by_expanded_dir", "variant_emulators")
+
+    def __init__(self, variant_emulators=()):
+        self.records = {}  # Archive name -> GameRecord, in games.csv order
+        self.variant_emulators = tuple(variant_emulators)  # Emulators every game also gets a .uae for (see write_game_config)
+        self.by_game_name = {}  # Game name -> records; WHDLoad and CD32 versions of a game share it
+        self.by_expanded_dir = {}  # Expanded directory -> records of the archives expanding to it
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record):
+        """Add or replace the record of an archive; a later games.csv row wins, as in a dict."""
+        previous = self.records.get(record.archive_name)
+        if previous is not None:
+            for index, name in ((self.by_game_name, previous.game_name), (self.by_expanded_dir, previous.expanded_dir)):
+                if name in index:
+                    index[name] = [r for r in index[name] if r is not previous]
+        self.records[record.archive_name] = record
+        if record.game_name:
+            self.by_game_name.setdefault(record.game_name, []).append(record)
+
+    def get(self, archive_name):
+        """Return the record of an archive, or EMPTY_GAME."""
+        return self.records.get(archive_name, EMPTY_GAME)
+
+    def add_archive(self, archive_name, expanded_dir=None):
+        """Join an input archive (and the directory it expands to) with its games.csv row."""
+        record = self.records.get(archive_name)
+        if record is None:
+            record = GameRecord(archive_name)
+            self.add(record)
+        if expanded_dir and record.expanded_dir != expanded_dir:
+            if record.expanded_dir in self.by_expanded_dir:
+                self.by_expanded_dir[record.expanded_dir].remove(record)
+            record.expanded_dir = expanded_dir
+            self.by_expanded_dir.setdefault(expanded_dir, []).append(record)
+        return record
+
+    def add_slave(self, archive_name, row):
+        """Record the scan result of one of an archive's slaves."""
+        record = self.add_archive(archive_name)
+        slave = (row["path"], ",".join(row["flags"]), row["kick_name"])
+        if slave not in record.slaves:  # Placed again by a watch rebuild
+            record.slaves += (slave,)
+
+    def find(self, name):
+        """Return all records matching a name: an archive name with or without extension, a game name or an expanded directory."""
+        matches = [
+            r for r in self.records.values()
+            if r.archive_name and name in (r.archive_name, os.path.splitext(r.archive_name)[0])
+        ]
+        for index in (self.by_game_name, self.by_expanded_dir):
+            for record in index.get(name, []):
+                if record not in matches:
+                    matches.append(record)
+        return matches
+
+def load_game_catalog(context, variant_emulators=()):
+    """Load game names, formats, hardware, emulators and config overrides from games.csv if it exists."""
+    catalog = GameCatalog(variant_emulators)
+    if os.path.exists(context.games_csv):
+        with open(context.games_csv, newline='', encoding='utf-8') as csvfile:
+            for row in csv.DictReader(csvfile):
                 archive_name = row.get("Archive Name", "").strip()
-                game_name = row.get("Game", "").strip()
-                whd_config = row.get("WHD Config", "").strip()
-                uae_config = row.get("UAE Config", "").strip()
-                p2k_config = row.get("P2K Config", "").strip()
-                retroarch_config = row.get("RetroArch Config", "").strip()
-                emulator = row.get("Emulator", "").strip().lower()  # Read and convert to lowercase
 
                 # Skip if no archive name is provided
                 if not archive_name:
                     continue
 
-                # Skip if no game name or settings are provided
-                if not game_name and not whd_config and not uae_config and not retroarch_config and not emulator:
-                    continue
+                catalog.add(GameRecord(
+                    archive_name,
+                    game_name=row.get("Game", "").strip(),
+                    format=row.get("Format", "").strip(),
+                    hardware=row.get("Hardware", "").strip(),
+                    emulator=row.get("Emulator", "").strip().lower(),  # Read and convert to lowercase
+                    notes=row.get("Notes", "").strip(),
+                    codes=row.get("Codes", "").strip(),
+                    whd_config=parse_config_pairs(row.get("WHD Config", "").strip()),
+                    uae_config=parse_config_pairs(row.get("UAE Config", "").strip()),
+                    retroarch_config=parse_config_pairs(row.get("RetroArch Config", "").strip(), split_on_spaces=False, strip_quotes=True),
+                    p2k_config=parse_config_pairs(row.get("P2K Config", "").strip()),
+                    in_csv=True,
+                ))
+
+    return catalog
+
+def write_if_changed(context, path, content):
+    """
+    Write a text file unless it already has exactly this content, keeping its mtime stable for rsync.
+
+    Returns:
+        bool: Whether the file was written.
+    """
+    data = content.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                context.stats.count("config_files_unchanged")
+                return False
+    except FileNotFoundError:
+        pass
+    # Write next to the file and rename, so an interrupted build never leaves a truncated config;
+    # like the other in-progress outputs under roms/ and config/, the name ends in .partial
+    temp_path = f"{path}.partial"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    context.stats.count("config_files_written")
+    return True
+
+def normalize_settings_text(text):
+    """Replace the typographic hyphens and spaces used in uae_settings.csv with plain ASCII ones."""
+    return text.replace("\u2011", "-").replace("\u202f", " ").replace("\xa0", " ").strip()
+
+def compile_uae_rule(values_format, default_value):
+    """
+    Compile the Values/Format text of a uae_settings.csv row into a value rule.
 
-                # Parse WHD Config into a dictionary
-                whd_config_map = {}
-                if whd_config:
-                    for pair in whd_config.replace(";", " ").split():
-                        if "=" in pair:
-                            key, value = pair.split("=", 1)
-                            whd_config_map[key.strip()] = value.strip()
-
-                # Parse UAE Config into a dictionary
-                uae_config_map = {}
-                if uae_config:
-                    for pair in uae_config.replace(";", " ").split():
-                        if "=" in pair:
-                            key, value = pair.split("=", 1)
-                            uae_config_map[key.strip()] = value.strip()
-
-                # Parse RetroArch Config into a dictionary
-                retroarch_config_map = {}
-                if retroarch_config:
-                    for pair in retroarch_config.split(";"):
-                        if "=" in pair:
-                            key, value = pair.split("=", 1)
-                            retroarch_config_map[key.strip()] = value.strip().strip('"')  # Remove surrounding quotes
-
-                p2k_config_map = {}
-                if p2k_config:
-                    for pair in p2k_config.replace(";", " ").split():
-                        if "=" in pair:
-                            key, value = pair.split("=", 1)
-                            p2k_config_map[key.strip()] = value.strip()
-
-                # Only add to the map if game_name or overrides are present
-                entry = {}
-                if game_name:
-                    entry["game_name_override"] = game_name
-                if whd_config_map:
-                    entry["whd_config"] = whd_config_map
-                if uae_config_map:
-                    entry["uae_config"] = uae_config_map
-                if retroarch_config_map:
-                    entry["retroarch_config"] = retroarch_config_map
-                if p2k_config_map:
-                    entry["p2k_config"] = p2k_config_map
-                if emulator:
-                    entry["emulator"] = emulator
-                game_override_map[archive_name] = entry
-
-    return game_override_map
-
-def generate_uae_file(uae_base_name, dest_base, hidden_dir, system_type, format_type, adf_files=None, cue_file=None, uae_config_map=None):
-    """
-    Generate a .uae file for a game.
+    A rule accepts a value that equals one of its literals, lies in one of its numeric ranges
+    or matches one of its patterns; "any" rules accept everything (paths, strings).
+    With first_field set only the part before the first comma is checked ("rw|ro,...").
+    """
+    text = normalize_settings_text(values_format)
+    rule = {"kind": "choice", "literals": [], "ranges": [], "patterns": [], "first_field": False}
+    if text == "Boolean":
+        rule["literals"] = ["true", "false", "yes", "no"]
+        return rule
+    match = re.fullmatch(r"Enum (\d+)-(\d+)", text)
+    if match:
+        # Motorola CPU models between the bounds
+        low, high = int(match.group(1)), int(match.group(2))
+        rule["literals"] = [str(model) for model in range(low, high + 1, 10) if model != 68050]
+        return rule
+    if text.endswith(",..."):
+        rule["first_field"] = True
+        text = text[:-len(",...")]
+    if text in ("Integer px", "int"):
+        rule["patterns"].append(r"-?\d+")
+        if default_value.isalpha():
+            rule["literals"].append(default_value.lower())  # e.g. gfx_width=auto
+        return rule
+    if text == "Hex scancode":
+        rule["patterns"].append(r"0x[0-9a-fA-F]+|\d+")
+        return rule
+    match = re.fullmatch(r"([\d.]+(?:,[\d.]+)+) MB", text)
+    if match:
+        rule["literals"] = match.group(1).split(",")
+        return rule
+    match = re.match(r"([\d.]+)-([\d.]+)\b", text)
+    if match and "|" not in text:
+        rule["ranges"].append([float(match.group(1)), float(match.group(2))])
+        return rule
+    if "|" in text:
+        for choice in text.split("|"):
+            range_match = re.fullmatch(r"([\d.]+)-([\d.]+)", choice)
+            if range_match:
+                rule["ranges"].append([float(range_match.group(1)), float(range_match.group(2))])
+            elif choice.endswith("X"):
+                rule["patterns"].append(re.escape(choice[:-1]) + r"\d+")  # joyX -> joy0, joy1...
+            else:
+                rule["literals"].append(choice.lower())
+        return rule
+    return {"kind": "any"}
 
-    Args:
-        uae_base_name (str): The base name for the .uae file.
-        dest_base (str): The base directory where the .uae file will be placed.
-        hidden_dir (str): The hidden directory name for the game.
-        system_type (str): The system type ('cd32', 'aga', 'ecs').
-        format_type (str): The format type ('adf', 'whdload', 'cd32').
-        adf_files (list, optional): List of .adf files for ADF-based games.
-        cue_file (str, optional): The .cue file for CD32 games.
-        uae_config_map (dict, optional): A dictionary of UAE configuration overrides.
+def compile_uae_schema():
     """
-    out_path = os.path.join(dest_base, f"{uae_base_name}.uae")
-    lines = []
+    Compile uae_settings.csv into a schema indexed by parameter name.
+
+    Each entry holds the emulators (UAE_EMULATORS keys) supporting the parameter, its value rule
+    and its documented format. Rows naming several parameters ("floppy0 / floppy1",
+    "whdload_custom1-5") are expanded.
+    """
+    schema = {}
+    with open(UAE_SETTINGS_CSV, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            entry = {
+                "emulators": sorted(e for e, column in UAE_EMULATORS.items() if row.get(column, "").startswith("☑")),
+                "rule": compile_uae_rule(row.get("Values/Format", ""), row.get("Default Value", "").strip()),
+                "format": normalize_settings_text(row.get("Values/Format", "")),
+            }
+            for name in row["Parameter"].split("/"):
+                name = normalize_settings_text(name)
+                match = re.fullmatch(r"(.*?)(\d)-(\d)", name)
+                if match:
+                    # whdload_custom1-5 -> whdload_custom1 ... whdload_custom5
+                    for i in range(int(match.group(2)), int(match.group(3)) + 1):
+                        schema[f"{match.group(1)}{i}"] = entry
+                else:
+                    schema[name] = entry
+    return schema
+
+@functools.lru_cache(maxsize=None)
+def load_uae_schema(context, settings_sha1):
+    """Return the compiled schema for this version of uae_settings.csv, from uae_schema.json when it is current."""
+    try:
+        with open(context.uae_schema_file, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("version") == UAE_SCHEMA_VERSION and cached.get("sha1") == settings_sha1:
+            context.stats.count("uae_schema_cache_hits")
+            return cached["schema"]
+    except (IOError, ValueError):
+        pass
+    context.stats.count("uae_schema_cache_misses")
+    schema = compile_uae_schema()
+    os.makedirs(os.path.dirname(context.uae_schema_file), exist_ok=True)
+    write_if_changed(context, context.uae_schema_file, json.dumps({"version": UAE_SCHEMA_VERSION, "sha1": settings_sha1, "schema": schema}, indent=1))
+    return schema
+
+def uae_schema(context):
+    """Return the schema of the current uae_settings.csv, or an empty schema if it is missing."""
+    if not os.path.exists(UAE_SETTINGS_CSV):
+        return {}
+    with open(UAE_SETTINGS_CSV, "rb") as f:
+        return load_uae_schema(context, hashlib.sha1(f.read()).hexdigest())
+
+def check_uae_value(rule, value):
+    """Check a setting's value against a rule from compile_uae_rule."""
+    if rule["kind"] == "any":
+        return True
+    value = value.split(",", 1)[0] if rule["first_field"] else value
+    if value.lower() in rule["literals"]:
+        return True
+    if any(re.fullmatch(pattern, value) for pattern in rule["patterns"]):
+        return True
+    try:
+        number = float(value)
+    except ValueError:
+        return False
+    return any(low <= number <= high for low, high in rule["ranges"])
+
+def validate_overrides(context, catalog):
+    """
+    Check the UAE and WHD Config overrides of every game against uae_settings.csv in one pass.
 
-    # Default UAE configuration
-    default_config = [
-        ("cpu_type", "68020" if system_type in ["cd32", "aga"] else "68000"),
-        ("chipset", "aga" if system_type in ["cd32", "aga"] else "ecs"),
+    Returns:
+        list: (archive name, problem) tuples, in games.csv order.
+    """
+    schema = uae_schema(context)
+    problems = []
+    for record in catalog:
+        archive_name, emulator = record.archive_name, record.emulator
+        for key, value in record.uae_config.items():
+            entry = schema.get(key)
+            if entry is None:
+                if key not in UAE_GENERATED_SETTINGS:
+                    problems.append((archive_name, f"unknown UAE setting {key}={value}"))
+            elif not check_uae_value(entry["rule"], value):
+                problems.append((archive_name, f"invalid value {key}={value}, expected {entry['format']}"))
+            elif emulator in UAE_EMULATORS and emulator not in entry["emulators"]:
+                problems.append((archive_name, f"{key} is not supported by {UAE_EMULATORS[emulator]} and will be left out"))
+        for key, value in record.whd_config.items():
+            if key not in WHD_SETTINGS:
+                problems.append((archive_name, f"unknown WHD setting {key}={value}"))
+            elif key == "kick" and not is_valid_kick_name(value):
+                problems.append((archive_name, f"invalid kickstart {value}, expected nnnnn.aNNN (e.g. 34005.a500)"))
+    return problems
+
+def report_override_problems(context, problems):
+    """Print the problems found by validate_overrides and record them in the build report."""
+    for archive_name, problem in problems:
+        print(f"[WARN] games.csv {archive_name}: {problem}")
+        context.stats.add_failure("validate", archive_name, problem)
+    if problems:
+        print(f"[WARN] {len(problems)} problems found in the games.csv overrides")
+
+@functools.lru_cache(maxsize=None)
+def uae_template(system_type, format_type):
+    """
+    Return the default .uae settings of a system and format as a tuple of (key, value) pairs.
+
+    Values of None are left out of the file unless a game overrides them. The per-game media
+    settings (cdimage0, filesystem2, floppyN) are added by render_uae_config.
+    """
+    is_aga = system_type in ["cd32", "aga"]
+    template = [
+        ("cpu_type", "68020" if is_aga else "68000"),
+        ("chipset", "aga" if is_aga else "ecs"),
         ("chipmem_size", "2" if system_type == "cd32" else "4" if system_type == "aga" else "2"),
         ("fastmem_size", "8"),
         ("kickstart_rom_file", (
-            "/recalbox/share/bios/kick40060.CD32"
+            f"{RECALBOX_BIOS_DIR}/kick40060.CD32"
             if system_type == "cd32" else
-            "/recalbox/share/bios/kick40068.A1200"
+            f"{RECALBOX_BIOS_DIR}/kick40068.A1200"
             if system_type == "aga" else
-            "/recalbox/share/bios/kick40063.A600"
+            f"{RECALBOX_BIOS_DIR}/kick40063.A600"
         )),
-        ("kickstart_ext_rom_file", "/recalbox/share/bios/kick40060.CD32.ext" if system_type == "cd32" else None),
+        ("kickstart_ext_rom_file", f"{RECALBOX_BIOS_DIR}/kick40060.CD32.ext" if system_type == "cd32" else None),
         ("use_gui", "no" if system_type == "cd32" else None),
     ]
+    if format_type == "whdload":
+        template.append(("boot1", "dh0"))
+    elif format_type == "adf":
+        template.append(("boot1", "df0"))
+        template.append(("nr_floppies", "4"))
+    return tuple(template)
+
+def render_uae_config(context, dest_name, hidden_dir, system_type, format_type, adf_files=None, cue_file=None, uae_config_map=None, emulator=None):
+    """
+    Render the contents of a .uae file: the cached template, the game's media and its overrides.
 
-    # Disk-specific configuration
+    Overrides replace template settings in place and append new ones. When the emulator is one of
+    UAE_EMULATORS, settings that uae_settings.csv marks as unsupported by it are left out and
+    kickstart ROMs are renamed as in EMULATOR_KICKSTART_NAMES.
+    """
+    config = dict(uae_template(system_type, format_type))
+    game_dir = f"{RECALBOX_ROMS_DIR}/{dest_name}/{hidden_dir}"
     if format_type == "cd32" and cue_file:
-        default_config.append(("cdimage0", f"/recalbox/share/roms/{os.path.basename(dest_base)}/{os.path.join(hidden_dir, cue_file)},image"))
+        config["cdimage0"] = f"{game_dir}/{cue_file},image"
     elif format_type == "whdload":
-        default_config.append(("boot1", "dh0"))
-        default_config.append(("filesystem2", f"rw,DH0:GAME:/recalbox/share/roms/{os.path.basename(dest_base)}/{hidden_dir}/,0"))
+        config["filesystem2"] = f"rw,DH0:GAME:{game_dir}/,0"
     elif format_type == "adf" and adf_files:
-        default_config.append(("boot1", "df0"))
-        default_config.append(("nr_floppies", "4"))
-        for i in range(min(4, len(adf_files))):
-            default_config.append((f"floppy{i}", f"/recalbox/share/roms/{os.path.basename(dest_base)}/{hidden_dir}/{adf_files[i]}"))
-
-    # Apply overrides from uae_config_map
+        for i, adf_file in enumerate(adf_files[:4]):
+            config[f"floppy{i}"] = f"{game_dir}/{adf_file}"
+    else:
+        config.pop("boot1", None)
+        config.pop("nr_floppies", None)
     if uae_config_map:
-        # Create a dictionary from default_config for easier updates
-        config_dict = {key: value for key, value in default_config}
+        config.update(uae_config_map)
+    kickstart_names = EMULATOR_KICKSTART_NAMES.get(emulator, {})
+    for key in ("kickstart_rom_file", "kickstart_ext_rom_file"):
+        if config.get(key) and os.path.basename(config[key]) in kickstart_names:
+            config[key] = f"{os.path.dirname(config[key])}/{kickstart_names[os.path.basename(config[key])]}"
 
-        # Update existing parameters and add new ones
-        for key, value in uae_config_map.items():
-            config_dict[key] = value
+    schema = uae_schema(context) if emulator in UAE_EMULATORS else {}
+    lines = []
+    for key, value in config.items():
+        if value is None:
+            continue
+        if key in schema and emulator not in schema[key]["emulators"]:
+            context.stats.count("uae_settings_unsupported")
+            continue
+        lines.append(f"{key}={value}")
+    return "\n".join(lines) + "\n"
 
-        # Convert the updated dictionary back to a list to preserve order
-        default_config = list(config_dict.items())
+def generate_uae_file(context, uae_base_name, dest_base, hidden_dir, system_type, format_type, adf_files=None, cue_file=None, uae_config_map=None, emulator=None, uae_dir=None):
+    """
+    Generate a .uae file for a game, leaving it untouched if its content did not change.
 
-    # Generate the lines for the UAE file
-    for key, value in default_config:
-        if value is not None:
-            lines.append(f"{key}={value}")
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        uae_base_name (str): The base name for the .uae file.
+        dest_base (str): The base directory where the .uae file will be placed.
+        hidden_dir (str): The hidden directory name for the game.
+        system_type (str): The system type ('cd32', 'aga', 'ecs').
+        format_type (str): The format type ('adf', 'whdload', 'cd32').
+        adf_files (list, optional): List of .adf files for ADF-based games.
+        cue_file (str, optional): The .cue (or converted .chd) file for CD32 games.
+        uae_config_map (dict, optional): A dictionary of UAE configuration overrides.
+        emulator (str, optional): The emulator the file is for, used to leave out unsupported settings.
+        uae_dir (str, optional): Where to write the .uae file instead of dest_base, e.g. an emulator variant's directory.
+    """
+    out_path = os.path.join(uae_dir or dest_base, f"{uae_base_name}.uae")
+    content = render_uae_config(context, os.path.basename(dest_base), hidden_dir, system_type, format_type, adf_files, cue_file, uae_config_map, emulator)
 
     # Write the UAE file
     try:
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write("\n".join(lines))
-            f.write("\n")  # Ensure trailing newline
+        write_if_changed(context, out_path, content)
     except IOError as e:
         print(f"[ERROR] Failed to write UAE file {out_path}: {e}")
+        context.stats.add_failure("write", out_path, e)
 
-def generate_p2k_cfg_file(uae_base_name, dest_base, p2k_config_map):
+def generate_p2k_cfg_file(context, uae_base_name, dest_base, p2k_config_map):
     """
     Generate a .uae.p2k.cfg file for a game if p2k_config_map is provided.
 
     Args:
+        context (BuildContext): The paths, statistics and journal of the build.
         uae_base_name (str): The base name for the .uae file.
         dest_base (str): The base directory where the .uae.p2k.cfg file will be placed.
         p2k_config_map (dict): A dictionary of P2K configuration overrides.
@@ -244,249 +1399,625 @@ def generate_p2k_cfg_file(uae_base_name, dest_base, p2k_config_map):
         return
     out_path = os.path.join(dest_base, f"{uae_base_name}.uae.p2k.cfg")
     try:
-        with open(out_path, "w", encoding="utf-8") as f:
-            for key, value in p2k_config_map.items():
-                f.write(f"{key}={value}\n")
+        write_if_changed(context, out_path, "".join(f"{key}={value}\n" for key, value in p2k_config_map.items()))
     except IOError as e:
         print(f"[ERROR] Failed to write P2K config file {out_path}: {e}")
+        context.stats.add_failure("write", out_path, e)
 
-def process_database(dir_to_archive_map, game_override_map):
-    """Process the database and handle WHDLoad games with kick_name and overrides logic."""
-    processed_dirs = set()  # Track directories processed from the database
+def write_game_config(context, manifest, key, game, catalog, data_fingerprint, force=False):
+    """
+    Generate the .uae (and, for WHDLoad games, .uae.p2k.cfg) file of a placed game unless it is up to date.
 
-    with open(DATABASE_FILE, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=';')
-        for row in reader:
-            expand_dir_path = row['path']
-            expand_dir_name = os.path.basename(os.path.dirname(expand_dir_path))
-            flags = row['flags'].split(',')
-            kick_name = row.get('kick_name', '').strip()  # Get the kick_name field
-            is_cd32 = "CD32" in expand_dir_name.upper()
-            is_aga = 'ReqAGA' in flags or "AGA" in expand_dir_name.upper()
-            system_type = "cd32" if is_cd32 else "aga" if is_aga else "ecs"
-            format_type = "whdload"  # WHDLoad format for database entries
-
-            src = os.path.join(EXPAND_DIR, os.path.dirname(expand_dir_path))
-            if not os.path.exists(src):
-                print(f"[WARN] Skipping missing path: {src}")
-                continue
+    The game also gets a .uae for each of the catalog's variant_emulators, in a subdirectory of its
+    system directory named after the emulator (e.g. amiga1200/Amiberry/). The variants point at
+    the same hidden game directory, so no game data is copied per emulator.
 
-            archive_name = dir_to_archive_map.get(expand_dir_name, None)
-            game_info = game_override_map.get(archive_name, {})
-            game_name_override = game_info.get("game_name_override")
-            whd_config = game_info.get("whd_config", {})
-            uae_config = game_info.get("uae_config", {})
-            p2k_config = game_info.get("p2k_config", {})
-
-            # Use game_name_override if set, otherwise fallback to the existing logic
-            uae_base_name = game_name_override if game_name_override else expand_dir_name
-            hidden_dir = f".{archive_name.rsplit('.', 1)[0]}" if archive_name else f".{expand_dir_name}"
-            dest_base = CD32_DIR if system_type == "cd32" else AMIGA1200_DIR if system_type == "aga" else AMIGA600_DIR
-
-            dest_dir = os.path.join(dest_base, hidden_dir)
-            if os.path.exists(dest_dir):
-                shutil.rmtree(dest_dir)
-            if os.path.isdir(src):
-                shutil.copytree(src, dest_dir)
-            else:
-                os.makedirs(dest_dir, exist_ok=True)
-                shutil.copy2(src, os.path.join(dest_dir, os.path.basename(src)))
-
-            # Copy the contents of system_base into the hidden directory
-            system_base = os.path.join(BASE_DIR, "system_base")
-            if os.path.exists(system_base):
-                for item in os.listdir(system_base):
-                    src_path = os.path.join(system_base, item)
-                    dest_path = os.path.join(dest_dir, item)
-                    if os.path.isdir(src_path):
-                        shutil.copytree(src_path, dest_path, dirs_exist_ok=True)
-                    else:
-                        shutil.copy2(src_path, dest_path)
-
-            # Handle kick_name logic for WHDLoad games
-            if format_type == "whdload":
-                # Check for kick_name or whdkick override
-                effective_kick_name = whd_config.get("kick", kick_name)
-                if effective_kick_name and is_valid_kick_name(effective_kick_name):
-                    copy_kickstart_file(effective_kick_name, dest_dir)
-
-            generate_uae_file(
-                uae_base_name,
-                dest_base,
-                hidden_dir,
-                system_type,
-                format_type,
-                uae_config_map=uae_config
-            )
-            generate_p2k_cfg_file(
-                uae_base_name,
-                dest_base,
-                p2k_config
-            )
-            processed_dirs.add(expand_dir_name)  # Mark directory as processed
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest.
+        key (str): The game's output key.
+        game (dict): The game's archive name (the games.csv lookup key), default name, system type,
+            format, destination system directory and hidden directory, plus its adf_files or cue_file.
+        catalog (GameCatalog): The games loaded from games.csv.
+        data_fingerprint (str): Fingerprint of the game's hidden directory.
+        force (bool): Regenerate even if the recorded config fingerprint matches, e.g. after the data was rebuilt.
+
+    Returns:
+        bool: Whether the files were (re)generated.
+    """
+    record = catalog.get(game["archive"])
+    # Use the games.csv game name if set, otherwise fallback to the base name
+    uae_base_name = record.game_name or game["name"]
+    uae_config = record.uae_config
+    p2k_config = record.p2k_config if game["format"] == "whdload" else {}
+    emulator = record.emulator
+    config_parts = [game, uae_base_name, uae_config, p2k_config, emulator, uae_template(game["system"], game["format"])]
+    if catalog.variant_emulators:
+        config_parts.append(catalog.variant_emulators)
+    if (emulator in UAE_EMULATORS or catalog.variant_emulators) and os.path.exists(UAE_SETTINGS_CSV):
+        # render_uae_config leaves out the settings uae_settings.csv marks as unsupported
+        config_parts.append(hash_file(context, manifest, UAE_SETTINGS_CSV))
+    config_fingerprint = fingerprint(*config_parts)
+    if not force and config_is_current(context, manifest, key, config_fingerprint):
+        return False
+
+    dest_base = os.path.join(context.roms_dir, game["dest"])
+    generated_files = []
+    targets = [(dest_base, emulator)] + [
+        (os.path.join(dest_base, UAE_EMULATORS[variant]), variant) for variant in catalog.variant_emulators
+    ]
+    for uae_dir, uae_emulator in targets:
+        os.makedirs(uae_dir, exist_ok=True)
+        generate_uae_file(
+            context,
+            uae_base_name,
+            dest_base,
+            game["hidden_dir"],
+            game["system"],
+            game["format"],
+            adf_files=game.get("adf_files"),
+            cue_file=game.get("cue_file"),
+            uae_config_map=uae_config,
+            emulator=uae_emulator,
+            uae_dir=uae_dir
+        )
+        generated_files.append(os.path.join(uae_dir, f"{uae_base_name}.uae"))
+        if game["format"] == "whdload":
+            generate_p2k_cfg_file(context, uae_base_name, uae_dir, p2k_config)
+            if p2k_config:
+                generated_files.append(os.path.join(uae_dir, f"{uae_base_name}.uae.p2k.cfg"))
+    dest_dir = os.path.join(dest_base, game["hidden_dir"])
+    record_outputs(context, manifest, key, data_fingerprint, config_fingerprint, dest_dir, generated_files, game)
+    return True
+
+def place_whdload_game(context, row, dir_to_archive_map, catalog, manifest, system_base_fingerprint, seen_keys, stream=False, link_mode="copy"):
+    """
+    Place one scanned WHDLoad slave's game into its hidden directory and generate its config files.
 
+    A game is placed once per run: further slaves of the same game (seen_keys already holds its
+    output key) are only recorded in the catalog.
+
+    In streaming mode the expand directory only holds slave files; the game contents are moved
+    from the staging directory (re-extracting the archive if it is no longer staged).
+    The system_base and kickstart files shared by all games are materialized according to link_mode.
+
+    Returns:
+        tuple: (manifest output key, expanded directory name, whether the game was copied),
+            or None if the slave's directory is missing.
+    """
+    expand_dir_path = row['path']
+    expand_dir_name = os.path.basename(os.path.dirname(expand_dir_path))
+    flags = row['flags']
+    kick_name = row['kick_name']
+    is_cd32 = "CD32" in expand_dir_name.upper()
+    is_aga = 'ReqAGA' in flags or "AGA" in expand_dir_name.upper()
+    system_type = "cd32" if is_cd32 else "aga" if is_aga else "ecs"
+    format_type = "whdload"  # WHDLoad format for database entries
+
+    src = os.path.join(context.expand_dir, os.path.dirname(expand_dir_path))
+    if not os.path.exists(src):
+        print(f"[WARN] Skipping missing path: {src}")
+        return None
+
+    archive_name = dir_to_archive_map.get(expand_dir_name, None)
+    if archive_name:
+        catalog.add_archive(archive_name, expand_dir_name)
+        catalog.add_slave(archive_name, row)
+    output_key = f"whdload:{archive_name or expand_dir_name}"
+    if output_key in seen_keys:
+        return output_key, expand_dir_name, False
+    seen_keys.add(output_key)
+    whd_config = catalog.get(archive_name).whd_config
+    hidden_dir = f".{archive_name.rsplit('.', 1)[0]}" if archive_name else f".{expand_dir_name}"
+    dest_base = context.cd32_dir if system_type == "cd32" else context.amiga1200_dir if system_type == "aga" else context.amiga600_dir
+    dest_dir = os.path.join(dest_base, hidden_dir)
+
+    # Check for kick_name or whdkick override
+    effective_kick_name = whd_config.get("kick", kick_name)
+    needs_kickstart = format_type == "whdload" and effective_kick_name and is_valid_kick_name(effective_kick_name)
+
+    # Fingerprint the inputs of the hidden directory and of the generated config files separately,
+    # so that editing a UAE override does not copy the game again
+    source_fingerprint = manifest["archives"][archive_name]["sha1"] if archive_name in manifest["archives"] else hash_tree(context, manifest, src)
+    data_fingerprint = fingerprint(
+        source_fingerprint,
+        os.path.dirname(expand_dir_path),
+        dest_dir,
+        system_base_fingerprint,
+        kickstart_fingerprint(context, manifest, effective_kick_name) if needs_kickstart else None,
+        link_mode,
+    )
+    game = {
+        "archive": archive_name,
+        "name": expand_dir_name,
+        "system": system_type,
+        "format": format_type,
+        "dest": os.path.basename(dest_base),
+        "hidden_dir": hidden_dir,
+    }
+    copied = False
+
+    if not data_is_current(context, manifest, output_key, data_fingerprint):
+        copied = True
+        # Build the hidden directory next to its final place and rename it once it is complete,
+        # so an interrupted build never leaves a half-copied game behind
+        partial_dir = f"{dest_dir}.partial"
+        if os.path.exists(partial_dir):
+            shutil.rmtree(partial_dir)
+        if stream and archive_name:
+            staged_src = os.path.join(context.staging_dir, os.path.dirname(expand_dir_path))
+            if not os.path.isdir(staged_src) and stage_archive(context, archive_name):
+                print(f"[INFO] Re-extracted {archive_name} into staging")
+            if not os.path.isdir(staged_src):
+                print(f"[ERROR] Skipping {archive_name}: staged contents not found at {staged_src}")
+                context.stats.add_failure("place", archive_name, f"staged contents not found at {staged_src}")
+                return output_key, expand_dir_name, copied
+            shutil.move(staged_src, partial_dir)
+        elif os.path.isdir(src):
+            shutil.copytree(src, partial_dir)
+        else:
+            os.makedirs(partial_dir, exist_ok=True)
+            shutil.copy2(src, os.path.join(partial_dir, os.path.basename(src)))
+
+        # Copy the contents of system_base into the hidden directory
+        if os.path.exists(context.system_base_dir):
+            for item in os.listdir(context.system_base_dir):
+                src_path = os.path.join(context.system_base_dir, item)
+                dest_path = os.path.join(partial_dir, item)
+                if os.path.isdir(src_path):
+                    shutil.copytree(
+                        src_path,
+                        dest_path,
+                        copy_function=lambda s, d: link_or_copy(s, d, link_mode),
+                        dirs_exist_ok=True
+                    )
+                else:
+                    link_or_copy(src_path, dest_path, link_mode)
+
+        # Handle kick_name logic for WHDLoad games
+        if needs_kickstart:
+            copy_kickstart_file(context, effective_kick_name, partial_dir, link_mode)
+
+        if os.path.exists(dest_dir):
+            shutil.rmtree(dest_dir)
+        os.rename(partial_dir, dest_dir)
+
+    write_game_config(context, manifest, output_key, game, catalog, data_fingerprint, copied)
+    return output_key, expand_dir_name, copied
+
+def finish_whdload_games(context, dir_to_archive_map, manifest, processed_dirs, seen_keys, copied_games):
+    """Report expanded directories without slaves and remove the outputs of deleted WHDLoad games."""
     # Check for unprocessed directories
     unprocessed_dirs = set(dir_to_archive_map.keys()) - processed_dirs
     for unprocessed_dir in unprocessed_dirs:
         print(f"[ERROR] No database entry found for expanded directory: {unprocessed_dir}")
+        context.stats.add_failure("place", unprocessed_dir, "no database entry found")
+
+    remove_stale_outputs(context, manifest, "whdload:", seen_keys)
+    print(f"[INFO] Copied {copied_games} new or changed WHDLoad games, {len(seen_keys) - copied_games} unchanged.")
+
+def process_database(context, scan_results, dir_to_archive_map, catalog, manifest, system_base_fingerprint, stream=False, link_mode="copy"):
+    """Process the slave scan results and handle WHDLoad games with kick_name and overrides logic."""
+    processed_dirs = set()  # Track directories processed from the database
+    seen_keys = set()  # Track manifest output keys produced by this run, filled in by place_whdload_game
+    copied_games = 0
+
+    for row in scan_results:
+        start = time.perf_counter()
+        placed = place_whdload_game(context, row, dir_to_archive_map, catalog, manifest, system_base_fingerprint, seen_keys, stream, link_mode)
+        if placed:
+            output_key, expand_dir_name, copied = placed
+            processed_dirs.add(expand_dir_name)  # Mark directory as processed
+            copied_games += copied
+            context.stats.add_game_time(output_key, time.perf_counter() - start)
+
+    finish_whdload_games(context, dir_to_archive_map, manifest, processed_dirs, seen_keys, copied_games)
+
+def run_pipeline(context, catalog, manifest, system_base_fingerprint, jobs=1, stream=False, link_mode="copy"):
+    """
+    Build the WHDLoad games as a pipeline: each archive flows extract -> scan -> place/generate
+    on its own, so the first games are finished while later archives are still being extracted.
+
+    Extraction runs on a thread pool and scanning on the SlaveScanner process pool; the main
+    thread merges extracted archives and places games as events arrive. At most 2 * jobs
+    extracted archives wait to be placed, bounding the disk space used by pending games.
+
+    Returns:
+        dict: The dir_to_archive_map of all expanded archives.
+    """
+    dir_to_archive_map, pending, total_archives = plan_archive_extraction(context, manifest, stream)
+    unchanged_archives = len(dir_to_archive_map)
+    scanner = SlaveScanner(context, manifest, jobs)
+    events = queue.Queue()
+    slots = threading.Semaphore(max(1, jobs) * 2)  # Extracted games not yet placed
+    temp_root = context.staging_dir if stream else context.expand_dir
+
+    processed_dirs = set()
+    seen_keys = set()
+    copied_games = 0
+    failed_archives = []
+    successful_expansions = unchanged_archives
+    outstanding_scans = 0
+
+    def place(results):
+        nonlocal copied_games
+        for row in results:
+            start = time.perf_counter()
+            placed = place_whdload_game(context, row, dir_to_archive_map, catalog, manifest, system_base_fingerprint, seen_keys, stream, link_mode)
+            if placed:
+                output_key, expand_dir_name, copied = placed
+                processed_dirs.add(expand_dir_name)
+                copied_games += copied
+                context.stats.add_game_time(output_key, time.perf_counter() - start)
+
+    def start_game(game_dir, extracted):
+        """Place a game whose slaves are all cached, or send it to the scanner; return 1 if a scan was started."""
+        results, uncached = scanner.add_game(game_dir)
+        if uncached:
+            future = scanner.submit(game_dir, uncached)
+            future.add_done_callback(lambda f: events.put(("scanned", game_dir, f, extracted)))
+            return 1
+        place(results)
+        if extracted:
+            slots.release()
+        return 0
+
+    def feed_extractions(executor):
+        for file in sorted(pending):
+            slots.acquire()
+            future = executor.submit(extract_archive_to_temp, context, file, temp_root)
+            future.add_done_callback(lambda f, file=file: events.put(("extracted", file, f)))
+
+    # Unchanged archives go straight to the scan stage
+    for game_dir in sorted(dir_to_archive_map):
+        outstanding_scans += start_game(game_dir, False)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        feeder = threading.Thread(target=feed_extractions, args=(executor,), daemon=True)
+        feeder.start()
+        remaining_extractions = len(pending)
+        while remaining_extractions or outstanding_scans:
+            event = events.get()
+            if event[0] == "extracted":
+                _, file, future = event
+                remaining_extractions -= 1
+                try:
+                    temp_dir, expanded_dirs_in_temp = future.result()
+                except (subprocess.CalledProcessError, OSError) as e:
+                    report_extraction_failure(context, file, e)
+                    failed_archives.append(file)
+                    slots.release()
+                    continue
+                game_dir = merge_extracted_archive(context, manifest, file, pending[file], temp_dir, expanded_dirs_in_temp, dir_to_archive_map, stream)
+                if game_dir is None:
+                    slots.release()
+                    continue
+                successful_expansions += 1
+                outstanding_scans += start_game(game_dir, True)
+            else:
+                _, game_dir, future, extracted = event
+                outstanding_scans -= 1
+                place(scanner.collect(game_dir, future))
+                if extracted:
+                    slots.release()
+        feeder.join()
+
+    print_extraction_summary(context, successful_expansions, total_archives, unchanged_archives, failed_archives)
+    scanner.close()
+    finish_whdload_games(context, dir_to_archive_map, manifest, processed_dirs, seen_keys, copied_games)
+    return dir_to_archive_map
+
+def stage_file(context, manifest, src, dest, link_mode="copy", verify=False):
+    """
+    Stage an input file into a game directory unless an identical file is already there.
+
+    A hardlinked file is only identical when it is the input itself, and a copied one only when
+    it is not, so switching --link re-stages every file; reflinks are always cloned again,
+    which is cheap, as a clone cannot be told from a copy.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest holding the file hash cache.
+        src (str): The input file (.adf, .cue, .bin...).
+        dest (str): The file in the hidden game directory.
+        link_mode (str): Copy, hardlink or reflink the file (see LINK_MODES).
+        verify (bool): Read the staged file back and compare its SHA-1 with the input's.
+
+    Returns:
+        bool: Whether the file was written.
+    """
+    if os.path.exists(dest) and (
+        os.path.samefile(src, dest) if link_mode == "hardlink"
+        else link_mode == "copy" and not os.path.samefile(src, dest)
+        and os.path.getsize(src) == os.path.getsize(dest) and hash_file(context, manifest, dest) == hash_file(context, manifest, src)
+    ):
+        context.stats.count("staged_files_unchanged")
+        return False
+    # Stage next to the file and rename, so an interrupted build never leaves a truncated image
+    partial_path = f"{dest}.partial"
+    link_or_copy(src, partial_path, link_mode)
+    context.stats.count("staged_files_written")
+    if verify:
+        if sha1_file(partial_path) != hash_file(context, manifest, src):
+            os.remove(partial_path)
+            raise IOError(f"Checksum mismatch after staging {src} to {dest}")
+        context.stats.count("staged_files_verified")
+    os.replace(partial_path, dest)
+    return True
+
+def stage_files(context, manifest, sources, dest_dir, link_mode="copy", verify=False):
+    """Make dest_dir hold exactly the given files (name -> source path), writing only those that differ."""
+    os.makedirs(dest_dir, exist_ok=True)
+    for name in os.listdir(dest_dir):
+        if name not in sources:
+            remove_output(context, os.path.relpath(os.path.join(dest_dir, name), context.output_dir))
+    for name, src in sources.items():
+        stage_file(context, manifest, src, os.path.join(dest_dir, name), link_mode, verify)
+
+def run_staging_jobs(context, phase, tasks, jobs=1):
+    """
+    Run the games of the ADF or ISO phase on a thread pool.
+
+    Copying is done by the kernel and hashing by hashlib, both outside the GIL, so several
+    games are staged at once. A game that fails keeps the outputs of the previous build.
 
-def process_adf_files(game_name_map):
-    """Process .adf files and directories containing .adf files."""
-    ADF_DIR = os.path.join(BASE_DIR, "adf")  # Directory containing .adf files
-    if not os.path.exists(ADF_DIR):
-        print(f"[ERROR] ADF directory not found: {ADF_DIR}")
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        phase (str): The phase name, for the build report.
+        tasks (list): (output key, function, args) tuples; function returns the output key or None.
+        jobs (int): The number of games staged concurrently.
+
+    Returns:
+        set: The output keys of the games that still have inputs.
+    """
+    def run(function, args):
+        start = time.perf_counter()
+        output_key = function(*args)
+        if output_key:
+            context.stats.add_game_time(output_key, time.perf_counter() - start)
+        return output_key
+
+    seen_keys = set()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {executor.submit(run, function, args): key for key, function, args in tasks}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                output_key = future.result()
+            except (IOError, OSError) as e:
+                print(f"[ERROR] Failed to stage {key}: {e}")
+                context.stats.add_failure(phase, key, str(e))
+                seen_keys.add(key)
+                continue
+            if output_key:
+                seen_keys.add(output_key)
+    return seen_keys
+
+def process_adf_files(context, catalog, manifest, jobs=1, link_mode="copy", verify=False):
+    """Process .adf files and directories containing .adf files, staging up to jobs games at once."""
+    if not os.path.exists(context.adf_dir):
+        print(f"[ERROR] ADF directory not found: {context.adf_dir}")
         return
 
-    for item in os.listdir(ADF_DIR):
-        item_path = os.path.join(ADF_DIR, item)
+    tasks = []
+    for item in sorted(os.listdir(context.adf_dir)):
+        item_path = os.path.join(context.adf_dir, item)
 
         # Determine if it's a single .adf file or a directory
         if os.path.isfile(item_path) and item.lower().endswith(".adf"):
             # Single .adf file
-            process_single_adf(item_path, game_name_map)
+            tasks.append((f"adf:{item}", process_single_adf, (context, item_path, catalog, manifest, link_mode, verify)))
         elif os.path.isdir(item_path):
             # Directory containing multiple .adf files
-            process_adf_directory(item_path, game_name_map)
+            tasks.append((f"adf:{item}", process_adf_directory, (context, item_path, catalog, manifest, link_mode, verify)))
         else:
             print(f"[WARN] Skipping unsupported item in ADF directory: {item_path}")
 
+    seen_keys = run_staging_jobs(context, "adf", tasks, jobs)
+    remove_stale_outputs(context, manifest, "adf:", seen_keys)
+
 
-def process_single_adf(adf_path, game_override_map):
-    """Process a single .adf file."""
+def process_single_adf(context, adf_path, catalog, manifest, link_mode="copy", verify=False):
+    """Process a single .adf file and return its manifest output key."""
     base_name = os.path.splitext(os.path.basename(adf_path))[0]
     is_aga = "AGA" in base_name.upper()
     system_type = "aga" if is_aga else "ecs"
-    dest_base = AMIGA1200_DIR if is_aga else AMIGA600_DIR
+    dest_base = context.amiga1200_dir if is_aga else context.amiga600_dir
     hidden_dir = f".{base_name}"
     dest_dir = os.path.join(dest_base, hidden_dir)
 
-    # Create the hidden directory and copy the .adf file
-    os.makedirs(dest_dir, exist_ok=True)
-    shutil.copy2(adf_path, dest_dir)
-
-    # Determine the game name and settings overrides
+    # The game name and settings overrides are looked up by the .adf file name
     archive_name = os.path.basename(adf_path)
-    game_info = game_override_map.get(archive_name, {})
-    game_name_override = game_info.get("game_name_override")
-    game_settings_overrides = game_info.get("game_settings_overrides", {})
-
-    # Use game_name_override if set, otherwise fallback to the base name
-    uae_base_name = game_name_override if game_name_override else base_name
-
-    # Generate the .uae file
-    generate_uae_file(
-        uae_base_name,
-        dest_base,
-        hidden_dir,
-        system_type,
-        "adf",
-        adf_files=[os.path.basename(adf_path)],
-        uae_config_map=game_info.get("uae_config", {})
-    )
-
-
-def process_adf_directory(adf_dir, game_override_map):
-    """Process a directory containing multiple .adf files."""
+    game = {
+        "archive": archive_name,
+        "name": base_name,
+        "system": system_type,
+        "format": "adf",
+        "dest": os.path.basename(dest_base),
+        "hidden_dir": hidden_dir,
+        "adf_files": [archive_name],
+    }
+
+    output_key = f"adf:{archive_name}"
+    data_fingerprint = fingerprint(hash_file(context, manifest, adf_path), dest_dir, link_mode)
+    copied = not data_is_current(context, manifest, output_key, data_fingerprint)
+    if copied:
+        # Stage the .adf file into the hidden directory
+        stage_files(context, manifest, {archive_name: adf_path}, dest_dir, link_mode, verify)
+
+    write_game_config(context, manifest, output_key, game, catalog, data_fingerprint, copied)
+    return output_key
+
+
+def process_adf_directory(context, adf_dir, catalog, manifest, link_mode="copy", verify=False):
+    """Process a directory containing multiple .adf files and return its manifest output key."""
+    output_key = f"adf:{os.path.basename(adf_dir)}"
     adf_files = sorted([f for f in os.listdir(adf_dir) if f.lower().endswith(".adf")])
     if not adf_files:
         print(f"[WARN] No .adf files found in directory: {adf_dir}")
-        return
+        return output_key
 
     # Use the base name of the first alphabetical .adf file
     first_adf = adf_files[0]
     base_name = os.path.splitext(first_adf)[0]
     is_aga = "AGA" in adf_dir.upper()
     system_type = "aga" if is_aga else "ecs"
-    dest_base = AMIGA1200_DIR if is_aga else AMIGA600_DIR
+    dest_base = context.amiga1200_dir if is_aga else context.amiga600_dir
     hidden_dir = f".{base_name}"
     dest_dir = os.path.join(dest_base, hidden_dir)
 
-    # Create the hidden directory and copy all .adf files
-    os.makedirs(dest_dir, exist_ok=True)
-    for adf_file in adf_files:
-        shutil.copy2(os.path.join(adf_dir, adf_file), dest_dir)
-
-    # Determine the game name and settings overrides
-    archive_name = os.path.basename(adf_files[0])
-    game_info = game_override_map.get(archive_name, {})
-    game_name_override = game_info.get("game_name_override")
-    game_settings_overrides = game_info.get("game_settings_overrides", {})
-
-    # Use game_name_override if set, otherwise fallback to the base name
-    uae_base_name = game_name_override if game_name_override else base_name
-
-    # Generate the .uae file
-    generate_uae_file(uae_base_name, dest_base, hidden_dir, system_type, "adf", adf_files, uae_config_map=game_info.get("uae_config", {}))
-
-def process_iso_files(game_override_map):
+    # The game name and settings overrides are looked up by the first .adf file name
+    game = {
+        "archive": os.path.basename(adf_files[0]),
+        "name": base_name,
+        "system": system_type,
+        "format": "adf",
+        "dest": os.path.basename(dest_base),
+        "hidden_dir": hidden_dir,
+        "adf_files": adf_files,
+    }
+
+    data_fingerprint = fingerprint(hash_tree(context, manifest, adf_dir), dest_dir, link_mode)
+    copied = not data_is_current(context, manifest, output_key, data_fingerprint)
+    if copied:
+        # Stage all .adf files, keeping those already identical in the hidden directory
+        stage_files(context, manifest, {f: os.path.join(adf_dir, f) for f in adf_files}, dest_dir, link_mode, verify)
+
+    write_game_config(context, manifest, output_key, game, catalog, data_fingerprint, copied)
+    return output_key
+
+def process_iso_files(context, catalog, manifest, jobs=1, link_mode="copy", verify=False, chd=False):
     """
-    Process subdirectories in the ISO directory for CD32 games.
+    Process subdirectories in the ISO directory for CD32 games, staging up to jobs games at once.
     Each subdirectory contains a .cue file and other files.
+
+    With chd set, games using PUAE are staged as a single CHD image converted by convert_to_chd
+    (see process_iso_directory); cached images no longer used by any game are removed afterwards.
     """
-    ISO_DIR = os.path.join(BASE_DIR, "iso")  # Directory containing subdirectories for CD32 games
-    if not os.path.exists(ISO_DIR):
-        print(f"[ERROR] ISO directory not found: {ISO_DIR}")
+    if not os.path.exists(context.iso_dir):
+        print(f"[ERROR] ISO directory not found: {context.iso_dir}")
         return
 
-    for subdir in os.listdir(ISO_DIR):
-        subdir_path = os.path.join(ISO_DIR, subdir)
+    chd_images = set() if chd else None
+    tasks = []
+    for subdir in sorted(os.listdir(context.iso_dir)):
+        subdir_path = os.path.join(context.iso_dir, subdir)
         if not os.path.isdir(subdir_path):
             print(f"[WARN] Skipping non-directory item in ISO directory: {subdir_path}")
             continue
+        tasks.append((f"iso:{subdir}", process_iso_directory, (context, subdir_path, catalog, manifest, link_mode, verify, chd_images)))
 
-        # Find the .cue file in the subdirectory
-        cue_files = [f for f in os.listdir(subdir_path) if f.lower().endswith(".cue")]
-        if len(cue_files) != 1:
-            print(f"[ERROR] Skipping {subdir_path}: Expected exactly one .cue file, found {len(cue_files)}")
-            continue
-
-        cue_file = cue_files[0]
-        base_name = os.path.splitext(cue_file)[0]  # Base name of the .cue file
-        hidden_dir = f".{base_name}"  # Hidden directory name
-        dest_dir = os.path.join(CD32_DIR, hidden_dir)  # Destination hidden directory
+    seen_keys = run_staging_jobs(context, "iso", tasks, jobs)
+    remove_stale_outputs(context, manifest, "iso:", seen_keys)
+    if chd_images is not None and os.path.isdir(context.chd_cache_dir):
+        for name in os.listdir(context.chd_cache_dir):
+            if os.path.join(context.chd_cache_dir, name) not in chd_images:
+                os.remove(os.path.join(context.chd_cache_dir, name))
 
-        # Create the hidden directory and copy all files from the original subdirectory
-        os.makedirs(dest_dir, exist_ok=True)
-        for file in os.listdir(subdir_path):
-            src_path = os.path.join(subdir_path, file)
-            dest_path = os.path.join(dest_dir, file)
-            shutil.copy2(src_path, dest_path)
+def convert_to_chd(context, cue_path, source_sha1):
+    """
+    Convert a cue/bin set to a CHD image with chdman, reusing the cached image of the same input.
 
-        # Determine the game name and settings overrides
-        archive_name = cue_file
-        game_info = game_override_map.get(archive_name, {})
-        game_name_override = game_info.get("game_name_override")
-        game_settings_overrides = game_info.get("game_settings_overrides", {})
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        cue_path (str): The .cue file of the game.
+        source_sha1 (str): The hash_tree of the game's directory, naming the cached image.
 
-        # Use game_name_override if set, otherwise fallback to the base name
-        uae_base_name = game_name_override if game_name_override else base_name
+    Returns:
+        str: The cached .chd file.
+    """
+    chd_path = os.path.join(context.chd_cache_dir, f"{source_sha1}.chd")
+    if os.path.exists(chd_path):
+        context.stats.count("chd_cache_hits")
+        return chd_path
+    context.stats.count("chd_cache_misses")
+    os.makedirs(context.chd_cache_dir, exist_ok=True)
+    temp_path = f"{chd_path}.tmp"
+    start = time.perf_counter()
+    try:
+        subprocess.run([CHDMAN, "createcd", "-f", "-i", cue_path, "-o", temp_path], check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, OSError) as e:
+        context.stats.add_subprocess("chdman", cue_path, time.perf_counter() - start, getattr(e, "returncode", None))
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise IOError(f"chdman failed for {cue_path}: {(getattr(e, 'stderr', None) or str(e)).strip()}")
+    context.stats.add_subprocess("chdman", cue_path, time.perf_counter() - start)
+    os.replace(temp_path, chd_path)
+    return chd_path
+
+def process_iso_directory(context, subdir_path, catalog, manifest, link_mode="copy", verify=False, chd_images=None):
+    """
+    Process one CD32 game directory and return its manifest output key, or None if it was skipped.
 
-        # Generate the .uae file
-        generate_uae_file(
-            uae_base_name,
-            CD32_DIR,
-            hidden_dir,
-            "cd32",
-            "cd32",
-            cue_file=cue_file,
-            uae_config_map=game_info.get("uae_config", {})
-        )
+    If chd_images is a set and the game's emulator and every variant emulator read CHD images
+    (CHD_EMULATORS), the game is staged as a CHD image and the cached image it uses is added to
+    the set; other games, including those on the default core, keep their cue/bin files.
+    """
+    # Find the .cue file in the subdirectory
+    cue_files = [f for f in os.listdir(subdir_path) if f.lower().endswith(".cue")]
+    if len(cue_files) != 1:
+        print(f"[ERROR] Skipping {subdir_path}: Expected exactly one .cue file, found {len(cue_files)}")
+        context.stats.add_failure("iso", subdir_path, f"expected exactly one .cue file, found {len(cue_files)}")
+        return None
+
+    cue_file = cue_files[0]
+    base_name = os.path.splitext(cue_file)[0]  # Base name of the .cue file
+    hidden_dir = f".{base_name}"  # Hidden directory name
+    dest_dir = os.path.join(context.cd32_dir, hidden_dir)  # Destination hidden directory
+
+    # The game name and settings overrides are looked up by the .cue file name
+    game = {
+        "archive": cue_file,
+        "name": base_name,
+        "system": "cd32",
+        "format": "cd32",
+        "dest": os.path.basename(context.cd32_dir),
+        "hidden_dir": hidden_dir,
+        "cue_file": cue_file,
+    }
+
+    output_key = f"iso:{os.path.basename(subdir_path)}"
+    source_fingerprint = hash_tree(context, manifest, subdir_path)
+    use_chd = chd_images is not None and all(
+        emulator in CHD_EMULATORS for emulator in (catalog.get(cue_file).emulator, *catalog.variant_emulators)
+    )
+    if use_chd:
+        game["cue_file"] = f"{base_name}.chd"  # cdimage0 points at the converted image
+        chd_path = os.path.join(context.chd_cache_dir, f"{source_fingerprint}.chd")
+        chd_images.add(chd_path)
+        data_fingerprint = fingerprint(source_fingerprint, dest_dir, "chd", link_mode)
+    else:
+        data_fingerprint = fingerprint(source_fingerprint, dest_dir, link_mode)
+    copied = not data_is_current(context, manifest, output_key, data_fingerprint)
+    if copied and use_chd:
+        # Link the cached image into the hidden directory; the cache is ours, so sharing its inode is safe
+        convert_to_chd(context, os.path.join(subdir_path, cue_file), source_fingerprint)
+        chd_link_mode = "reflink" if link_mode == "reflink" else "hardlink"
+        stage_files(context, manifest, {game["cue_file"]: chd_path}, dest_dir, chd_link_mode, verify)
+    elif copied:
+        # Stage all files of the original subdirectory; unchanged tracks are not copied again
+        files = sorted(f for f in os.listdir(subdir_path) if os.path.isfile(os.path.join(subdir_path, f)))
+        stage_files(context, manifest, {f: os.path.join(subdir_path, f) for f in files}, dest_dir, link_mode, verify)
+
+    write_game_config(context, manifest, output_key, game, catalog, data_fingerprint, copied)
+    return output_key
 
 def is_valid_kick_name(kick_name):
     """Validate the kick_name format: nnnnn.a*."""
-    import re
     return bool(re.fullmatch(r"\d{5}\.a.*", kick_name, re.IGNORECASE))
 
-def copy_kickstart_file(kick_name, dest_dir):
+def copy_kickstart_file(context, kick_name, dest_dir, link_mode="copy"):
     """
     Copy the kickstart file and its corresponding .RTB file from the kickstart directory
     to the Devs/Kickstarts directory.
 
     Args:
+        context (BuildContext): The paths, statistics and journal of the build.
         kick_name (str): The validated kick_name (e.g., "34005.a500").
         dest_dir (str): The destination directory (hidden folder).
+        link_mode (str): Copy, hardlink or reflink the files (see LINK_MODES).
     """
-    kickstart_dir = os.path.join(BASE_DIR, "kickstart")
+    kickstart_dir = context.kickstart_dir
     kickstarts_dir = os.path.join(dest_dir, "Devs", "Kickstarts")
     os.makedirs(kickstarts_dir, exist_ok=True)
 
@@ -496,7 +2027,7 @@ def copy_kickstart_file(kick_name, dest_dir):
 
     # Copy the kickstart file
     if os.path.exists(source_file):
-        shutil.copy2(source_file, dest_file)
+        link_or_copy(source_file, dest_file, link_mode)
     else:
         print(f"[WARN] Kickstart file not found: {source_file}")
 
@@ -506,60 +2037,714 @@ def copy_kickstart_file(kick_name, dest_dir):
 
     # Copy the .RTB file
     if os.path.exists(source_rtb_file):
-        shutil.copy2(source_rtb_file, dest_rtb_file)
+        link_or_copy(source_rtb_file, dest_rtb_file, link_mode)
     else:
         print(f"[WARN] RTB file not found: {source_rtb_file}")
 
-def write_retroarch_overrides(game_override_map):
+def is_selected_game(games, archive_name, record, default_name=None):
+    """Check whether a game is named in games by archive name (with or without extension) or game name."""
+    if games is None:
+        return True
+    names = {record.game_name or None, default_name}
+    if archive_name:
+        names.update([archive_name, os.path.splitext(archive_name)[0]])
+    return not games.isdisjoint(names - {None})
+
+def retroarch_config_path(context, record):
+    """Return the RetroArch override file of a game: config/<emulator>/<game name>.cfg."""
+    emulator = record.emulator or "default_emulator"  # Default to "default_emulator" if not set
+    return os.path.join(context.config_dir, emulator, f"{record.display_name()}.cfg")  # Use game name or archive name
+
+def write_retroarch_overrides(context, catalog, games=None):
     """
     Write RetroArch overrides for each game in the override map.
 
     Args:
-        game_override_map (dict): The map containing game overrides.
+        context (BuildContext): The paths, statistics and journal of the build.
+        catalog (GameCatalog): The games loaded from games.csv.
+        games (set, optional): Only write the overrides of these games (see is_selected_game).
+
+    Returns:
+        list: The override files of the selected games, written or already up to date.
     """
     print("Writing RetroArch overrides...")
-    for archive_name, game_info in game_override_map.items():
-        retroarch_config = game_info.get("retroarch_config", {})
-        emulator = game_info.get("emulator", "default_emulator")  # Default to "default_emulator" if not set
-        game_name = game_info.get("game_name_override", os.path.splitext(archive_name)[0])  # Use game name or archive name
+    config_files = []
+    for record in catalog:
+        if not is_selected_game(games, record.archive_name, record):
+            continue
+        retroarch_config = record.retroarch_config
 
         if retroarch_config:
             # Construct the path for the RetroArch config file
-            emulator_config_dir = os.path.join(CONFIG_DIR, emulator)
-            os.makedirs(emulator_config_dir, exist_ok=True)
-            config_file_path = os.path.join(emulator_config_dir, f"{game_name}.cfg")
+            config_file_path = retroarch_config_path(context, record)
+            os.makedirs(os.path.dirname(config_file_path), exist_ok=True)
 
-            # Write the RetroArch overrides to the file
+            # Write the RetroArch overrides to the file, in the format key = "value"
             try:
-                with open(config_file_path, "w", encoding="utf-8") as config_file:
-                    for key, value in retroarch_config.items():
-                        # Ensure the format is key = "value"
-                        config_file.write(f'{key} = "{value}"\n')
+                write_if_changed(context, config_file_path, "".join(f'{key} = "{value}"\n' for key, value in retroarch_config.items()))
+                config_files.append(config_file_path)
             except IOError as e:
                 print(f"[ERROR] Failed to write RetroArch config {config_file_path}: {e}")
+                context.stats.add_failure("write", config_file_path, e)
+    return config_files
+
+def write_puae_core_options(context, manifest, catalog, games=None):
+    """
+    Write the RetroArch core options of the PUAE variants: config/PUAE/<game name>.opt selecting the Amiga model.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest; its outputs list the placed games.
+        catalog (GameCatalog): The games loaded from games.csv.
+        games (set, optional): Only write the options of these games (see is_selected_game).
+
+    Returns:
+        list: The options files of the selected games, written or already up to date.
+    """
+    config_files = []
+    if "puae" not in catalog.variant_emulators:
+        return config_files
+    for key, entry in sorted(manifest["outputs"].items()):
+        game = entry.get("game")
+        if not game:
+            continue
+        record = catalog.get(game["archive"])
+        if not is_selected_game(games, game["archive"], record, game["name"]):
+            continue
+        options_path = os.path.join(context.config_dir, UAE_EMULATORS["puae"], f"{record.game_name or game['name']}.opt")
+        os.makedirs(os.path.dirname(options_path), exist_ok=True)
+        try:
+            write_if_changed(context, options_path, f'puae_model = "{PUAE_MODELS[game["system"]]}"\n')
+            config_files.append(options_path)
+        except IOError as e:
+            print(f"[ERROR] Failed to write PUAE core options {options_path}: {e}")
+            context.stats.add_failure("write", options_path, e)
+    return config_files
+
+def record_config_outputs(context, manifest, config_files, complete):
+    """
+    Record the files of the config phase in the manifest and remove those it no longer writes.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest; its "configs" list holds the files of the previous config phase.
+        config_files (list): The files written or found up to date by this config phase.
+        complete (bool): Whether the phase covered every game; a phase restricted with --games
+            only adds its files, as the other games' files were not looked at.
+    """
+    rel_paths = {os.path.relpath(path, context.output_dir) for path in config_files}
+    previous = set(manifest.get("configs", []))
+    if complete:
+        for rel_path in sorted(previous - rel_paths):
+            remove_output(context, rel_path)
+            try:
+                os.rmdir(os.path.dirname(os.path.join(context.output_dir, rel_path)))  # config/<emulator>, once its last file is gone
+            except OSError:
+                pass
+    else:
+        rel_paths |= previous
+    manifest["configs"] = sorted(rel_paths)
+
+# --- Gamelists ---
+def load_gamelist_index(context):
+    """Load the game metadata written by the previous gamelist phase, or an empty index if it is missing or outdated."""
+    try:
+        with open(context.gamelist_index_file, encoding="utf-8") as f:
+            index = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    return index.get("games", {}) if index.get("version") == GAMELIST_INDEX_VERSION else {}
+
+def gamelist_entry(context, entry, record, cached=None):
+    """
+    Build the gamelist metadata of one placed game.
+
+    The slave scan results are only known when the WHDLoad phase ran in this process;
+    otherwise those of the cached entry are kept.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        entry (dict): The game's manifest output entry.
+        record (GameRecord): The game's catalog record.
+        cached (dict, optional): The game's entry in the previous gamelist index.
+
+    Returns:
+        dict: The system directory, .uae path, name and description of the game, with its slaves and
+            emulator variants (path, emulator, core), or None if the game has no .uae file.
+    """
+    game = entry["game"]
+    system_dir = os.path.relpath(os.path.join(context.roms_dir, game["dest"]), context.output_dir)
+    uae_files = [f for f in entry["files"] if f.endswith(".uae") and os.path.dirname(f) == system_dir]
+    if not uae_files:
+        return None
+    variants = []
+    for variant, name in UAE_EMULATORS.items():
+        variant_file = os.path.join(system_dir, name, os.path.basename(uae_files[0]))
+        if variant_file in entry["files"]:
+            emulator, core = EMULATOR_CORES[variant]
+            variants.append({"path": f"./{name}/{os.path.basename(variant_file)}", "label": name, "emulator": emulator, "core": core})
+    slaves = [list(slave) for slave in record.slaves] or (cached or {}).get("slaves", [])
+
+    desc = [f"Hardware: {record.hardware or game['system'].upper()}"]
+    if record.notes:
+        desc.append(record.notes)
+    if record.codes:
+        desc.append(f"Codes: {record.codes}")
+    for path, flags, kick_name in slaves:
+        details = [flags.replace(",", ", ")] if flags else []
+        if kick_name:
+            details.append(f"kickstart {kick_name}")
+        desc.append(f"Slave: {os.path.basename(path)}" + (f" ({'; '.join(details)})" if details else ""))
+    return {
+        "system": game["dest"],
+        "path": f"./{os.path.basename(uae_files[0])}",
+        "name": record.game_name or game["name"],
+        "desc": "\n".join(desc),
+        "slaves": slaves,
+        "variants": variants,
+    }
+
+def render_gamelist(entries):
+    """
+    Render the gamelist.xml of one system directory, in the layout EmulationStation writes.
+
+    Emulator variants are listed as games of their own that override the emulator and core.
+    """
+    lines = ['<?xml version="1.0"?>', "<gameList>"]
+    for entry in sorted(entries, key=lambda e: (e["name"].lower(), e["path"])):
+        games = [{"path": entry["path"], "name": entry["name"]}] + [
+            {"path": v["path"], "name": f"{entry['name']} ({v['label']})", "emulator": v["emulator"], "core": v["core"]}
+            for v in entry.get("variants", [])
+        ]
+        for game in games:
+            lines.append("\t<game>")
+            for field in ("path", "name", "desc", "emulator", "core"):
+                value = entry["desc"] if field == "desc" else game.get(field)
+                if value is not None:
+                    lines.append(f"\t\t<{field}>{escape(value)}</{field}>")
+            lines.append("\t</game>")
+    lines.append("</gameList>")
+    return "\n".join(lines) + "\n"
+
+def write_gamelists(context, manifest, catalog):
+    """
+    Write the gamelist.xml of amiga600, amiga1200 and amigacd32 from games.csv and the slave scan results.
+
+    EmulationStation then finds every game without scanning the hidden game directories.
+    The metadata of each game is kept in gamelist_index.json between runs, and a gamelist.xml
+    is only rewritten when one of its entries changed.
+
+    Args:
+        context (BuildContext): The paths, statistics and journal of the build.
+        manifest (dict): The build manifest; its outputs list the placed games.
+        catalog (GameCatalog): The games loaded from games.csv.
+    """
+    cached_index = load_gamelist_index(context)
+    index = {}
+    for key, entry in sorted(manifest["outputs"].items()):
+        if not entry.get("game"):
+            continue  # Built before game details were recorded; the next data build records them
+        metadata = gamelist_entry(context, entry, catalog.get(entry["game"]["archive"]), cached_index.get(key))
+        if metadata:
+            index[key] = metadata
+
+    for system_dir in (context.amiga600_dir, context.amiga1200_dir, context.cd32_dir):
+        gamelist_path = os.path.join(system_dir, "gamelist.xml")
+        entries = [metadata for metadata in index.values() if metadata["system"] == os.path.basename(system_dir)]
+        if entries:
+            os.makedirs(system_dir, exist_ok=True)
+            write_if_changed(context, gamelist_path, render_gamelist(entries))
+        elif os.path.exists(gamelist_path):
+            os.remove(gamelist_path)
+
+    changed = sum(1 for key in set(index) | set(cached_index) if index.get(key) != cached_index.get(key))
+    if changed:
+        write_if_changed(context, context.gamelist_index_file, json.dumps({"version": GAMELIST_INDEX_VERSION, "games": index}, indent=1, sort_keys=True))
+    print(f"[INFO] Gamelists hold {len(index)} games, {changed} changed.")
+
+# --- Watch Mode ---
+def diff_game_overrides(old_catalog, new_catalog):
+    """Return the archive names whose games.csv rows were added, removed or changed."""
+    old = {record.archive_name: record.settings() for record in old_catalog if record.in_csv}
+    new = {record.archive_name: record.settings() for record in new_catalog if record.in_csv}
+    return {name for name in set(old) | set(new) if old.get(name) != new.get(name)}
+
+def snapshot_tree(path):
+    """Map every file and directory below path (or path itself) to its size and mtime."""
+    snapshot = {}
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return {path: (stat.st_size, stat.st_mtime_ns)}
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            file_path = os.path.join(root, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue  # Removed while walking
+            snapshot[file_path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+def poll_changes(paths, interval=WATCH_POLL_INTERVAL):
+    """Yield the set of changed files below paths, comparing size and mtime snapshots every interval seconds."""
+    def scan():
+        snapshot = {}
+        for path in paths:
+            if os.path.exists(path):
+                snapshot.update(snapshot_tree(path))
+        return snapshot
+
+    previous = scan()
+    while True:
+        time.sleep(interval)
+        current = scan()
+        changed = {path for path in set(previous) | set(current) if previous.get(path) != current.get(path)}
+        previous = current
+        if changed:
+            yield changed
+
+def inotify_changes(paths, timeout=None):
+    """
+    Yield the set of changed files below paths as reported by Linux inotify.
+
+    Directories are watched recursively, including directories created later; a watched file
+    is watched through its parent directory so that replacing it (as copycsv does) is seen.
+    Raises OSError if inotify is not available.
+    """
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, "inotify_init1"):
+        raise OSError("inotify is not available")
+    fd = libc.inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    watches = {}  # Watch descriptor -> directory
+    watched_dirs = [path for path in paths if os.path.isdir(path)]
+    watched_files = {path for path in paths if not os.path.isdir(path)}
+
+    def is_watched(path):
+        return path in watched_files or any(path == d or path.startswith(d + os.sep) for d in watched_dirs)
+
+    def add_watch(directory):
+        wd = libc.inotify_add_watch(fd, os.fsencode(directory), mask)
+        if wd >= 0:
+            watches[wd] = directory
+
+    def add_tree(directory):
+        for root, dirs, files in os.walk(directory):
+            add_watch(root)
+
+    for path in paths:
+        if os.path.isdir(path):
+            add_tree(path)
+        elif os.path.isdir(os.path.dirname(path)):
+            add_watch(os.path.dirname(path))
+
+    try:
+        while True:
+            if not select.select([fd], [], [], timeout)[0]:
+                continue
+            data = os.read(fd, 64 * 1024)
+            changed = set()
+            offset = 0
+            while offset < len(data):
+                wd, event_mask, cookie, name_length = struct.unpack_from("iIII", data, offset)
+                name = data[offset + 16:offset + 16 + name_length].rstrip(b"\0")
+                offset += 16 + name_length
+                if event_mask & IN_Q_OVERFLOW:
+                    changed.update(paths)  # Events were lost, treat everything as changed
+                    continue
+                directory = watches.get(wd)
+                if directory is None:
+                    continue
+                if event_mask & IN_IGNORED:
+                    del watches[wd]
+                    continue
+                changed_path = os.path.join(directory, os.fsdecode(name)) if name else directory
+                if not is_watched(changed_path):
+                    continue  # Another file next to a watched file
+                if event_mask & IN_ISDIR and event_mask & (IN_CREATE | IN_MOVED_TO):
+                    add_tree(changed_path)
+                changed.add(changed_path)
+            if changed:
+                yield changed
+    finally:
+        os.close(fd)
+
+def debounced_changes(paths):
+    """
+    Yield batches of changed paths, each collected until no change was seen for WATCH_DEBOUNCE seconds.
+
+    Uses inotify where available and falls back to polling.
+    """
+    events = queue.Queue()
+
+    def produce():
+        try:
+            source = inotify_changes(paths)
+            print("[INFO] Watching for changes with inotify...")
+            for changed in source:
+                events.put(changed)
+        except OSError as e:
+            print(f"[INFO] Watching for changes by polling every {WATCH_POLL_INTERVAL}s ({e})...")
+            for changed in poll_changes(paths):
+                events.put(changed)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        batch = set(events.get())
+        while True:
+            try:
+                batch.update(events.get(timeout=WATCH_DEBOUNCE))
+            except queue.Empty:
+                break
+        yield batch
+
+def run_deploy(option):
+    """Run a delta deploy of the built outputs; return whether it succeeded."""
+    print(f"[INFO] Deploying ({option})...")
+    result = subprocess.run([sys.executable, DEPLOY_SCRIPT, option])
+    if result.returncode != 0:
+        print(f"[ERROR] Deploy failed with status {result.returncode}")
+    return result.returncode == 0
+
+# --- Builder ---
+class Builder:
+    """
+    Build the Recalbox game directories and config files, phase by phase.
+
+    Holds the manifest and overrides of a build so a long-lived process can rerun single phases:
+    the uae phase regenerates .uae/.uae.p2k.cfg files from the game details recorded in the
+    manifest and the config phase rewrites RetroArch overrides, both without touching game data.
+
+    Args:
+        input_dir (str, optional): Root of games.csv and the lha, adf, iso, kickstart and system_base directories.
+        output_dir (str, optional): Root of roms/, config/ and the build's manifest, caches and scratch directories.
+        jobs (int): The number of archives extracted, games scanned and ADF/ISO games staged concurrently.
+        stream (bool): See extract_lha_archives.
+        pipeline (bool): Build WHDLoad games with run_pipeline instead of phase by phase.
+        link_mode (str): One of LINK_MODES.
+        strict (bool): Stop before building anything if validate_overrides finds problems in games.csv.
+        verify (bool): Check the SHA-1 of every staged ADF and ISO file against its input.
+        chd (bool): Stage CD32 games as CHD images (see process_iso_files).
+        variant_emulators (iterable): UAE_EMULATORS keys every game also gets a .uae for (see write_game_config).
+    """
+
+    def __init__(self, input_dir=None, output_dir=None, jobs=1, stream=False, pipeline=False, link_mode="copy", strict=False, verify=False, chd=False, variant_emulators=()):
+        self.context = BuildContext(input_dir, output_dir)
+        self.variant_emulators = tuple(variant_emulators)
+        self.strict = strict
+        self.verify = verify
+        self.chd = chd
+        self.jobs = jobs
+        self.stream = stream
+        self.pipeline = pipeline
+        self.link_mode = link_mode
+        self.manifest = None
+        self.catalog = None
+
+    def prepare(self, phases=BUILD_PHASES, games=None, clean=False, resume=False):
+        """
+        Load the overrides and manifest and clear the outputs that the selected phases rebuild entirely.
+
+        With resume set, the games an interrupted build completed (see BuildJournal) are added to
+        the manifest and nothing is cleared, so the build continues where it stopped.
+        """
+        self.load_overrides()
+        data_phases = set(phases) & set(DATA_PHASES)
+        interrupted = self.context.journal.exists()
+        if interrupted and not resume:
+            print("[INFO] The previous build was interrupted; its unsaved progress is discarded (use --resume to keep it)")
+        if data_phases and not (resume and interrupted) and (clean or not os.path.exists(self.context.manifest_file)):
+            print("Clearing previous output directories...")
+            clear_dir(self.context.expand_dir)
+            clear_dir(self.context.roms_dir)
+            clear_dir(self.context.staging_dir)
+            self.manifest = empty_manifest()
+        else:
+            if data_phases:
+                print("Reusing unchanged outputs from the previous build...")
+            self.manifest = load_manifest(self.context)
+            if resume and interrupted:
+                replayed = self.context.journal.replay(self.manifest)
+                print(f"[INFO] Resuming the interrupted build after {replayed} completed steps")
+        self.context.journal.open()
+        remove_partial_outputs(self.context, self.context.roms_dir, 3)  # roms/<system>/<emulator>/<game>.uae.partial
+        remove_partial_outputs(self.context, self.context.config_dir, 2)
+        if "whdload" in phases:
+            clear_dir(self.context.db_dir)
+        if "config" in phases and games is None and "configs" not in self.manifest:
+            clear_dir(self.context.config_dir)  # No record of the previous config files to remove the stale ones
+        if data_phases:
+            os.makedirs(self.context.expand_dir, exist_ok=True)
+            os.makedirs(self.context.amiga600_dir, exist_ok=True)
+            os.makedirs(self.context.amiga1200_dir, exist_ok=True)
+            os.makedirs(self.context.cd32_dir, exist_ok=True)  # Create CD32 directory
+            print("Output directories prepared.")
+
+    def load_overrides(self):
+        """Load the games.csv overrides and report all their problems before anything is built."""
+        self.catalog = load_game_catalog(self.context, self.variant_emulators)
+        problems = validate_overrides(self.context, self.catalog)
+        report_override_problems(self.context, problems)
+        if problems and self.strict:
+            raise SystemExit("[ERROR] Fix the games.csv problems above or run without --strict")
+
+    def list_games(self, query=None):
+        """
+        Print the catalog: every input and games.csv row with its build status, without building.
+
+        Args:
+            query (str, optional): Only list the games matching this archive, game or directory name (see GameCatalog.find).
+        """
+        self.catalog = load_game_catalog(self.context, self.variant_emulators)
+        self.manifest = load_manifest(self.context)
+        keys = {}  # Archive name -> manifest output key of its input
+        if os.path.isdir(self.context.lha_dir):
+            for file in sorted(os.listdir(self.context.lha_dir)):
+                if file.lower().endswith(".lha"):
+                    keys[file] = f"whdload:{file}"
+        if os.path.isdir(self.context.adf_dir):
+            for item in sorted(os.listdir(self.context.adf_dir)):
+                item_path = os.path.join(self.context.adf_dir, item)
+                if os.path.isfile(item_path) and item.lower().endswith(".adf"):
+                    keys[item] = f"adf:{item}"
+                elif os.path.isdir(item_path):
+                    # Directories are looked up by their first .adf file
+                    adf_files = sorted(f for f in os.listdir(item_path) if f.lower().endswith(".adf"))
+                    if adf_files:
+                        keys[adf_files[0]] = f"adf:{item}"
+        if os.path.isdir(self.context.iso_dir):
+            for subdir in sorted(os.listdir(self.context.iso_dir)):
+                subdir_path = os.path.join(self.context.iso_dir, subdir)
+                cue_files = [f for f in os.listdir(subdir_path) if f.lower().endswith(".cue")] if os.path.isdir(subdir_path) else []
+                if len(cue_files) == 1:
+                    keys[cue_files[0]] = f"iso:{subdir}"
+        for archive_name in keys:
+            self.catalog.add_archive(archive_name)
+
+        records = self.catalog.find(query) if query else list(self.catalog)
+        for record in records:
+            key = keys.get(record.archive_name)
+            status = "missing input" if key is None else "built" if key in self.manifest["outputs"] else "new"
+            overrides = [
+                label for label, config in (("whd", record.whd_config), ("uae", record.uae_config),
+                                            ("retroarch", record.retroarch_config), ("p2k", record.p2k_config))
+                if config
+            ]
+            print(f"{status:<13} {key or record.archive_name}  {record.display_name()}"
+                  f"  [{record.format or '-'}/{record.hardware or '-'}]"
+                  f"  emulator={record.emulator or 'default'}  overrides={','.join(overrides) or 'none'}")
+        print(f"[INFO] {len(records)} games listed.")
+
+    def build_whdload(self):
+        """Extract, scan and place the WHDLoad games."""
+        system_base_fingerprint = hash_tree(self.context, self.manifest, self.context.system_base_dir)
+        if self.pipeline:
+            run_pipeline(self.context, self.catalog, self.manifest, system_base_fingerprint, self.jobs, self.stream, self.link_mode)
+        else:
+            dir_to_archive_map = extract_lha_archives(self.context, self.manifest, self.jobs, self.stream)
+            save_manifest(self.context, self.manifest)
+            scan_results = run_scan_slaves(self.context, self.manifest, self.jobs)
+            process_database(self.context, scan_results, dir_to_archive_map, self.catalog, self.manifest, system_base_fingerprint, self.stream, self.link_mode)
+        save_manifest(self.context, self.manifest)
+        if os.path.exists(self.context.staging_dir):
+            shutil.rmtree(self.context.staging_dir)  # Games without a database entry are left behind in streaming mode
+
+    def build_adf(self):
+        process_adf_files(self.context, self.catalog, self.manifest, self.jobs, self.link_mode, self.verify)
+        save_manifest(self.context, self.manifest)
+
+    def build_iso(self):
+        process_iso_files(self.context, self.catalog, self.manifest, self.jobs, self.link_mode, self.verify, self.chd)
+        save_manifest(self.context, self.manifest)
+
+    def write_uae_files(self, games=None):
+        """Regenerate the .uae/.uae.p2k.cfg files of placed games whose overrides changed."""
+        regenerated = 0
+        for key, entry in sorted(self.manifest["outputs"].items()):
+            game = entry.get("game")
+            if not game:
+                continue  # Built before game details were recorded; the next data build records them
+            if not is_selected_game(games, game["archive"], self.catalog.get(game["archive"]), game["name"]):
+                continue
+            if not os.path.isdir(os.path.join(self.context.output_dir, entry["dir"])):
+                print(f"[WARN] Skipping {key}: game directory {entry['dir']} is missing, rebuild its data")
+                continue
+            start = time.perf_counter()
+            if write_game_config(self.context, self.manifest, key, game, self.catalog, entry["data"], force=games is not None):
+                regenerated += 1
+                self.context.stats.add_game_time(key, time.perf_counter() - start)
+        save_manifest(self.context, self.manifest)
+        print(f"[INFO] Regenerated the config files of {regenerated} games.")
+
+    def write_configs(self, games=None):
+        config_files = write_retroarch_overrides(self.context, self.catalog, games)
+        config_files += write_puae_core_options(self.context, self.manifest, self.catalog, games)
+        record_config_outputs(self.context, self.manifest, config_files, games is None)
+        save_manifest(self.context, self.manifest)
+
+    def write_gamelists(self):
+        write_gamelists(self.context, self.manifest, self.catalog)
+
+    def watch(self, deploy_option=None):
+        """
+        Rebuild what is affected by changes to the inputs until interrupted.
+
+        Changed archives, kickstarts or system_base files rerun the (incremental) WHDLoad phase,
+        changed ADFs or ISOs their phase. A changed games.csv is diffed row by row against the
+        previous overrides and only the config files of the changed games are rewritten.
+        The gamelists are refreshed after every rebuild.
+
+        Args:
+            deploy_option (str, optional): Run a delta deploy with this option (all, uae or config) after each rebuild.
+        """
+        triggers = [
+            (self.context.lha_dir, "whdload"),
+            (self.context.kickstart_dir, "whdload"),
+            (self.context.system_base_dir, "whdload"),
+            (self.context.adf_dir, "adf"),
+            (self.context.iso_dir, "iso"),
+            (self.context.games_csv, None),
+            (self.context.config_master_dir, None),  # Only deployed
+        ]
+        steps = {"whdload": self.build_whdload, "adf": self.build_adf, "iso": self.build_iso}
+        try:
+            for changed in debounced_changes([path for path, phase in triggers]):
+                start = time.perf_counter()
+                self.context.stats = BuildStats()
+                phases = {
+                    phase for path, phase in triggers
+                    if phase and any(c == path or c.startswith(path + os.sep) for c in changed)
+                }
+                affected = set()
+                if self.context.games_csv in changed:
+                    previous_catalog = self.catalog
+                    self.catalog = load_game_catalog(self.context, self.variant_emulators)
+                    report_override_problems(self.context, validate_overrides(self.context, self.catalog))
+                    affected = diff_game_overrides(previous_catalog, self.catalog)
+                    for archive_name in affected:
+                        previous = previous_catalog.get(archive_name)
+                        if previous.whd_config != self.catalog.get(archive_name).whd_config:
+                            phases.add("whdload")  # A kickstart override changes the game directory
+                        if previous.retroarch_config:
+                            remove_output(self.context, os.path.relpath(retroarch_config_path(self.context, previous), self.context.output_dir))
+                    print(f"[INFO] games.csv changed for {len(affected)} games")
+
+                for phase in DATA_PHASES:
+                    if phase in phases:
+                        with self.context.stats.phase(phase):
+                            steps[phase]()
+                if affected:
+                    with self.context.stats.phase("uae"):
+                        self.write_uae_files(affected)
+                    with self.context.stats.phase("config"):
+                        self.write_configs(affected)
+                with self.context.stats.phase("gamelist"):
+                    self.write_gamelists()  # Also picks up Notes and Codes edits
+                print(f"[INFO] Rebuilt after {len(changed)} changed files in {time.perf_counter() - start:.2f}s")
+                if deploy_option:
+                    run_deploy(deploy_option)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+
+    def run(self, phases=BUILD_PHASES, games=None, clean=False, resume=False):
+        """
+        Run the selected phases in build order.
+
+        Args:
+            phases (iterable): Names from BUILD_PHASES.
+            games (set, optional): Restrict the uae and config phases to these games (see is_selected_game).
+            clean (bool): Discard the build manifest and rebuild the game data from scratch.
+            resume (bool): Continue an interrupted build (see prepare).
+        """
+        self.context.stats = BuildStats()
+        self.prepare(phases, games, clean, resume)
+        steps = [
+            ("whdload", self.build_whdload),
+            ("adf", self.build_adf),
+            ("iso", self.build_iso),
+            ("uae", lambda: self.write_uae_files(games)),
+            ("config", lambda: self.write_configs(games)),
+            ("gamelist", self.write_gamelists),
+        ]
+        for name, step in steps:
+            if name in phases:
+                with self.context.stats.phase(name):
+                    step()
 
 # --- Main Execution ---
-print("Starting WHDLoad preparation script...")
-
-print("Clearing previous output directories...")
-clear_dir(DB_DIR)
-clear_dir(EXPAND_DIR)
-clear_dir(ROMS_DIR)
-clear_dir(CONFIG_DIR)  # Clear the config directory
-os.makedirs(DB_DIR, exist_ok=True)
-os.makedirs(AMIGA600_DIR, exist_ok=True)
-os.makedirs(AMIGA1200_DIR, exist_ok=True)
-os.makedirs(CD32_DIR, exist_ok=True)  # Create CD32 directory
-print("Output directories cleared and recreated.")
-
-dir_to_archive_map = extract_lha_archives()
-game_override_map = load_game_overrides()
-run_scan_slaves()
-process_database(dir_to_archive_map, game_override_map)
-process_adf_files(game_override_map)
-process_iso_files(game_override_map)
-
-# Write RetroArch overrides
-write_retroarch_overrides(game_override_map)
-
-print("Script finished.")
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description="Prepare WHDLoad, ADF and CD32 games for Recalbox.")
+    parser.add_argument("--clean", action="store_true", help="Discard the build manifest and rebuild everything from scratch")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted build from the last completed archive and game instead of discarding its progress")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1, help="Number of archives extracted, games scanned and ADF/ISO games staged concurrently (default: CPU count)")
+    parser.add_argument("--stream", action="store_true", help="Extract games next to roms/ and move them into place; only slave files are kept in expand/")
+    parser.add_argument("--pipeline", action="store_true", help="Extract, scan and place each WHDLoad game as soon as its archive is ready instead of phase by phase")
+    parser.add_argument("--link", choices=LINK_MODES, default="copy", help="Materialize system_base, kickstart, ADF and ISO files as copies, hardlinks or reflinks (default: copy)")
+    parser.add_argument("--verify", action="store_true", help="Read back every staged ADF and ISO file and compare its SHA-1 with the input")
+    parser.add_argument("--emulators", help=f"Comma-separated emulators ({', '.join(UAE_EMULATORS)}) every game also gets a .uae for, "
+                        "in <system>/<Emulator>/, pointing at the same game data and listed in gamelist.xml with that emulator")
+    parser.add_argument("--chd", action="store_true", help=f"Convert CD32 cue/bin sets to compressed CHD images with {CHDMAN} (cached in chd_cache/); "
+                        "only games whose Emulator is puae are converted, the others keep their cue/bin files")
+    parser.add_argument("--input", help="Directory holding games.csv and the lha, adf, iso, kickstart and system_base directories (default: script directory)")
+    parser.add_argument("--output", help="Directory receiving roms/, config/ and the build manifest and caches (default: script directory)")
+    parser.add_argument("--only", help=f"Comma-separated phases to run: {', '.join(BUILD_PHASES)} (default: all). "
+                        "uae regenerates .uae/.uae.p2k.cfg files and config RetroArch overrides without touching game data")
+    parser.add_argument("--games", help="Comma-separated archive or game names; restricts the uae and config phases (implies --only uae,config,gamelist)")
+    parser.add_argument("--report", help="Where to write the JSON build report (default: db/build_report.json)")
+    parser.add_argument("--strict", action="store_true", help="Stop before building if the games.csv overrides do not match uae_settings.csv")
+    parser.add_argument("--watch", action="store_true", help="After the build, keep watching the inputs and rebuild only what changed")
+    parser.add_argument("--deploy", choices=["all", "uae", "config"], help="Run a delta deploy after the build (and after each --watch rebuild)")
+    parser.add_argument("--list", nargs="?", const="", metavar="QUERY", help="List the games of games.csv and the inputs with their build status instead of building; "
+                        "QUERY restricts the list to an archive, game or directory name")
+    args = parser.parse_args()
+
+    games = {name.strip() for name in args.games.split(",") if name.strip()} if args.games else None
+    if args.only:
+        phases = [phase.strip() for phase in args.only.split(",")]
+        unknown = set(phases) - set(BUILD_PHASES)
+        if unknown:
+            parser.error(f"unknown phases: {', '.join(sorted(unknown))}")
+    else:
+        phases = ["uae", "config", "gamelist"] if games else list(BUILD_PHASES)
+    if games and set(phases) & set(DATA_PHASES):
+        parser.error("--games only applies to the uae and config phases")
+    if args.clean and args.only:
+        parser.error("--clean rebuilds everything and cannot be combined with --only")
+    if args.clean and args.resume:
+        parser.error("--clean and --resume cannot be combined")
+    variant_emulators = [name.strip().lower() for name in args.emulators.split(",") if name.strip()] if args.emulators else []
+    unknown = set(variant_emulators) - set(UAE_EMULATORS)
+    if unknown:
+        parser.error(f"unknown emulators: {', '.join(sorted(unknown))}")
+    if args.chd and not shutil.which(CHDMAN):
+        parser.error(f"--chd needs {CHDMAN} (from the MAME tools) on the PATH")
+    if args.deploy and args.output and os.path.abspath(args.output) != BASE_DIR:
+        parser.error("--deploy deploys the outputs in the script directory and cannot be combined with --output")
+
+    if args.list is not None:
+        Builder(args.input, args.output).list_games(args.list or None)
+        return
+
+    print("Starting WHDLoad preparation script...")
+    builder = Builder(args.input, args.output, args.jobs, args.stream, args.pipeline, args.link, args.strict, args.verify, args.chd, variant_emulators)
+    context = builder.context
+    if not set(phases) & set(DATA_PHASES) and not os.path.exists(context.manifest_file):
+        sys.exit(f"[ERROR] No previous build found in {context.output_dir}, run a full build first")
+    builder.run(phases, games, args.clean, args.resume)
+
+    report_file = args.report or context.build_report_file
+    context.stats.write_report(report_file)
+    context.stats.print_summary()
+    print(f"[INFO] Build report written to {report_file}")
+    if args.deploy:
+        run_deploy(args.deploy)
+    if args.watch:
+        builder.watch(args.deploy)
+    print("Script finished.")
+
+if __name__ == "__main__":
+    main()